@@ -0,0 +1,68 @@
+"""Measures the time to the first processed sentence, with and without a
+bundle (see Wrapper.save_bundle()).
+
+Usage: python benchmark_bundle.py config_file bundle_file sentences_file
+- config_file: a pymachine config with a [machine] section, e.g.
+  conf/machine.cfg. External (Longman) definitions are included if
+  ext_definitions is set. Its bundle option, if any, is ignored.
+- bundle_file: where the bundle is saved.
+- sentences_file: the first sentence is processed, see
+  benchmark_worker_pool.py for the format.
+
+The bundle is built from the config first. Each start runs in a new process,
+so that neither of them finds the symbols, the definitions or the lexicon of
+the other in memory (the files may well be in the page cache, though).
+"""
+
+from ConfigParser import ConfigParser
+import logging
+import multiprocessing
+import sys
+import time
+
+from pymachine.wrapper import Wrapper
+
+from benchmark_worker_pool import read_sentences
+
+def timed_start(cfg, include_ext, sentence, results):
+    """Starts a wrapper from @p cfg and processes @p sentence; puts the
+    times they took to @p results."""
+    start = time.time()
+    wrapper = Wrapper(cfg, batch=True, include_ext=include_ext)
+    loaded = time.time()
+    wrapper.process(sentence)
+    results.put((loaded - start, time.time() - loaded))
+
+def measure(cfg, include_ext, sentence):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=timed_start, args=(cfg, include_ext, sentence, results))
+    process.start()
+    times = results.get()
+    process.join()
+    return times
+
+def main():
+    logging.basicConfig(
+        level=logging.WARNING,
+        format="%(asctime)s : " +
+        "%(module)s (%(lineno)s) - %(levelname)s - %(message)s")
+    cfg = ConfigParser()
+    cfg.read(sys.argv[1])
+    cfg.remove_option('machine', 'bundle')
+    bundle_fn = sys.argv[2]
+    sentence = read_sentences(sys.argv[3])[0]
+    include_ext = cfg.has_option('machine', 'ext_definitions')
+
+    Wrapper(cfg, batch=True, include_ext=include_ext).save_bundle(bundle_fn)
+
+    print "start      load  first sentence   total"
+    for label in ('config', 'bundle'):
+        if label == 'bundle':
+            cfg.set('machine', 'bundle', bundle_fn)
+        load, first = measure(cfg, include_ext, sentence)
+        print "{0:6}  {1:6.3f}s  {2:13.3f}s  {3:5.3f}s".format(
+            label, load, first, load + first)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Compares clone_definitions() with copy.deepcopy() on a definition set.
+
+Usage: python benchmark_clone.py config_file [repeat]
+- config_file: a pymachine config with a [machine] section, e.g.
+  conf/machine.cfg. External (Longman) definitions are included if
+  ext_definitions is set.
+- repeat: the number of copies made with each method (default: 3).
+
+This is the copy Wrapper.reset_lexicon() makes before building the lexicon.
+"""
+
+from ConfigParser import ConfigParser
+from copy import deepcopy
+import logging
+import sys
+import time
+
+from pymachine.clone import clone_definitions, clone_machines
+from pymachine.wrapper import Wrapper
+
+def best_time(function, arg, repeat):
+    """The fastest of @p repeat runs of @p function(@p arg), in seconds."""
+    times = []
+    for i in xrange(repeat):
+        start = time.time()
+        function(arg)
+        times.append(time.time() - start)
+    return min(times)
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s : " +
+        "%(module)s (%(lineno)s) - %(levelname)s - %(message)s")
+    cfg = ConfigParser()
+    cfg.read(sys.argv[1])
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    include_ext = cfg.has_option('machine', 'ext_definitions')
+
+    wrapper = Wrapper(cfg, batch=True, include_ext=include_ext)
+    definitions = wrapper.definitions
+    num_machines = len(clone_machines(
+        m for machines in definitions.itervalues() for m in machines))
+
+    # deepcopy recurses along the definition graph
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10 * num_machines))
+    deepcopy_time = best_time(deepcopy, definitions, repeat)
+    clone_time = best_time(clone_definitions, definitions, repeat)
+
+    print "definitions:  {0}".format(len(definitions))
+    print "machines:     {0}".format(num_machines)
+    print "deepcopy:     {0:.3f} s".format(deepcopy_time)
+    print "clone:        {0:.3f} s".format(clone_time)
+    print "speedup:      {0:.1f}x".format(deepcopy_time / max(clone_time, 1e-9))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Compares the definition parser with the pyparsing grammar it replaces.
+
+Usage: python benchmark_definition_parser.py definition_file [lines]
+- definition_file: a 4lang definition file (e.g. 4lang); only its definition
+  column is parsed.
+- lines: parse only the first this many lines.
+
+Both parsers parse every definition; the throughput of each is reported in
+lines per second, with the number of definitions they parse differently
+(which should be 0). Syntax errors count as results.
+"""
+
+import sys
+import time
+
+import pyparsing
+
+from pymachine.definition_grammar import DefinitionSyntaxError
+from pymachine.definition_parser import DefinitionParser
+
+def read_definitions(file_name, max_lines=None):
+    """The definition column of the lines of @p file_name."""
+    definitions = []
+    for line in open(file_name):
+        fields = line.strip('\n').split('\t')
+        if len(fields) > 7:
+            definitions.append(fields[7])
+        if len(definitions) == max_lines:
+            break
+    return definitions
+
+def timed_parse(parse, error_class, definitions):
+    """Parses @p definitions with @p parse. Returns the time it took and
+    the results (@c None for syntax errors)."""
+    results = []
+    start = time.time()
+    for definition in definitions:
+        try:
+            results.append(parse(definition))
+        except error_class:
+            results.append(None)
+    return time.time() - start, results
+
+def main():
+    definitions = read_definitions(
+        sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else None)
+    dp = DefinitionParser({})
+    dp.init_parser()
+
+    print "definitions: {0}".format(len(definitions))
+    print "parser      time      lines/s  errors"
+    baseline = None
+    for label, parse, error_class in (
+            ('pyparsing', dp.parse_pyparsing, pyparsing.ParseException),
+            ('new', dp.parse, DefinitionSyntaxError)):
+        elapsed, results = timed_parse(parse, error_class, definitions)
+        print "{0:9}  {1:7.3f}s  {2:9.1f}  {3:6d}".format(
+            label, elapsed, len(definitions) / max(elapsed, 1e-9),
+            results.count(None))
+        if baseline is None:
+            baseline = elapsed, results
+    print "speedup:     {0:.1f}x".format(baseline[0] / max(elapsed, 1e-9))
+    print "different:   {0}".format(
+        sum(1 for old, new in zip(baseline[1], results) if old != new))
+
+if __name__ == "__main__":
+    main()
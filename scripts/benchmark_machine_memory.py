@@ -0,0 +1,92 @@
+"""Reports the memory footprint of the machines in a full static graph.
+
+Usage: python benchmark_machine_memory.py config_file
+- config_file: a pymachine config with a [machine] section, e.g.
+  conf/machine.cfg. External (Longman) definitions are included if
+  ext_definitions is set.
+
+Only the objects owned by the machines are counted (the machine itself, its
+partitions, its parent links and its control), shared printnames and the
+shared empty partition are not. The bytes per machine that the shared empty
+partitions save (compared with an empty Partition of its own in each
+unused place) are reported as well.
+"""
+
+from ConfigParser import ConfigParser
+import logging
+import resource
+import sys
+
+from pymachine.machine import Partition, _empty_partition
+from pymachine.wrapper import Wrapper
+
+def max_rss():
+    """Peak resident set size of the process in bytes (Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def static_machines(lexicon):
+    """All machines reachable from the static graph."""
+    machines = set()
+    for static_machines in lexicon.static.itervalues():
+        for machine in static_machines:
+            if machine not in machines:
+                machines |= machine.unique_machines_in_tree()
+    return machines
+
+def object_size(obj):
+    """Size of @p obj including its __dict__, if it has one."""
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+def machine_sizes(machine):
+    """Returns the sizes of the parts of @p machine in a dict."""
+    sizes = {
+        'machine': object_size(machine),
+        'partitions': sys.getsizeof(machine.partitions) + sum(
+            sys.getsizeof(p) for p in machine.partitions
+            if p is not _empty_partition),
+        'parents': sys.getsizeof(machine.parents) + sum(
+            sys.getsizeof(link) for link in machine.parents),
+        'control': 0}
+    if machine.control is not None:
+        sizes['control'] = object_size(machine.control)
+    return sizes
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s : " +
+        "%(module)s (%(lineno)s) - %(levelname)s - %(message)s")
+    cfg = ConfigParser()
+    cfg.read(sys.argv[1])
+    include_ext = cfg.has_option('machine', 'ext_definitions')
+
+    rss_before = max_rss()
+    wrapper = Wrapper(cfg, batch=True, include_ext=include_ext)
+    rss_after = max_rss()
+
+    machines = static_machines(wrapper.lexicon)
+    totals = {}
+    shared = 0
+    for machine in machines:
+        for part, size in machine_sizes(machine).iteritems():
+            totals[part] = totals.get(part, 0) + size
+        shared += sum(1 for p in machine.partitions if p is _empty_partition)
+    total = sum(totals.itervalues())
+    num = max(len(machines), 1)
+
+    print "static names:     {0}".format(len(wrapper.lexicon.static))
+    print "machines:         {0}".format(len(machines))
+    for part in ('machine', 'partitions', 'parents', 'control'):
+        print "{0:<17} {1:.1f} bytes/machine".format(
+            part + ':', float(totals.get(part, 0)) / num)
+    print "total:            {0:.1f} bytes/machine ({1} MB)".format(
+        float(total) / num, total / 2 ** 20)
+    print "shared empty partitions: {0} ({1:.1f} bytes/machine saved)".format(
+        shared, float(shared * sys.getsizeof(Partition())) / num)
+    print "peak RSS growth:  {0} MB".format((rss_after - rss_before) / 2 ** 20)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Compares DefinitionParser.unify() with unify_by_keys(), which it replaces.
+
+Usage: python benchmark_unify.py definition_file [definitions]
+- definition_file: a 4lang definition file (e.g. 4lang).
+- definitions: the number of the longest definitions to unify (100 by
+  default).
+
+The definitions are parsed into machines once for each method, without
+unification; only the unification is timed. The time of each method is
+reported, with the number of definitions they unify differently (which
+should be 0).
+"""
+
+import sys
+import time
+
+from pymachine.definition_grammar import DefinitionSyntaxError
+from pymachine.definition_parser import DefinitionParser
+
+class UnunifiedParser(DefinitionParser):
+    """Leaves the machines it parses as they are."""
+    def unify(self, machine):
+        pass
+
+def read_longest(file_name, count):
+    """The @p count lines of @p file_name with the longest definitions."""
+    lines = []
+    for line in open(file_name):
+        line = line.strip('\n')
+        fields = line.split('\t')
+        if len(fields) == 9 and fields[7]:
+            lines.append((len(fields[7]), line))
+    lines.sort(key=lambda (length, line): -length)
+    return [line for _, line in lines[:count]]
+
+def parse(lines):
+    """The machines of the definitions in @p lines, not unified."""
+    dp = UnunifiedParser({})
+    machines = []
+    for line in lines:
+        try:
+            machines.append(dp.parse_into_machines(line))
+        except DefinitionSyntaxError:
+            pass
+    return machines
+
+def structure(machine):
+    """The printnames and partitions of the machines of the definition
+    @p machine, the machines numbered in breadth-first order."""
+    index = {machine: 0}
+    machines = [machine]
+    for m in machines:
+        for partition in m.partitions:
+            for m_ in partition:
+                if m_ not in index:
+                    index[m_] = len(machines)
+                    machines.append(m_)
+    return [(m.printname_, [[index[m_] for m_ in partition]
+                            for partition in m.partitions])
+            for m in machines]
+
+def main():
+    lines = read_longest(
+        sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 100)
+    dp = DefinitionParser({})
+
+    print "definitions: {0}".format(len(lines))
+    print "method           time      defs/s"
+    baseline = None
+    for label, unify in (('unify_by_keys', dp.unify_by_keys),
+                         ('unify', dp.unify)):
+        machines = parse(lines)
+        start = time.time()
+        for machine in machines:
+            unify(machine)
+        elapsed = time.time() - start
+        print "{0:13}  {1:7.3f}s  {2:10.1f}".format(
+            label, elapsed, len(machines) / max(elapsed, 1e-9))
+        results = [structure(machine) for machine in machines]
+        if baseline is None:
+            baseline = elapsed, results
+    print "speedup:       {0:.1f}x".format(baseline[0] / max(elapsed, 1e-9))
+    print "different:     {0}".format(
+        sum(1 for old, new in zip(baseline[1], results) if old != new))
+
+if __name__ == "__main__":
+    main()
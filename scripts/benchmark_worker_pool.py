@@ -0,0 +1,66 @@
+"""Measures the throughput of a WorkerPool with 1..N worker processes.
+
+Usage: python benchmark_worker_pool.py config_file sentences_file [workers]
+- config_file: a pymachine config with a [machine] section, e.g.
+  conf/machine.cfg. External (Longman) definitions are included if
+  ext_definitions is set.
+- sentences_file: one sentence per line, as the space-separated analyses of
+  its tokens (e.g. "the/ART snake/NOUN eat/VERB<PAST> the/ART elephant/NOUN").
+- workers: the largest number of workers tried (default: the number of CPUs).
+
+The lexicon is built and frozen once; every pool forks its workers from it.
+The time it takes to start the workers is reported separately.
+"""
+
+from ConfigParser import ConfigParser
+import logging
+import multiprocessing
+import sys
+import time
+
+from pymachine.worker_pool import WorkerPool
+from pymachine.wrapper import Wrapper
+
+def read_sentences(file_name):
+    """The sentences in @p file_name in the format of SentenceParser."""
+    sentences = []
+    for line in open(file_name):
+        analyses = line.decode('utf-8').split()
+        if analyses:
+            sentences.append([(analysis.split('/')[0], analysis)
+                              for analysis in analyses])
+    return sentences
+
+def main():
+    logging.basicConfig(
+        level=logging.WARNING,
+        format="%(asctime)s : " +
+        "%(module)s (%(lineno)s) - %(levelname)s - %(message)s")
+    cfg = ConfigParser()
+    cfg.read(sys.argv[1])
+    sentences = read_sentences(sys.argv[2])
+    max_workers = (int(sys.argv[3]) if len(sys.argv) > 3
+                   else multiprocessing.cpu_count())
+    include_ext = cfg.has_option('machine', 'ext_definitions')
+
+    wrapper = Wrapper(cfg, batch=True, include_ext=include_ext)
+    wrapper.lexicon.freeze()
+
+    print "sentences:    {0}".format(len(sentences))
+    print "workers  startup  sentences/s  speedup"
+    base = None
+    for workers in xrange(1, max_workers + 1):
+        start = time.time()
+        pool = WorkerPool(wrapper, workers)
+        startup = time.time() - start
+        start = time.time()
+        pool.map(sentences)
+        throughput = len(sentences) / max(time.time() - start, 1e-9)
+        pool.close()
+        if base is None:
+            base = throughput
+        print "{0:7d}  {1:6.3f}s  {2:11.1f}  {3:6.2f}x".format(
+            workers, startup, throughput, throughput / base)
+
+if __name__ == "__main__":
+    main()
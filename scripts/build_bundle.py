@@ -0,0 +1,31 @@
+"""Builds a Wrapper and saves it as a bundle (see Wrapper.save_bundle()).
+
+Usage: python build_bundle.py config_file bundle_file
+- config_file: a pymachine config with a [machine] section, e.g.
+  conf/machine.cfg. External (Longman) definitions are included if
+  ext_definitions is set. Its bundle option, if any, is ignored.
+- bundle_file: the snapshot to write; set it as the bundle option of the
+  [machine] section to start the wrapper from it.
+"""
+
+from ConfigParser import ConfigParser
+import logging
+import sys
+
+from pymachine.wrapper import Wrapper
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s : " +
+        "%(module)s (%(lineno)s) - %(levelname)s - %(message)s")
+    cfg = ConfigParser()
+    cfg.read(sys.argv[1])
+    cfg.remove_option('machine', 'bundle')
+    include_ext = cfg.has_option('machine', 'ext_definitions')
+    wrapper = Wrapper(cfg, batch=True, include_ext=include_ext)
+    logging.info('saving bundle to {}...'.format(sys.argv[2]))
+    wrapper.save_bundle(sys.argv[2])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""The active state of a single sentence.
+
+Everything the processing of a sentence changes (the active machines, the
+bookkeeping of activate(), the AVM constructions woken up, the constructions
+added for the words of the sentence) is kept in an ActiveContext, not in the
+Lexicon. The methods of Lexicon that work on the active graph (add_active(),
+expand(), unify_recursively(), activate(), ...) take the context as an
+argument; if it is omitted, they use the lexicon's own context (@c
+Lexicon.context), which is what clear_active() resets.
+
+Processing a sentence does not change the static graph, so several threads
+can process sentences with the same lexicon at the same time, each in its own
+context (see Lexicon.new_context()). The exceptions are the definitions added
+on first use (Lexicon.load_definitions()) and the unknown words get_machine()
+adds to the static graph; these, and the expansion plan cache, are guarded by
+a lock. To keep the static graph read-only, load all definitions (e.g. with
+Lexicon.freeze()) before sharing the lexicon."""
+
+from collections import OrderedDict
+import copy
+
+class ActiveStore(object):
+    """
+    The active machines of a context, by printname. Besides the machines of
+    each printname, it keeps the first machine of each printname (the one
+    unify_recursively() and the others use) in the order they became active,
+    and the expanded and unexpanded machines, also in order; so none of these
+    has to be collected by scanning the store.
+
+    A store is not reset, but replaced with a new one (with the context, see
+    Lexicon.clear_active()), which costs the same regardless of how many
+    machines it had. The active machines themselves are not reused: they are
+    returned to the caller (see Wrapper.process()).
+    """
+
+    def __init__(self):
+        # printname -> {active machine: is it expanded?}
+        self.machines = {}
+        # printname -> its first active machine
+        self.firsts = {}
+        # the first machines, in the order they became active
+        self.order = []
+        self._order_view = ()
+        # the expanded and unexpanded machines (as ordered sets)
+        self.expanded = OrderedDict()
+        self.unexpanded = OrderedDict()
+
+    def __contains__(self, printname):
+        return printname in self.machines
+
+    def __len__(self):
+        """The number of active printnames."""
+        return len(self.machines)
+
+    def __getitem__(self, printname):
+        """The {active machine: is it expanded?} dict of @p printname. Use
+        add() to change it."""
+        return self.machines[printname]
+
+    def __repr__(self):
+        return repr(self.machines)
+
+    def __iter__(self):
+        return iter(self.machines)
+
+    def keys(self):
+        return self.machines.keys()
+
+    def items(self):
+        return self.machines.items()
+
+    def iteritems(self):
+        return self.machines.iteritems()
+
+    def values(self):
+        return self.machines.values()
+
+    def add(self, machine, expanded=False):
+        """
+        Adds @p machine to the store, or marks it expanded if @p expanded is
+        @c True. Returns whether its printname was not active before.
+        """
+        printname = machine.printname()
+        machines = self.machines.get(printname)
+        new = machines is None
+        if new:
+            machines = self.machines[printname] = {}
+            self.firsts[printname] = machine
+            self.order.append(machine)
+        else:
+            expanded = expanded or machines.get(machine, False)
+        machines[machine] = expanded
+        if expanded:
+            self.unexpanded.pop(machine, None)
+            self.expanded[machine] = None
+        else:
+            self.unexpanded[machine] = None
+        return new
+
+    def first(self, printname):
+        """The first active machine of @p printname."""
+        return self.firsts[printname]
+
+    def first_machines(self):
+        """The first machine of each printname, in the order they became
+        active, as a tuple (which is only rebuilt after a change)."""
+        if len(self._order_view) != len(self.order):
+            self._order_view = tuple(self.order)
+        return self._order_view
+
+class ActiveContext(object):
+    """The per-sentence state of processing with @p lexicon."""
+
+    def __init__(self, lexicon):
+        self.lexicon = lexicon
+        # the active machines
+        self.active = ActiveStore()
+        # the keys of the machines to be returned by activate() (see the
+        # activation index in Lexicon.__init__())
+        self.activation_queue = lexicon.activation_keys()
+        # The constructions added for this sentence only, e.g. the woken AVM
+        # constructions
+        self.added_constructions = []
+        # AVM name -> the copy of its construction woken up in this context
+        self.avm_constructions = {}
+
+    @property
+    def constructions(self):
+        """The constructions of the lexicon and of the context."""
+        return self.lexicon.constructions + self.added_constructions
+
+    def add_construction(self, construction):
+        """Adds @p construction for this context (sentence) only."""
+        self.added_constructions.append(construction)
+
+    def wake_avm_construction(self, avm_construction):
+        """
+        Adds a copy of @p avm_construction (with an empty AVM) to the
+        constructions, unless it has already been woken up. The AVM is filled
+        in this context, so the construction itself is never modified.
+        """
+        name = avm_construction.avm.name
+        if name not in self.avm_constructions:
+            woken = copy.copy(avm_construction)
+            woken.avm = avm_construction.avm.copy()
+            self.avm_constructions[name] = woken
+            self.added_constructions.append(woken)
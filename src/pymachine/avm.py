@@ -92,6 +92,15 @@ class AVM(object):
             datatype, required, default_value, _ = self.__data[key]
             self.__data[key] = [datatype, required, default_value, default_value]
 
+    def copy(self):
+        """Returns a cleared AVM with the same attributes."""
+        avm = AVM(self.name)
+        for key, attribute in self.__data.iteritems():
+            avm.add_attribute(key, *attribute[:AVM.VALUE])
+        if self.bool_str is not None:
+            avm.set_satisfaction(self.bool_str)
+        return avm
+
     def __getitem__(self, key):
         """Gets the current value of an attribute."""
         return self.__data[key][AVM.VALUE]
@@ -0,0 +1,81 @@
+"""Copying machine graphs without copy.deepcopy.
+
+copy.deepcopy() copies a machine through the generic memo machinery: every
+partition list, parent link tuple and control goes through a dispatch and a
+memo lookup, and Machine.__deepcopy__ rebuilds the parent links with one
+add_parent_link() call per edge. clone_machines() does the same job in a
+single pass over the graph:
+
+1. the machines connected to the roots are collected, and an empty copy is
+   allocated for each of them (without calling __init__, so no printname is
+   looked up again);
+2. the partitions and the parent links of each copy are built in bulk, by
+   mapping the lists of the original through the id map;
+3. the controls are recreated for the copies, only their non-machine
+   attributes (if any) are deep-copied.
+
+The result is the same graph deepcopy() would build: all machines reachable
+through children or parents are copied, and machines shared by several roots
+are copied only once."""
+
+import copy
+
+from pymachine.machine import Partition, _empty_partition, _no_parents
+from pymachine.traversal import traverse
+
+def clone_machines(roots):
+    """
+    Copies the graph of @p roots.
+    @return a dict that maps every machine connected to @p roots (through
+            children or parents) to its copy.
+    """
+    machines = [m for m, _ in traverse(roots, follow_parents=True)]
+    copies = dict.fromkeys(machines)
+    for machine in machines:
+        cls = machine.__class__
+        new_machine = cls.__new__(cls)
+        new_machine._symbol = machine._symbol
+        new_machine._fingerprints = None
+        copies[machine] = new_machine
+
+    memo = None
+    for machine in machines:
+        new_machine = copies[machine]
+        new_machine.partitions = [
+            Partition(copies[m] for m in part) if part else _empty_partition
+            for part in machine.partitions]
+        parents = machine.parents
+        if parents is _no_parents:
+            new_machine.parents = _no_parents
+        elif type(parents) is set:
+            new_machine.parents = set((copies[m], i) for m, i in parents)
+        else:
+            new_machine.parents = [(copies[m], i) for m, i in parents]
+
+        control = machine.control
+        if control is None:
+            new_machine.control = None
+            continue
+        # the state of a control is its machine and its __dict__, see
+        # Control.__getstate__
+        control_cls = control.__class__
+        new_control = control_cls.__new__(control_cls)
+        new_control.machine = new_machine
+        if getattr(control, '__dict__', None):
+            # e.g. the kr dict of a KRPosControl; it may reference machines
+            # as well, so the memo starts out with the copies
+            if memo is None:
+                memo = dict((id(m), copies[m]) for m in machines)
+            new_control.__dict__ = copy.deepcopy(control.__dict__, memo)
+        new_machine.control = new_control
+    return copies
+
+def clone_definitions(definitions):
+    """
+    Copies a definition dict (printname -> set of machines, as returned by
+    definition_parser.read()). Equivalent to deepcopy(definitions).
+    """
+    copies = clone_machines(
+        m for machines in definitions.itervalues() for m in machines)
+    return dict((printname, set(copies[m] for m in machines))
+                for printname, machines in definitions.iteritems())
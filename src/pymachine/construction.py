@@ -137,9 +137,14 @@ class VerbConstruction(Construction):
     Hence, it is enough to maintain a single Machine as a placeholder for
     this element.
     """
-    def __init__(self, name, lexicon, supp_dict, max_depth=3):
+    def __init__(self, name, lexicon, supp_dict, max_depth=3, context=None):
+        """
+        @param context the active context of the sentence (see
+                       active_context.py); the lexicon's own, if @c None.
+        """
         self.name = name
         self.lexicon = lexicon
+        self.context = context
         self.supp_dict = supp_dict
         self.max_depth = max_depth
         self.matchers = {}
@@ -176,7 +181,7 @@ class VerbConstruction(Construction):
 
         # first transition
         control.add_transition(KRPosMatcher("VERB"), [ExpandOperator(
-            self.lexicon, self.working_area)], "0", "1")
+            self.lexicon, self.working_area, self.context)], "0", "1")
 
         # count every transition as an increase in number of state
         for path in permutations(arguments):
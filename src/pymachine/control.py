@@ -6,9 +6,24 @@ import logging
 from hunmisc.utils.readkr import kr_to_dictionary as kr2dict
 
 class Control(object):
+    # Every machine in the lexicon has its own control, so the common ones
+    # are kept small, see Machine.__slots__
+    __slots__ = ('machine',)
+
     def __init__(self, machine=None):
         self.set_machine(machine)
 
+    def __getstate__(self):
+        return self.machine, getattr(self, '__dict__', None)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # pickled before Control had __slots__
+            state = state.pop('machine', None), state
+        self.machine, attrs = state
+        if attrs:
+            self.__dict__.update(attrs)
+
     def set_machine(self, machine):
         """Sets the machine the control controls."""
         from pymachine.machine import Machine
@@ -55,6 +70,7 @@ class KRPosControl(Control):
 class ConceptControl(Control):
     """object controlling machines that were not in the sentence, but
     in the main lexicon"""
+    __slots__ = ()
 
 class PluginControl(Control):
     """Control for plugin machines."""
@@ -0,0 +1,334 @@
+"""A recursive descent parser for the 4lang definition grammar.
+
+DefinitionParser.init_parser() describes the grammar of definitions with
+pyparsing. Most of its rules combine their alternatives with Or (^), which
+parses every alternative at every position and keeps the longest match (the
+first one of the longest ones); nothing is remembered between attempts, so
+the same subexpressions are parsed again and again, and parsing the
+definition files is the slowest part of building the lexicon from scratch.
+
+parse_definition() parses the same grammar by hand:
+
+    D  -> E | E , D
+    E  -> UE | BE | U ( E ) | < E >
+    BE -> A B | B A | A B A | B [ E ; E ]
+    UE -> U | U [ D ] | U ( U )
+    A  -> UE | [ D ] | < A > | '
+    U  -> unary | =DEEP_CASE | $LANGSPEC | #AVM | @external | < U >
+    B  -> BINARY | =REL
+
+and returns the same nested lists as pyparsing (see DefinitionParser.parse()).
+The alternatives are chosen the same way, longest match first, and no rule
+backtracks into its parts once they have matched. So each rule has a single
+result at each position, which is memoized: every rule is parsed at most once
+at every position.
+
+On a syntax error, a DefinitionSyntaxError is raised with the position the
+parse got the farthest to, and the tokens that were expected there.
+definition_parser.iter_definitions() reports the lines with syntax errors
+as DefinitionError records."""
+
+import re
+
+_space = re.compile(r'[ \t\n\r]*')
+
+# Combine(Optional('-') + Word(lowercase + '_' + nums) +
+#         Optional(id_sep + Word(nums))), and the like
+_unary_word = re.compile(r'-?[a-z_0-9]+(?:/[0-9]+)?')
+_binary_word = re.compile(r'[A-Z_0-9]+(?:/[0-9]+)?')
+_deep_case = re.compile(r'=[ \t\n\r]*([A-Z]+)')
+_langspec = re.compile(r'\$[ \t\n\r]*([A-Z_]+)')
+_avm = re.compile(r'#[ \t\n\r]*([A-Za-z_]+)')
+_enc = re.compile(r'@[ \t\n\r]*([A-Za-z0-9_\-]+)')
+_rel = re.compile(r'=[ \t\n\r]*REL')
+
+class DefinitionSyntaxError(Exception):
+    """
+    A syntax error in the definition @p text.
+    @param pos the position the parse got the farthest to.
+    @param expected the tokens expected there.
+    """
+    def __init__(self, text, pos, expected):
+        Exception.__init__(
+            self, 'expected {0} at char {1}:\n{2}\n{3}^'.format(
+                ' or '.join(sorted(expected)), pos, text, ' ' * pos))
+        self.text = text
+        self.pos = pos
+        self.expected = expected
+
+    def __reduce__(self):
+        return DefinitionSyntaxError, (self.text, self.pos, self.expected)
+
+class DefinitionError(object):
+    """
+    A line of a definition file with a syntax error in its definition.
+    @param line_no the number of the line (from 1).
+    @param error the DefinitionSyntaxError.
+    """
+    __slots__ = ('line_no', 'line', 'error')
+
+    def __init__(self, line_no, line, error):
+        self.line_no = line_no
+        self.line = line
+        self.error = error
+
+    def __repr__(self):
+        return 'DefinitionError({0!r}, {1!r}, {2!r})'.format(
+            self.line_no, self.line, self.error)
+
+    def __str__(self):
+        return 'line {0}: {1}'.format(self.line_no, self.error)
+
+def _longest(*alternatives):
+    """The longest of the (tree, end) @p alternatives (the first one of the
+    longest ones), or @c None if all of them are @c None."""
+    best = None
+    for alternative in alternatives:
+        if alternative is not None and (best is None or
+                                        alternative[1] > best[1]):
+            best = alternative
+    return best
+
+class _DefinitionParser(object):
+    """
+    Parses one definition. Each rule takes the position to start at
+    (before the whitespace), and returns the parse tree and the position
+    after it, or @c None if the rule does not match there.
+    """
+    def __init__(self, text):
+        self.text = text
+        self.memo = {}
+        self.error_pos = -1
+        self.expected = set()
+
+    def parse(self):
+        text = self.text
+        definition = self.definition(0)
+        if definition is not None:
+            end = _space.match(text, definition[1]).end()
+            if end == len(text):
+                return [definition[0]]
+            self.fail(end, 'end of definition')
+        raise DefinitionSyntaxError(text, self.error_pos, self.expected)
+
+    def fail(self, pos, expected):
+        if pos > self.error_pos:
+            self.error_pos = pos
+            self.expected = set([expected])
+        elif pos == self.error_pos:
+            self.expected.add(expected)
+        return None
+
+    def literal(self, pos, literal):
+        """The position after @p literal if it is next, @c None otherwise."""
+        pos = _space.match(self.text, pos).end()
+        if self.text.startswith(literal, pos):
+            return pos + len(literal)
+        return self.fail(pos, repr(literal))
+
+    def memoized(rule):
+        def memoized_rule(self, pos):
+            key = rule, pos
+            try:
+                return self.memo[key]
+            except KeyError:
+                result = self.memo[key] = rule(self, pos)
+                return result
+        memoized_rule.__name__ = rule.__name__
+        return memoized_rule
+
+    @memoized
+    def definition(self, pos):
+        # D -> E | E , D
+        expression = self.expression(pos)
+        if expression is None:
+            return None
+        tree, end = [expression[0]], expression[1]
+        while True:
+            after_sep = self.literal(end, ',')
+            if after_sep is None:
+                break
+            expression = self.expression(after_sep)
+            if expression is None:
+                break
+            tree.append(expression[0])
+            end = expression[1]
+        return tree, end
+
+    @memoized
+    def expression(self, pos):
+        unexpr = self.unexpr(pos)
+        binexpr = self.binexpr(pos)
+        # E -> U ( E )
+        in_parens = None
+        unary = self.unary(pos)
+        if unary is not None:
+            after_lp = self.literal(unary[1], '(')
+            if after_lp is not None:
+                expression = self.expression(after_lp)
+                if expression is not None:
+                    end = self.literal(expression[1], ')')
+                    if end is not None:
+                        in_parens = [unary[0], '(', expression[0], ')'], end
+        # E -> < E >
+        in_defa = None
+        after_la = self.literal(pos, '<')
+        if after_la is not None:
+            expression = self.expression(after_la)
+            if expression is not None:
+                end = self.literal(expression[1], '>')
+                if end is not None:
+                    in_defa = ['<', expression[0], '>'], end
+        return _longest(
+            # E -> UE
+            unexpr and ([unexpr[0]], unexpr[1]),
+            # E -> BE
+            binexpr and ([binexpr[0]], binexpr[1]),
+            in_parens,
+            in_defa)
+
+    @memoized
+    def binexpr(self, pos):
+        # BE -> A B, BE -> A B A
+        arg_bin = arg_bin_arg = None
+        argexpr = self.argexpr(pos)
+        if argexpr is not None:
+            binary = self.binary(argexpr[1])
+            if binary is not None:
+                arg_bin = [argexpr[0], binary[0]], binary[1]
+                argexpr2 = self.argexpr(binary[1])
+                if argexpr2 is not None:
+                    arg_bin_arg = ([argexpr[0], binary[0], argexpr2[0]],
+                                   argexpr2[1])
+        # BE -> B A, BE -> B [ E ; E ]
+        bin_arg = bin_parts = None
+        binary = self.binary(pos)
+        if binary is not None:
+            argexpr = self.argexpr(binary[1])
+            if argexpr is not None:
+                bin_arg = [binary[0], argexpr[0]], argexpr[1]
+            bin_parts = self.binary_parts(binary)
+        return _longest(arg_bin, bin_arg, arg_bin_arg, bin_parts)
+
+    def binary_parts(self, binary):
+        """The rest of B [ E ; E ] after @p binary."""
+        after_lb = self.literal(binary[1], '[')
+        if after_lb is None:
+            return None
+        expression1 = self.expression(after_lb)
+        if expression1 is None:
+            return None
+        after_sep = self.literal(expression1[1], ';')
+        if after_sep is None:
+            return None
+        expression2 = self.expression(after_sep)
+        if expression2 is None:
+            return None
+        end = self.literal(expression2[1], ']')
+        if end is None:
+            return None
+        return ([binary[0], '[', expression1[0], ';', expression2[0], ']'],
+                end)
+
+    @memoized
+    def unexpr(self, pos):
+        unary = self.unary(pos)
+        if unary is None:
+            return None
+        # UE -> U [ D ]
+        in_brackets = None
+        after_lb = self.literal(unary[1], '[')
+        if after_lb is not None:
+            definition = self.definition(after_lb)
+            if definition is not None:
+                end = self.literal(definition[1], ']')
+                if end is not None:
+                    in_brackets = [unary[0], '[', definition[0], ']'], end
+        # UE -> U ( U )
+        in_parens = None
+        after_lp = self.literal(unary[1], '(')
+        if after_lp is not None:
+            unary2 = self.unary(after_lp)
+            if unary2 is not None:
+                end = self.literal(unary2[1], ')')
+                if end is not None:
+                    in_parens = [unary[0], '(', unary2[0], ')'], end
+        # UE -> U
+        return _longest(([unary[0]], unary[1]), in_brackets, in_parens)
+
+    @memoized
+    def argexpr(self, pos):
+        # A -> UE
+        unexpr = self.unexpr(pos)
+        # A -> [ D ]
+        in_brackets = None
+        after_lb = self.literal(pos, '[')
+        if after_lb is not None:
+            definition = self.definition(after_lb)
+            if definition is not None:
+                end = self.literal(definition[1], ']')
+                if end is not None:
+                    in_brackets = ['[', definition[0], ']'], end
+        # A -> < A >
+        in_defa = None
+        after_la = self.literal(pos, '<')
+        if after_la is not None:
+            argexpr = self.argexpr(after_la)
+            if argexpr is not None:
+                end = self.literal(argexpr[1], '>')
+                if end is not None:
+                    in_defa = ['<', argexpr[0], '>'], end
+        # A -> '
+        prime = None
+        end = self.literal(pos, "'")
+        if end is not None:
+            prime = ["'"], end
+        return _longest(unexpr and ([unexpr[0]], unexpr[1]), in_brackets,
+                        in_defa, prime)
+
+    @memoized
+    def unary(self, pos):
+        # the first alternative that matches
+        text = self.text
+        pos = _space.match(text, pos).end()
+        match = _unary_word.match(text, pos)
+        if match:
+            return match.group(), match.end()
+        for prefix, pattern in (('=', _deep_case), ('$', _langspec),
+                                ('#', _avm), ('@', _enc)):
+            match = pattern.match(text, pos)
+            if match:
+                return [prefix, match.group(1)], match.end()
+        after_la = self.literal(pos, '<')
+        if after_la is not None:
+            unary = self.unary(after_la)
+            if unary is not None:
+                end = self.literal(unary[1], '>')
+                if end is not None:
+                    return ['<', unary[0], '>'], end
+        return self.fail(pos, 'unary')
+
+    @memoized
+    def binary(self, pos):
+        # the first alternative that matches
+        text = self.text
+        pos = _space.match(text, pos).end()
+        match = _binary_word.match(text, pos)
+        if match:
+            return match.group(), match.end()
+        match = _rel.match(text, pos)
+        if match:
+            return ['=', 'REL'], match.end()
+        return self.fail(pos, 'binary')
+
+    del memoized
+
+def parse_definition(text):
+    """
+    Parses the definition @p text (the definition column of a 4lang
+    definition line). Returns the same nested lists as the pyparsing grammar
+    of DefinitionParser: a list with the list of the parse trees of its
+    comma-separated expressions.
+    @raise DefinitionSyntaxError if @p text is not a definition.
+    """
+    return _DefinitionParser(text).parse()
@@ -0,0 +1,145 @@
+"""The definition graph as a sparse matrix.
+
+Lexicon.extract_definition_graph() builds the flattened definition graph out
+of new machines, one for each static entry, linked to each other. Graph
+algorithms and exports only need its adjacency matrix, so
+definition_matrix() computes the same graph as a scipy.sparse CSR matrix
+(and the list of the names of its rows and columns), without creating any
+machines.
+
+The definitions are flattened in parallel: the headwords are split into
+contiguous shards, and worker processes (forked, so they share the static
+graph of the lexicon; a frozen one is shared page by page, see
+worker_pool.py) return the neighbours of the headwords of their shard as
+column indices, which are concatenated into the matrix in order."""
+
+from array import array
+import marshal
+import multiprocessing
+
+import numpy
+from scipy.sparse import csr_matrix
+
+# The lexicon, the static names and their row index, inherited by the worker
+# processes
+_lexicon = None
+_names = None
+_index = None
+
+def definition_neighbours(lexicon, name, deep_cases=False):
+    """
+    The names of the neighbours of @p name in the definition graph (see
+    Lexicon.extract_definition_graph()): the canonical words in its
+    definition (that of the static entry @p name), and the canonical
+    versions of non-canonical terms in it.
+    @param deep_cases if @c True, the deep cases in the definition are
+                      included as well.
+    """
+    static = lexicon.static
+    neighbours = set()
+    static_machine = static[name][0]
+    if static_machine.fancy():
+        return neighbours
+    stop = set()
+    stack = [static_machine]
+    while stack:
+        for child in stack.pop().children():
+            if child.fancy():
+                if deep_cases and child.deep_case():
+                    neighbours.add(child.printname())
+                # deep cases are stopped by their printname (see
+                # Lexicon.__build_definition_graph())
+                key = child.printname()
+            else:
+                cname = lexicon.get_static_machine(
+                    child.printname())[0].printname()
+                if cname != name:
+                    neighbours.add(cname)
+                if static.get(child.printname(), (None,))[0] is child:
+                    continue
+                key = child
+            if key not in stop:
+                stop.add(key)
+                stack.append(child)
+    return neighbours
+
+def _flatten(names, deep_cases):
+    """
+    The neighbours of @p names in _lexicon, marshalled: for each name, the
+    row indices of the neighbours in _index, and the names of the others
+    (the deep cases).
+    """
+    rows = []
+    for name in names:
+        columns, others = array('i'), []
+        for neighbour in definition_neighbours(_lexicon, name, deep_cases):
+            column = _index.get(neighbour)
+            if column is None:
+                others.append(neighbour)
+            else:
+                columns.append(column)
+        rows.append((columns.tostring(), others))
+    return marshal.dumps(rows)
+
+def _flatten_shard(shard):
+    """Flattens the shard (first name, last name + 1, deep_cases) in a worker
+    process."""
+    start, stop, deep_cases = shard
+    return _flatten(_names[start:stop], deep_cases)
+
+def definition_matrix(lexicon, deep_cases=False, processes=None,
+                      shards_per_process=4):
+    """
+    Returns the definition graph of @p lexicon (see
+    Lexicon.extract_definition_graph()) as a CSR matrix M and the list of
+    the names of its nodes: M[i, j] == 1 iff names[j] is a neighbour of
+    names[i]. The first len(lexicon.static) names are the static entries,
+    in sorted order; the rest are deep cases, which have no neighbours.
+    @param deep_cases if @c True, deep cases are included as nodes.
+    @param processes the number of worker processes (the number of CPUs by
+                     default).
+    @param shards_per_process the number of shards per process.
+    """
+    global _lexicon, _names, _index
+    names = sorted(lexicon.static)
+    index = dict((name, i) for i, name in enumerate(names))
+    _lexicon, _names, _index = lexicon, names, index
+    try:
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if processes <= 1:
+            flattened = [_flatten(names, deep_cases)]
+        else:
+            num_shards = processes * shards_per_process
+            shard_size = max(1, -(-len(names) // num_shards))
+            shards = [(start, start + shard_size, deep_cases)
+                      for start in xrange(0, len(names), shard_size)]
+            pool = multiprocessing.Pool(processes)
+            try:
+                flattened = list(pool.imap(_flatten_shard, shards))
+            finally:
+                pool.terminate()
+                pool.join()
+    finally:
+        _lexicon, _names, _index = None, None, None
+
+    indptr, indices = array('i', [0]), array('i')
+    for rows in flattened:
+        for columns, others in marshal.loads(rows):
+            row = array('i')
+            row.fromstring(columns)
+            for name in others:
+                if name not in index:
+                    index[name] = len(names)
+                    names.append(name)
+                row.append(index[name])
+            indices.extend(sorted(row))
+            indptr.append(len(indices))
+    # the rows of the deep cases
+    indptr.extend([len(indices)] * (len(names) + 1 - len(indptr)))
+    matrix = csr_matrix(
+        (numpy.ones(len(indices), dtype=numpy.int8),
+         numpy.frombuffer(indices.tostring(), dtype=numpy.intc),
+         numpy.frombuffer(indptr.tostring(), dtype=numpy.intc)),
+        shape=(len(names), len(names)))
+    return matrix, names
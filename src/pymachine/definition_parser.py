@@ -1,8 +1,11 @@
+import cPickle
 import logging
+import multiprocessing
 import sys
 import re
 import string
 from collections import defaultdict
+from itertools import chain
 
 try:
     import pyparsing
@@ -14,7 +17,9 @@ except ImportError:
 from hunmisc.xstring.encoding import decode_from_proszeky
 
 from constants import deep_cases, avm_pre, deep_pre, enc_pre, id_sep
-from pymachine.machine import Machine
+from pymachine.definition_grammar import (
+    parse_definition, DefinitionError, DefinitionSyntaxError)
+from pymachine.machine import Machine, Partition
 from pymachine.control import ConceptControl
 
 class ParserException(Exception):
@@ -38,9 +43,11 @@ class DefinitionParser(object):
     unary_p = re.compile("^[a-z_#\-/0-9]+(/[0-9]+)?$")
     binary_p = re.compile("^[A-Z_0-9]+(/[0-9]+)?$")
 
+    # The pyparsing grammar, built by init_parser() when first needed
+    definition = None
+
     def __init__(self, plur_dict):
         self.plur_dict = plur_dict
-        self.init_parser()
 
     @classmethod
     def _is_binary(cls, s):
@@ -62,6 +69,11 @@ class DefinitionParser(object):
         return s in deep_cases
 
     def init_parser(self):
+        """
+        Builds the pyparsing grammar of definitions. parse() uses the parser
+        in definition_grammar.py instead, which parses the same grammar;
+        this one is kept as its reference, see parse_pyparsing().
+        """
         self.lb_lit = Literal(DefinitionParser.lb)
         self.rb_lit = Literal(DefinitionParser.rb)
         self.lp_lit = Literal(DefinitionParser.lp)
@@ -175,6 +187,18 @@ class DefinitionParser(object):
         #self.sen = self.definition + LineEnd()
 
     def parse(self, s):
+        """
+        Parses the definition @p s into nested lists, see
+        definition_grammar.py.
+        @raise DefinitionSyntaxError if @p s is not a definition.
+        """
+        return parse_definition(s)
+
+    def parse_pyparsing(self, s):
+        """parse() with the pyparsing grammar (see init_parser()).
+        @raise pyparsing.ParseException if @p s is not a definition."""
+        if self.definition is None:
+            self.init_parser()
         return self.definition.parseString(s, parseAll=True).asList()
 
     def create_machine(self, name, partitions):
@@ -196,50 +220,159 @@ class DefinitionParser(object):
 
         return m
 
-    def unify(self, machine):
-        def __collect_machines(m, machines, is_root=False):
-            # cut the recursion
-            key = m.printname(), __has_other(m)
-            if (key in machines and m in machines[key]):
-                return
+    @staticmethod
+    def _has_other(m):
+        """Whether there is an 'other' in the first partition of @p m."""
+        for m_ in m.partitions[0]:
+            if m_.printname() == "other":
+                return True
+        return False
 
-            if not is_root:
-                machines[m.printname(), __has_other(m)].append(m)
-            for partition in m.partitions:
-                for m_ in partition:
-                    __collect_machines(m_, machines)
-
-        def __has_other(m):
-            for m_ in m.partitions[0]:
-                if m_.printname() == "other":
-                    return True
-            return False
-
-        def __get_unified(machines, res=None):
-            # if nothing to unify, don't
-            if len(machines) == 1:
-                return machines[0]
-
-            # if a return machine is given, don't create a new one
-            if res is None:
-                prototype = machines[0]
-                res = self.create_machine(prototype.printname(),
-                                          len(prototype.partitions))
-            for m in machines:
-                # if the same machine, don't add anything
-                if id(m) == id(res):
-                    continue
+    def _collect_machines(self, machine):
+        """
+        The machines in the definition @p machine, grouped by their
+        printname and _has_other(), in depth-first order; and the key of the
+        group of each machine. The root is only in a group if the definition
+        refers to it.
+        """
+        groups = defaultdict(list)
+        keys = {}
+        stack = [chain.from_iterable(machine.partitions)]
+        while stack:
+            for m in stack[-1]:
+                if m not in keys:
+                    key = keys[m] = m.printname(), self._has_other(m)
+                    groups[key].append(m)
+                    stack.append(chain.from_iterable(m.partitions))
+                    break
+            else:
+                stack.pop()
+        return groups, keys
 
-                for p_i, p in enumerate(m.partitions):
-                    for part_m in p:
-                        if part_m.printname() != "other":
-                            res.partitions[p_i].append(part_m)
+    def _get_unified(self, machines, res=None):
+        """
+        The machine that replaces @p machines: @p res (a new machine if
+        @c None) with the partitions of all of them, 'other's excepted.
+        """
+        # if nothing to unify, don't
+        if len(machines) == 1:
+            return machines[0]
+
+        # if a return machine is given, don't create a new one
+        if res is None:
+            prototype = machines[0]
+            res = self.create_machine(prototype.printname(),
+                                      len(prototype.partitions))
+        for m in machines:
+            # if the same machine, don't add anything
+            if id(m) == id(res):
+                continue
 
-                            part_m.del_parent_link(m, p_i)
-                            part_m.add_parent_link(res, p_i)
+            for p_i, p in enumerate(m.partitions):
+                moved = [part_m for part_m in p
+                         if part_m.printname() != "other"]
+                for part_m in moved:
+                    part_m.del_parent_link(m, p_i)
+                res.append_all(moved, p_i)
 
-            return res
+        return res
 
+    def unify(self, machine):
+        """
+        Unifies the unary machines in the definition @p machine that have
+        the same printname, and either both or neither of which have an
+        'other' in their first partition: each such group is replaced by a
+        single machine (the root, if it has their printname) that has the
+        partitions of all of them.
+
+        The groups are collected in one traversal, and the edges are rewired
+        to the unified machines in a second one (see _rewire()), so this
+        takes linear time; unify_by_keys() does the same one group at a time,
+        with a traversal of the whole definition for each. The few
+        definitions where the order of the groups matters are unified by
+        unify_by_keys().
+        """
+        groups, keys = self._collect_machines(machine)
+        unified = self._unify_groups(machine, groups)
+        if unified is None:
+            self.unify_by_keys(machine, groups)
+        else:
+            self._rewire(machine, unified, keys)
+
+    def _unify_groups(self, machine, groups):
+        """
+        Creates the unified machine of each of @p groups (see
+        _collect_machines()) of the definition @p machine. Returns the dict
+        key -> unified machine, or @c None (without changing anything) if
+        unifying the groups one after the other could give a different
+        result: if the unified machine would be of an other group (the
+        printname of the new machine would be changed by create_machine(),
+        or the root would be unified with both groups of its printname), or
+        would lose an 'other' that could still be unified.
+        """
+        root_name = machine.printname()
+        to_unify = []
+        for key, machines in groups.iteritems():
+            if len(machines) == 1 or len(machines[0].partitions) > 1:
+                continue
+            printname, is_other = key
+            if printname == root_name:
+                if (printname, not is_other) in groups:
+                    return None
+            elif (printname in self.plur_dict or
+                  decode_from_proszeky(printname) != printname):
+                return None
+            for m in machines:
+                if m is not machine:
+                    for p in m.partitions:
+                        for m_ in p:
+                            if m_.printname() == "other":
+                                return None
+            to_unify.append(key)
+
+        unified = {}
+        for key in to_unify:
+            # if unification affects the root (machine), be that the result
+            # machine
+            unified[key] = self._get_unified(
+                groups[key], machine if key[0] == root_name else None)
+        return unified
+
+    def _rewire(self, machine, unified, keys):
+        """
+        Replaces the machines of the groups in @p unified (key -> unified
+        machine) with their unified machine everywhere in the definition
+        @p machine. @p keys is the key of the group of each machine.
+        """
+        visited = set([machine])
+        stack = [machine]
+        while stack:
+            where = stack.pop()
+            for p_i, p in enumerate(where.partitions):
+                new_p = []
+                replaced = False
+                for part_m in p:
+                    res = unified.get(keys.get(part_m))
+                    if res is not None and res is not part_m:
+                        res.add_parent_link(where, p_i)
+                        part_m = res
+                        replaced = True
+                    new_p.append(part_m)
+                    if part_m not in visited:
+                        visited.add(part_m)
+                        stack.append(part_m)
+
+                # unification if there is a machine more than once on the same
+                # partition
+                if replaced:
+                    where.partitions[p_i] = Partition(new_p)
+
+    def unify_by_keys(self, machine, groups=None):
+        """
+        unify() one group at a time, replacing the machines of each group
+        (see _collect_machines()) in a traversal of the whole definition
+        @p machine.
+        """
         def __replace(where, for_what, is_other=False, visited=None):
             if visited is None:
                 visited = set()
@@ -252,21 +385,22 @@ class DefinitionParser(object):
             pn = for_what.printname()
             for p_i, p in enumerate(where.partitions):
                 # change the partition machines
-                for part_m_i, part_m in enumerate(p):
-                    if part_m.printname() == pn and __has_other(
+                new_p = []
+                for part_m in p:
+                    if part_m.printname() == pn and self._has_other(
                             part_m) == is_other:
-                        where.partitions[p_i][part_m_i] = for_what
+                        part_m = for_what
                         for_what.add_parent_link(where, p_i)
-                    __replace(where.partitions[p_i][part_m_i],
-                              for_what, is_other, visited)
+                    new_p.append(part_m)
+                    __replace(part_m, for_what, is_other, visited)
 
                 # unification if there is a machine more than once on the same
                 # partition
-                where.partitions[p_i] = list(set(p))
+                where.partitions[p_i] = Partition(new_p)
 
-        machines = defaultdict(list)
-        __collect_machines(machine, machines, is_root=True)
-        for k, machines_to_unify in machines.iteritems():
+        if groups is None:
+            groups = self._collect_machines(machine)[0]
+        for k, machines_to_unify in groups.iteritems():
 
             if len(machines_to_unify[0].partitions) > 1:
                 continue
@@ -275,9 +409,9 @@ class DefinitionParser(object):
             #if unification affects the root (machine),
             #be that the result machine
             if printname == machine.printname():
-                unified = __get_unified(machines_to_unify, machine)
+                unified = self._get_unified(machines_to_unify, machine)
             else:
-                unified = __get_unified(machines_to_unify)
+                unified = self._get_unified(machines_to_unify)
             __replace(machine, unified, is_other)
 
     def __parse_expr(self, expr, root, loop_to_defendum=True,
@@ -518,35 +652,187 @@ class DefinitionParser(object):
         self.unify(machine)
         return machine
 
+def _parse_lines(dp, lines, args):
+    """
+    Parses the definition @p lines with @p dp, passing @p args to
+    parse_into_machines(). Yields the line, its machine (@c None if its
+    definition is empty) and the DefinitionSyntaxError in it (or @c None)
+    for each line.
+    """
+    for line in lines:
+        l = line.strip('\n')
+        logging.debug("Parsing: {0}".format(l))
+        try:
+            m = dp.parse_into_machines(l, *args)
+        except DefinitionSyntaxError, pe:
+            yield l, None, pe
+            continue
+        if m.partitions[0] == []:
+            logging.debug('dropping empty definition of '+m.printname())
+            m = None
+        yield l, m, None
+
+def _add_parsed(d, parsed):
+    """Adds the machines of the lines @p parsed by _parse_lines() to @p d,
+    and reports the syntax errors, in the order of the lines."""
+    for l, m, error in parsed:
+        if error is not None:
+            print l
+            logging.error("Error: "+str(error))
+            continue
+        if m is None:
+            continue
+        pn = m.printname()
+        if pn in d:
+            continue
+            # logging.warning('duplicate pn: {0}, machines: {1}, {2}'.format(
+            #    pn, d[pn], "{0}:{1}".format(m, m.partitions)))
+        d[m.printname()].add(m)
+        logging.debug('\n'+m.to_debug_str())
+
+# The lines being read, inherited by the worker processes, and the parser and
+# the arguments of parse_into_machines() of a worker
+_lines = None
+_parser = None
+_args = None
+
+def _init_worker(plur_dict, args):
+    global _parser, _args
+    _parser = DefinitionParser(plur_dict)
+    _args = args
+
+def _parse_shard(shard):
+    """
+    Parses the lines _lines[start:stop] in a worker process. Returns the
+    list of their results (see _parse_lines()) and the exception that stopped
+    the parse (or @c None), pickled.
+    """
+    start, stop = shard
+    parsed = []
+    try:
+        parsed.extend(_parse_lines(_parser, _lines[start:stop], _args))
+    except Exception, e:
+        return cPickle.dumps((parsed, e), 2)
+    return cPickle.dumps((parsed, None), 2)
+
+def _parse_in_processes(lines, plur_dict, args, processes,
+                        shards_per_process):
+    """
+    Parses @p lines in @p processes worker processes, in contiguous shards.
+    Yields the results of _parse_lines() in the order of the lines; the
+    exception that stopped a shard is raised after the results of the lines
+    before it.
+    """
+    global _lines
+    num_shards = processes * shards_per_process
+    shard_size = max(1, -(-len(lines) // num_shards))
+    shards = [(start, start + shard_size)
+              for start in xrange(0, len(lines), shard_size)]
+    _lines = lines
+    pool = multiprocessing.Pool(processes, _init_worker, (plur_dict, args))
+    shard_results = pool.imap(_parse_shard, shards)
+    try:
+        for pickled in shard_results:
+            parsed, exception = cPickle.loads(pickled)
+            for result in parsed:
+                yield result
+            if exception is not None:
+                raise exception
+    finally:
+        # the shards left are parsed all the same: terminating the pool while
+        # a worker is sending its results can deadlock it
+        for pickled in shard_results:
+            pass
+        pool.terminate()
+        pool.join()
+        _lines = None
+
+def _parse_cached(lines, cache, salt, parse):
+    """
+    Yields the results of _parse_lines() for @p lines, taking those of the
+    lines already in @p cache (a ParseCache) from it, and parsing the others
+    with @p parse (a function that returns an iterator over the results of
+    the lines passed to it). The results are stored in the cache, which is
+    then updated with the headwords defined (see ParseCache.update()).
+    """
+    keys = cache.keys((line.strip('\n') for line in lines), salt)
+    cached = [key in cache for key in keys]
+    parsed = parse([line for line, in_cache in zip(lines, cached)
+                    if not in_cache])
+    headwords = {}
+    for line, key, in_cache in zip(lines, keys, cached):
+        if in_cache:
+            m, error = cache.get(key)
+            result = line.strip('\n'), m, error
+        else:
+            result = next(parsed)
+            cache.put(key, result[1:])
+        if result[1] is not None:
+            headwords.setdefault(result[1].printname(), key)
+        yield result
+    cache.update(headwords, keys)
+
 def read(f, plur_filn, printname_index=0, add_indices=False,
-         loop_to_defendum=True, three_parts=False):
+         loop_to_defendum=True, three_parts=False, processes=1,
+         shards_per_process=4, cache=None):
+    """
+    Reads the definitions in the lines of @p f. Returns a dict:
+    printname -> set of the machine of its first definition.
+    @param processes the number of worker processes the lines are parsed in
+                     (the number of CPUs if @c None). The file is split into
+                     contiguous shards of lines, and their machines are added
+                     in the order of the lines, so the result (and the errors
+                     reported) are the same as with one process.
+    @param shards_per_process the number of shards per process; the shards
+                              are added in order while the others are still
+                              being parsed.
+    @param cache a ParseCache (see parse_cache.py) of the file: only the
+                 lines not in it are parsed. It is updated, but not saved.
+    """
     logging.warning(
         "Will now discard all but the first definition of each \
         headword!".upper())
     d = defaultdict(set)
     plur_dict = read_plur(open(plur_filn)) if plur_filn else {}
-    dp = DefinitionParser(plur_dict)
-    for line in f:
-        l = line.strip('\n')
-        logging.debug("Parsing: {0}".format(l))
-        try:
-            m = dp.parse_into_machines(l, printname_index, add_indices,
-                                       loop_to_defendum, three_parts)
-            if m.partitions[0] == []:
-                logging.debug('dropping empty definition of '+m.printname())
-                continue
-            pn = m.printname()
-            if pn in d:
-                continue
-                # logging.warning('duplicate pn: {0}, machines: {1}, {2}'.format(
-                #    pn, d[pn], "{0}:{1}".format(m, m.partitions)))
-            d[m.printname()].add(m)
-            logging.debug('\n'+m.to_debug_str())
-        except pyparsing.ParseException, pe:
-            print l
-            logging.error("Error: "+str(pe))
+    args = printname_index, add_indices, loop_to_defendum, three_parts
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    def parse(lines):
+        if processes <= 1:
+            return _parse_lines(DefinitionParser(plur_dict), lines, args)
+        return _parse_in_processes(list(lines), plur_dict, args, processes,
+                                   shards_per_process)
+
+    if cache is None:
+        _add_parsed(d, parse(f))
+    else:
+        salt = repr((sorted(plur_dict.iteritems()), args))
+        _add_parsed(d, _parse_cached(list(f), cache, salt, parse))
     return d
 
+def iter_definitions(stream, plur_filn=None, printname_index=0,
+                     add_indices=False, loop_to_defendum=True,
+                     three_parts=False):
+    """
+    Parses the definition lines of @p stream (a file, a pipe, ...) one at a
+    time. Yields (headword, machine) for the first non-empty definition of
+    each headword, and a DefinitionError for each line with a syntax error,
+    in the order of the lines. Only the headwords are remembered, not their
+    machines (cf. read()), so Lexicon.add_static() can take the generator
+    directly.
+    """
+    plur_dict = read_plur(open(plur_filn)) if plur_filn else {}
+    args = printname_index, add_indices, loop_to_defendum, three_parts
+    headwords = set()
+    parsed = _parse_lines(DefinitionParser(plur_dict), stream, args)
+    for line_no, (l, m, error) in enumerate(parsed, 1):
+        if error is not None:
+            yield DefinitionError(line_no, l, error)
+        elif m is not None and m.printname() not in headwords:
+            headwords.add(m.printname())
+            yield m.printname(), m
+
 def read_plur(_file):
     plur_dict = {}
     for line in _file:
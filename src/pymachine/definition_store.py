@@ -0,0 +1,207 @@
+"""Definitions loaded by headword.
+
+Reading a definition file (or unpickling a dump of one) creates the machines
+of every headword, although most runs only look at a few thousand of them.
+A definition index file stores the definitions of each headword as a
+separate blob instead:
+
+    magic, version, index offset
+    blobs: the pickled definition machines of one headword each
+    index (marshal): headword -> (offset, size, names) of its blob, where
+                     names are the printnames of the machines in it
+
+A DefinitionStore maps the index files read-only, and unpickles the blob of a
+headword when it is first asked for (d[headword], d.get(headword), ...), so
+it can be used wherever the printname -> set of machines dicts returned by
+definition_parser.read() are. Lexicon(definitions=...) takes such a store to
+add definitions to the static graph on first use, see
+Lexicon.load_definitions(); the names in the index tell it which definitions
+mention a word without reading them (see DefinitionStore.names())."""
+
+import cPickle
+import marshal
+import mmap
+import struct
+
+DEFINITIONS_MAGIC = 'PYMDEFS\0'
+# Must be increased whenever the layout changes
+DEFINITIONS_VERSION = 2
+# magic, version, reserved, index offset
+_preamble = struct.Struct('<8sIIQ')
+
+class DefinitionStoreError(Exception):
+    pass
+
+def definition_names(machines):
+    """The printnames of the machines in the definitions @p machines."""
+    names = set()
+    for machine in machines:
+        names.update(m.printname() for m in machine.unique_machines_in_tree())
+    return names
+
+def write_definition_blobs(f, definitions):
+    """
+    Writes the blobs of @p definitions (printname -> set of machines) to the
+    file object @p f. Returns the index: printname -> (offset, size, names)
+    of its blob (see definition_names()).
+    """
+    index = {}
+    for printname, machines in definitions.iteritems():
+        blob = cPickle.dumps(list(machines), 2)
+        index[printname] = (f.tell(), len(blob),
+                            tuple(sorted(definition_names(machines))))
+        f.write(blob)
+    return index
+
+def write_definition_index(definitions, path):
+    """Writes @p definitions (printname -> set of machines) to @p path as an
+    index file."""
+    with open(path, 'wb') as f:
+        f.write(_preamble.pack(DEFINITIONS_MAGIC, DEFINITIONS_VERSION, 0, 0))
+        index = write_definition_blobs(f, definitions)
+        index_offset = f.tell()
+        f.write(marshal.dumps(index))
+        f.seek(0)
+        f.write(_preamble.pack(DEFINITIONS_MAGIC, DEFINITIONS_VERSION, 0,
+                               index_offset))
+
+class DefinitionStore(object):
+    """
+    printname -> set of definition machines, read from index files on first
+    access. Definitions can also be added directly (d[printname] = machines,
+    update()); the definitions of a headword in several sources are merged.
+    """
+    def __init__(self, paths=()):
+        # printname -> set of machines, for the headwords already read
+        self.loaded = {}
+        # the headwords whose definitions have been set directly
+        self.changed = set()
+        # (path, mmap, index) of the index files
+        self.sources = []
+        for path in paths:
+            self.add_file(path)
+
+    def __getstate__(self):
+        return {'loaded': self.loaded, 'changed': self.changed,
+                'paths': [path for path, _, _ in self.sources]}
+
+    def __setstate__(self, state):
+        self.__init__(state['paths'])
+        self.loaded = state['loaded']
+        self.changed = state.get('changed', set())
+
+    def add_file(self, path):
+        """Adds the index file (or the lexicon snapshot with definitions, see
+        snapshot.py) at @p path as a source."""
+        # snapshot.py imports this module
+        from pymachine.snapshot import is_snapshot, snapshot_definitions
+        if is_snapshot(path):
+            buf, index = snapshot_definitions(path)
+            self.add_index(path, buf, index)
+            return
+        with open(path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(buf) < _preamble.size:
+            raise DefinitionStoreError(
+                '{0} is not a definition index'.format(path))
+        magic, version, _, index_offset = _preamble.unpack_from(buf)
+        if magic != DEFINITIONS_MAGIC:
+            raise DefinitionStoreError(
+                '{0} is not a definition index'.format(path))
+        if version != DEFINITIONS_VERSION:
+            raise DefinitionStoreError(
+                'unsupported definition index version {0} in {1} '
+                '(expected {2})'.format(version, path, DEFINITIONS_VERSION))
+        self.add_index(path, buf, marshal.loads(buf[index_offset:]))
+
+    def add_index(self, path, buf, index):
+        """
+        Adds a source: the blobs in @p buf (read from @p path) at the offsets
+        in @p index (printname -> (offset, size, names)), as written by
+        write_definition_blobs().
+        """
+        self.sources.append((path, buf, index))
+        for printname in index:
+            # already read from the other sources
+            if printname in self.loaded:
+                offset, size, _ = index[printname]
+                self.loaded[printname].update(
+                    cPickle.loads(buf[offset:offset + size]))
+
+    def __read(self, printname):
+        """Reads the definitions of @p printname from the sources."""
+        machines = set()
+        for _, buf, index in self.sources:
+            if printname in index:
+                offset, size, _ = index[printname]
+                machines.update(cPickle.loads(buf[offset:offset + size]))
+        return machines
+
+    def __contains__(self, printname):
+        return printname in self.loaded or any(
+            printname in index for _, _, index in self.sources)
+
+    def __getitem__(self, printname):
+        if printname not in self.loaded:
+            if not any(printname in index for _, _, index in self.sources):
+                raise KeyError(printname)
+            self.loaded[printname] = self.__read(printname)
+        return self.loaded[printname]
+
+    def get(self, printname, default=None):
+        return self[printname] if printname in self else default
+
+    def __setitem__(self, printname, machines):
+        self.loaded[printname] = machines
+        self.changed.add(printname)
+
+    def names(self, printname):
+        """The printnames of the machines in the definitions of
+        @p printname (see definition_names()), read from the index if the
+        definitions have not been changed since."""
+        if printname in self.changed:
+            return definition_names(self.loaded[printname])
+        names = set()
+        for _, _, index in self.sources:
+            if printname in index:
+                names.update(index[printname][2])
+        return names
+
+    def update(self, definitions):
+        """Merges @p definitions (printname -> set of machines) into the
+        store."""
+        for printname, machines in definitions.iteritems():
+            if printname in self:
+                self[printname] |= machines
+            else:
+                self[printname] = machines
+
+    def keys(self):
+        printnames = set(self.loaded)
+        for _, _, index in self.sources:
+            printnames.update(index)
+        return list(printnames)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    iterkeys = __iter__
+
+    def __len__(self):
+        return len(self.keys())
+
+    def iteritems(self):
+        """Reads all definitions."""
+        for printname in self.keys():
+            yield printname, self[printname]
+
+    def itervalues(self):
+        for _, machines in self.iteritems():
+            yield machines
+
+    def warm_up(self, printnames):
+        """Reads the definitions of @p printnames (e.g. frequent words) in
+        advance."""
+        for printname in printnames:
+            if printname in self:
+                self[printname]
@@ -0,0 +1,63 @@
+"""Precompiled expansion plans.
+
+Lexicon.expand() walks the static subgraph of a word with unify_recursively()
+every time the word is expanded, repeating the type checks, the bookkeeping of
+the stop set and the AVM wake-ups for the same graph. Which static machines
+are visited and which edges are added only depends on the static graph: the
+walk stops at machines whose printname has already been unified in the same
+call and at AVMs ('#' names), neither of which depends on the active graph.
+
+An ExpansionPlan records the result of such a walk once: the machines to
+create (one per printname, in the order they are entered), the edges to add
+(in the order unify_recursively() adds them) and the AVM constructions to
+wake. Lexicon.expand() keeps the plans of the words expanded recently in an
+LRU cache, and replays them against the active graph; a plan is dropped when
+the static machines of one of its printnames change.
+
+If an AVM printname of the plan is active, the walk would continue below it,
+so the plan cannot be used; Lexicon.expand() falls back to
+unify_recursively() in that case."""
+
+from pymachine.traversal import walk
+
+class ExpansionPlan(object):
+    """The active machines and edges unify_recursively() creates for a
+    static machine."""
+    __slots__ = ('names', 'controls', 'edges', 'avm_names', 'children',
+                 'parents')
+
+    def __init__(self, static_machine):
+        # printname -> index in names
+        index = {}
+        self.names, self.controls, self.edges = [], [], []
+        # the indices of the (active machines of the) machines on the path
+        results = []
+
+        def enter(machine):
+            name = machine.printname()
+            if name in index:
+                results.append(index[name])
+                return False
+            index[name] = len(self.names)
+            results.append(len(self.names))
+            self.names.append(name)
+            self.controls.append(machine.control)
+            return not name.startswith('#')
+
+        def after_edge(machine, part_i, child):
+            child_i = results.pop()
+            # (there is no active machine for an AVM)
+            if not self.names[child_i].startswith('#'):
+                self.edges.append((results[-1], part_i, child_i))
+
+        walk(static_machine, enter, after_edge=after_edge)
+        self.avm_names = tuple(name for name in self.names
+                               if name.startswith('#'))
+        # the (part_i, child_i) edges and the parent indices of each machine
+        # (see overlay.py)
+        self.children = [[] for _ in self.names]
+        self.parents = [[] for _ in self.names]
+        for parent_i, part_i, child_i in self.edges:
+            self.children[parent_i].append((part_i, child_i))
+            if parent_i not in self.parents[child_i]:
+                self.parents[child_i].append(parent_i)
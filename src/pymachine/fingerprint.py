@@ -0,0 +1,62 @@
+"""Weisfeiler-Lehman style structural hashes of machine subgraphs.
+
+The label of a machine at level 0 is the hash of its printname; at level k,
+it is the hash of its own label at level k - 1 and the (sorted) labels of
+its children at level k - 1, partition by partition. The label at level k
+thus summarizes the neighbourhood of depth k of the machine: machines whose
+neighbourhoods are equal (up to the order of the partitions) get the same
+fingerprint, and different ones get different fingerprints with high
+probability. As with any hash, equal fingerprints do not prove equality.
+
+fingerprint() caches the labels in the machines themselves, and
+Machine.append(), remove() and renaming drop the cache of the machine and of
+its ancestors, so after an edge changes only the affected machines are
+recomputed. neighbourhood_fingerprint() follows the parent links as well; its
+labels are kept in a memo dict provided by the caller, because they cannot be
+invalidated.
+
+The fingerprints are built from hash(), so they are only comparable within a
+process."""
+
+DEFAULT_DEPTH = 3
+
+def fingerprint(machine, depth=DEFAULT_DEPTH):
+    """The structural hash of the neighbourhood of depth @p depth of
+    @p machine, along its partitions."""
+    return _label(machine, depth, None)
+
+def neighbourhood_fingerprint(machine, depth=DEFAULT_DEPTH, memo=None):
+    """
+    The same as fingerprint(), but the neighbourhood also includes the
+    parents, so that e.g. the whole graph of a definition is taken into
+    account if @p depth is large enough.
+    @param memo a dict that holds the labels of the machines; it can be
+                shared by subsequent calls if the graphs do not change.
+    """
+    if memo is None:
+        memo = {}
+    return _label(machine, depth, memo)
+
+def _label(machine, level, memo):
+    """The label of @p machine at @p level. The labels are stored in
+    @p memo, or in the machine if @p memo is @c None."""
+    if memo is None:
+        labels = machine._fingerprints
+        if labels is None:
+            labels = machine._fingerprints = [hash(machine.printname_)]
+    else:
+        labels = memo.get(machine)
+        if labels is None:
+            labels = memo[machine] = [hash(machine.printname_)]
+    while len(labels) <= level:
+        prev = len(labels) - 1
+        children = tuple(tuple(sorted(_label(child, prev, memo)
+                                      for child in part))
+                         for part in machine.partitions)
+        if memo is None:
+            labels.append(hash((labels[prev], children)))
+        else:
+            parents = tuple(sorted((_label(parent, prev, memo), part_i)
+                                   for parent, part_i in machine.parents))
+            labels.append(hash((labels[prev], children, parents)))
+    return labels[level]
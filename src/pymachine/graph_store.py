@@ -0,0 +1,442 @@
+"""Array-backed (CSR) store for a finalized static graph.
+
+A frozen lexicon keeps its static graph in a handful of flat arrays instead
+of millions of linked Machine objects: nodes are numbered from 0, outgoing
+edges are stored in compressed sparse row (CSR) format, colored by the index
+of the partition they belong to, and the parent links are stored the same way
+in a reverse CSR. Machines are only created as thin views (see NodeView) when
+somebody asks for them."""
+
+from array import array
+from collections import MutableMapping
+import copy
+import cPickle
+import marshal
+
+from pymachine.machine import Machine
+from pymachine.control import Control, ConceptControl
+from pymachine.symbols import symbols
+from pymachine.traversal import VisitedBitmap
+
+class FrozenGraphException(Exception):
+    pass
+
+class GraphStore(object):
+    """
+    Frozen copy of the static graph of a lexicon.
+
+    Node @c i has the printname @c names[node_name[i]] and
+    @c node_arity[i] partitions. Its outgoing edges are
+    @c targets[offsets[i]:offsets[i + 1]], the partitions they belong to are
+    in the same slice of @c colors. The incoming edges (parent links) are
+    stored in @c rev_offsets, @c rev_sources and @c rev_colors the same way.
+    """
+    # Controls that only store the machine they control can be shared by all
+    # nodes
+    shared_controls = (Control, ConceptControl)
+
+    def __init__(self):
+        self.names = []
+        self.name_ids = {}
+        # index in self.names -> Symbol in the global symbol table
+        self.name_symbols = []
+        self.node_name = array('i')
+        self.node_arity = array('b')
+        # index into self.control_table, -1 for no control
+        self.node_control = array('i')
+        self.control_table = []
+        self.offsets = array('i', [0])
+        self.targets = array('i')
+        self.colors = array('b')
+        self.rev_offsets = array('i')
+        self.rev_sources = array('i')
+        self.rev_colors = array('b')
+        # printname -> node ids of the static entry (canonical first)
+        self.static = {}
+        self.static_disambig = {}
+        self._views = []
+
+    def __len__(self):
+        return len(self.node_name)
+
+    @staticmethod
+    def from_static(static, static_disambig):
+        """
+        Builds a store from the static graph of a lexicon
+        (@c Lexicon.static and @c Lexicon.static_disambig). The machines are
+        not modified.
+        """
+        store = GraphStore()
+        ids = {}
+        order = []
+        # Numbering in depth-first order keeps definitions together
+        for name in sorted(static):
+            for root in static[name]:
+                if root in ids:
+                    continue
+                ids[root] = len(order)
+                order.append(root)
+                stack = [root]
+                while stack:
+                    machine = stack.pop()
+                    for part in reversed(machine.partitions):
+                        for child in reversed(part):
+                            if child not in ids:
+                                ids[child] = len(order)
+                                order.append(child)
+                                stack.append(child)
+
+        control_ids = {}
+        for machine in order:
+            store.node_name.append(store._name_id(machine.printname_))
+            store.node_arity.append(len(machine.partitions))
+            store.node_control.append(
+                store._control_id(machine.control, control_ids))
+            for color, part in enumerate(machine.partitions):
+                for child in part:
+                    store.targets.append(ids[child])
+                    store.colors.append(color)
+            store.offsets.append(len(store.targets))
+        store._build_reverse()
+
+        for name, machines in static.iteritems():
+            store.static[name] = [ids[m] for m in machines]
+        store.static_disambig = dict(
+            (name, set(names))
+            for name, names in static_disambig.iteritems())
+        store._views = [None] * len(order)
+        return store
+
+    def _name_id(self, name):
+        try:
+            return self.name_ids[name]
+        except KeyError:
+            self.name_ids[name] = len(self.names)
+            self.names.append(name)
+            self.name_symbols.append(symbols.id(name))
+            return len(self.names) - 1
+
+    def _control_id(self, control, control_ids):
+        """Adds a detached copy of @p control to the control table."""
+        if control is None:
+            return -1
+        if type(control) in GraphStore.shared_controls:
+            key = type(control)
+            if key in control_ids:
+                return control_ids[key]
+        else:
+            key = None
+        detached = copy.copy(control)
+        detached.machine = None
+        self.control_table.append(detached)
+        if key is not None:
+            control_ids[key] = len(self.control_table) - 1
+        return len(self.control_table) - 1
+
+    def _build_reverse(self):
+        """Fills the reverse CSR from the forward one."""
+        num_nodes = len(self.node_name)
+        counts = array('i', [0]) * (num_nodes + 1)
+        for target in self.targets:
+            counts[target + 1] += 1
+        for i in xrange(num_nodes):
+            counts[i + 1] += counts[i]
+        self.rev_offsets = array('i', counts)
+        self.rev_sources = array('i', [0]) * len(self.targets)
+        self.rev_colors = array('b', [0]) * len(self.targets)
+        fill = counts
+        for source in xrange(num_nodes):
+            for edge in xrange(self.offsets[source], self.offsets[source + 1]):
+                target = self.targets[edge]
+                self.rev_sources[fill[target]] = source
+                self.rev_colors[fill[target]] = self.colors[edge]
+                fill[target] += 1
+
+    # Node access
+
+    def printname(self, node):
+        return self.names[self.node_name[node]]
+
+    def symbol(self, node):
+        return self.name_symbols[self.node_name[node]]
+
+    def control(self, node):
+        """The (detached) control of @p node, or @c None."""
+        control_id = self.node_control[node]
+        return self.control_table[control_id] if control_id >= 0 else None
+
+    def children(self, node, partition=None):
+        """The ids of the children of @p node, optionally only those in
+        @p partition."""
+        begin, end = self.offsets[node], self.offsets[node + 1]
+        if partition is None:
+            return self.targets[begin:end]
+        return [self.targets[e] for e in xrange(begin, end)
+                if self.colors[e] == partition]
+
+    def edges(self, node):
+        """(partition, child) pairs of the outgoing edges of @p node."""
+        begin, end = self.offsets[node], self.offsets[node + 1]
+        return zip(self.colors[begin:end], self.targets[begin:end])
+
+    def parents(self, node):
+        """(parent, partition) pairs of the incoming edges of @p node."""
+        begin, end = self.rev_offsets[node], self.rev_offsets[node + 1]
+        return zip(self.rev_sources[begin:end], self.rev_colors[begin:end])
+
+    def reachable(self, roots, follow_parents=False, visited=None):
+        """
+        Returns the ids of the nodes reachable from @p roots.
+        @param visited the nodes not to visit, a VisitedBitmap. It is
+                       updated, so it can be shared by subsequent calls.
+        """
+        if visited is None:
+            visited = VisitedBitmap(len(self.node_name))
+        stack = list(roots)
+        result = []
+        offsets, targets = self.offsets, self.targets
+        while stack:
+            node = stack.pop()
+            if node in visited:
+                continue
+            visited.add(node)
+            result.append(node)
+            stack.extend(targets[offsets[node]:offsets[node + 1]])
+            if follow_parents:
+                stack.extend(self.rev_sources[
+                    self.rev_offsets[node]:self.rev_offsets[node + 1]])
+        return result
+
+    # Machines
+
+    def view(self, node):
+        """Returns the (cached) NodeView of @p node."""
+        view = self._views[node]
+        if view is None:
+            view = self._views[node] = NodeView(self, node)
+        return view
+
+    def static_views(self):
+        """The static entries with NodeViews, as in @c Lexicon.static (see
+        StaticViews)."""
+        return StaticViews(self)
+
+    def to_machines(self):
+        """
+        Builds regular (mutable) machines from the store. Returns the static
+        graph as a dict in the format of @c Lexicon.static.
+        """
+        machines = []
+        for node in xrange(len(self.node_name)):
+            control = self.control(node)
+            machine = Machine(self.printname(node),
+                              copy.copy(control) if control else None,
+                              self.node_arity[node])
+            machines.append(machine)
+        for node, machine in enumerate(machines):
+            for color, child in self.edges(node):
+                machine.partition(color).append(machines[child])
+            for parent, color in self.parents(node):
+                machines[node].add_parent_link(machines[parent], color)
+        return dict((name, [machines[node] for node in nodes])
+                    for name, nodes in self.static.iteritems())
+
+    # Serialization
+
+    _arrays = ('node_name', 'node_arity', 'node_control', 'offsets',
+               'targets', 'colors', 'rev_offsets', 'rev_sources', 'rev_colors')
+
+    def __getstate__(self):
+        state = dict((name, getattr(self, name).tostring())
+                     for name in GraphStore._arrays)
+        state.update(names=self.names, control_table=self.control_table,
+                     static=self.static, static_disambig=self.static_disambig)
+        return state
+
+    def __setstate__(self, state):
+        self.__init__()
+        for name in GraphStore._arrays:
+            values = array(getattr(self, name).typecode)
+            values.fromstring(state[name])
+            setattr(self, name, values)
+        self.names = state['names']
+        self.name_ids = dict((name, i) for i, name in enumerate(self.names))
+        self.name_symbols = [symbols.id(name) for name in self.names]
+        self.control_table = state['control_table']
+        self.static = state['static']
+        self.static_disambig = state['static_disambig']
+        self._views = [None] * len(self.node_name)
+
+    def save(self, f):
+        """Writes the store to the file object @p f."""
+        state = self.__getstate__()
+        state['control_table'] = cPickle.dumps(self.control_table, 2)
+        f.write(marshal.dumps(state))
+
+    @staticmethod
+    def load(f):
+        """Reads a store written by save() from the file object @p f."""
+        state = marshal.loads(f.read())
+        state['control_table'] = cPickle.loads(state['control_table'])
+        store = GraphStore.__new__(GraphStore)
+        store.__setstate__(state)
+        return store
+
+class StaticViews(MutableMapping):
+    """
+    The static entries of a GraphStore as a printname -> NodeViews mapping,
+    to be used as @c Lexicon.static. The views of an entry are only created
+    when the entry is first looked up; entries can be added, replaced and
+    deleted as in a dict.
+    """
+    def __init__(self, store):
+        self.store = store
+        # printname -> the machines of the entries looked up or set
+        self.entries = {}
+        # printname -> the node ids of the entries not looked up yet
+        self.pending = dict(store.static)
+
+    def __getitem__(self, name):
+        try:
+            return self.entries[name]
+        except KeyError:
+            nodes = self.pending.pop(name)
+            view = self.store.view
+            machines = self.entries[name] = [view(node) for node in nodes]
+            return machines
+
+    def get(self, name, default=None):
+        if name in self.entries or name in self.pending:
+            return self[name]
+        return default
+
+    def __contains__(self, name):
+        return name in self.entries or name in self.pending
+
+    def __setitem__(self, name, machines):
+        self.pending.pop(name, None)
+        self.entries[name] = machines
+
+    def __delitem__(self, name):
+        if name in self.pending:
+            del self.pending[name]
+        else:
+            del self.entries[name]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return self.entries.keys() + self.pending.keys()
+
+    def __len__(self):
+        return len(self.entries) + len(self.pending)
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
+
+def _node_view(store, node):
+    """Unpickling helper for NodeView."""
+    return store.view(node)
+
+class NodeView(Machine):
+    """
+    A read-only Machine that represents a node of a GraphStore. Its
+    partitions and parents are read from the store on first access, and
+    kept as tuples. Views are cached by the store, so there is at most one
+    for each node, and they can be compared and hashed like ordinary
+    machines.
+
+    The control of a view is shared with other nodes and is not attached to
+    any machine; it is meant to be copied (see Lexicon.unify_recursively).
+    """
+    __slots__ = ('store', 'node_id', '_partition_views', '_parent_views')
+
+    def __init__(self, store, node_id):
+        self.store = store
+        self.node_id = node_id
+        self._fingerprints = None
+        self._partition_views = None
+        self._parent_views = None
+
+    def __reduce__(self):
+        return _node_view, (self.store, self.node_id)
+
+    def __deepcopy__(self, memo):
+        raise FrozenGraphException("frozen machines cannot be copied")
+
+    def _get_printname_(self):
+        return self.store.printname(self.node_id)
+
+    def _set_printname_(self, name):
+        raise FrozenGraphException(
+            "cannot rename a frozen machine: {0}".format(self.printname_))
+
+    printname_ = property(_get_printname_, _set_printname_)
+
+    def printname(self):
+        return self.symbol().base_name
+
+    def symbol(self):
+        return self.store.symbol(self.node_id)
+
+    @property
+    def partitions(self):
+        if self._partition_views is None:
+            store = self.store
+            partitions = [[] for i in xrange(store.node_arity[self.node_id])]
+            for color, child in store.edges(self.node_id):
+                partitions[color].append(store.view(child))
+            self._partition_views = tuple(tuple(part) for part in partitions)
+        return self._partition_views
+
+    @property
+    def parents(self):
+        if self._parent_views is None:
+            store = self.store
+            self._parent_views = tuple(
+                (store.view(parent), color)
+                for parent, color in store.parents(self.node_id))
+        return self._parent_views
+
+    @property
+    def control(self):
+        return self.store.control(self.node_id)
+
+    def children(self):
+        return set(child for part in self.partitions for child in part)
+
+    def unique_machines_in_tree(self):
+        store = self.store
+        return set(store.view(node) for node in store.reachable([self.node_id]))
+
+    def set_control(self, control):
+        raise FrozenGraphException("frozen machines cannot be modified")
+
+    def append(self, what, which_partition=0):
+        raise FrozenGraphException("frozen machines cannot be modified")
+
+    def append_all(self, what_iter, which_partition=0):
+        raise FrozenGraphException("frozen machines cannot be modified")
+
+    def partition(self, which_partition):
+        raise FrozenGraphException("frozen machines cannot be modified")
+
+    def remove(self, what, which_partition=None):
+        raise FrozenGraphException("frozen machines cannot be modified")
+
+    def remove_all(self, what_iter, which_partition=None):
+        raise FrozenGraphException("frozen machines cannot be modified")
+
+    def replace(self, old, new, which_partition):
+        raise FrozenGraphException("frozen machines cannot be modified")
+
+    def unify(self, machine2, exclude_0_case=False, exclude_negation=False,
+              keep_orig=False):
+        raise FrozenGraphException("frozen machines cannot be modified")
+
+    def add_parent_link(self, whose, part):
+        raise FrozenGraphException("frozen machines cannot be modified")
+
+    def del_parent_link(self, whose, part):
+        raise FrozenGraphException("frozen machines cannot be modified")
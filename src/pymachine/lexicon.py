@@ -1,49 +1,165 @@
 import logging
 from itertools import chain
-from collections import Iterable, defaultdict
+from collections import Iterable, OrderedDict, defaultdict
 import copy
+import threading
+import weakref
 
+from pymachine.active_context import ActiveContext
+from pymachine.clone import clone_machines
 from pymachine.machine import Machine
 from pymachine.control import ConceptControl
 from pymachine.construction import Construction, AVMConstruction
-from pymachine.constants import id_sep
+from pymachine.definition_grammar import DefinitionError
+from pymachine.definition_store import definition_names
+from pymachine.expansion import ExpansionPlan
+from pymachine.fingerprint import fingerprint
+from pymachine.graph_store import GraphStore, FrozenGraphException
+from pymachine.overlay import OverlayMachine, overlay_plan
+from pymachine.symbols import symbols
+from pymachine.traversal import walk, partition_edges
+
+# Guards the changes to the static graph and to the expansion plan cache that
+# can happen while sentences are processed in several threads (see
+# active_context.py)
+_static_lock = threading.RLock()
+
+class Resolution(object):
+    """The result of Lexicon.resolve_many()."""
+    def __init__(self):
+        # name -> the canonical static machine it refers to
+        self.machines = {}
+        # the names added to static as new words
+        self.created = []
+        # name -> the static names it may refer to
+        self.ambiguous = {}
+        # the names not in static
+        self.missing = []
 
 class Lexicon:
     """THE machine repository."""
-    def __init__(self):
+    # For lexicons pickled before overlay mode
+    overlay = False
+    # For lexicons pickled before the activation index
+    activation_index = None
+    # For lexicons pickled before expansion plans
+    expansion_plans = None
+    # The number of words whose expansion plans are cached
+    expansion_cache_size = 1024
+    # For lexicons pickled before lazy definitions
+    definitions = None
+    # For lexicons pickled before the mention index of the definitions
+    definition_mentions = None
+    # For lexicons pickled before active contexts
+    context = None
+    live_contexts = None
+    # For lexicons pickled before resolve_many()
+    missing_names = None
+    # The number of names the negative cache of resolve_many() holds
+    missing_cache_size = 65536
+
+    def __init__(self, overlay=False, definitions=None):
+        """
+        @param overlay if @c True, expanded machines are copied from the
+                       static graph lazily, see overlay.py.
+        @param definitions if not @c None, a printname -> definition machines
+                           mapping (e.g. a DefinitionStore) that definitions
+                           are added to static from on first use, see
+                           load_definitions(). Note that this changes the
+                           results of activate() and the order of the static
+                           machines of a printname.
+        """
         # static will store only one machine per printname (key),
         # while active can store more
         self.static = {}
         # e.g. {'in': {'in_2758', 'in_13'}}, where in_XXXs are keys in static
         self.static_disambig = defaultdict(set)
-        # TODO: map: {active_machine : is it expanded?}
-        self.active = {}
         # Constructions
         self.constructions = []
-        # AVM name -> construction. Not used by default, have to be added to
-        # self.constructions first via activation
+        # AVM name -> construction. Not used by default, have to be woken up
+        # in an active context first via activation
         self.avm_constructions = {}
+        # fingerprint -> the non-canonical static machines with that
+        # fingerprint (at depth 1), for deduplication in add_static()
+        self.static_fingerprints = {}
+        # Set by freeze()
+        self.graph_store = None
+        self.overlay = overlay
+        # The activation index, built by finalize_static() (see activate()):
+        # printname -> the indices (in static) of its static machines whose
+        # children are all AVMs
+        self.activation_index = None
+        self.clear_expansion_plans()
+        self.definitions = definitions
+        if definitions is not None:
+            logging.warning(
+                "definitions are loaded on first use: activate() only sees "
+                "the definitions loaded so far (see load_definitions())")
+        # the headwords whose definitions have been added from definitions
+        self.loaded_definitions = set()
+        # base name -> the headwords whose definitions mention a name with
+        # that base name, built on first use (see load_definitions())
+        self.definition_mentions = None
+        # the names resolve_many() has not found, until static changes
+        self.missing_names = set()
 #        self.create_elvira_machine()
+        # The active state of the methods called without a context
         self.clear_active()
 
-    def __add_active_machine(self, m, expanded=False):
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('live_contexts', None)
+        return state
+
+    def __setstate__(self, state):
+        # (lexicons pickled before active contexts kept it in the lexicon)
+        state.pop('active', None)
+        self.__dict__.update(state)
+        self.live_contexts = weakref.WeakSet()
+        if self.context is not None:
+            self.live_contexts.add(self.context)
+
+    @property
+    def active(self):
+        """The active machines of the lexicon's own context (read-only, see
+        active_context.py)."""
+        return self.active_context().active
+
+    def new_context(self):
+        """Returns a new, empty active context (see active_context.py). The
+        lexicon keeps track of the contexts in use, so that the static
+        machines indexed later are queued in them as well (see
+        activate())."""
+        with _static_lock:
+            if self.live_contexts is None:
+                self.live_contexts = weakref.WeakSet()
+            context = ActiveContext(self)
+            self.live_contexts.add(context)
+            return context
+
+    def active_context(self, context=None):
+        """Returns @p context, or the lexicon's own context if it is
+        @c None."""
+        if context is not None:
+            return context
+        if self.context is None:
+            self.clear_active()
+        return self.context
+
+    def __add_active_machine(self, m, context, expanded=False):
         """Helper method for add_active()"""
-        printname = m.printname()
-        #logging.info('activating machine: {}'.format(printname))
-        if printname in self.active:
-            already_expanded = self.active[printname].get(m, False)
-            self.active[printname][m] = expanded | already_expanded
-        else:
-            self.active[printname] = {m: expanded}
+        #logging.info('activating machine: {}'.format(m.printname()))
+        context.active.add(m, expanded)
 
-    def add_active(self, what):
+    def add_active(self, what, context=None):
         """adds machines to active collection
         typically called to add a sentence being worked with"""
+        context = self.active_context(context)
         if isinstance(what, Iterable):
             for m in what:
-                self.__add_active_machine(m)
+                self.__add_active_machine(m, context)
         elif isinstance(what, Machine):
-            self.__add_active_machine(what)
+            self.__add_active_machine(what, context)
         else:
             logging.error("Calling Lexicon.add_active() with an incompatible" +
                           " type")
@@ -52,111 +168,232 @@ class Lexicon:
         """
         Add lexical definition to the static collection
         while keeping prior links (parent links).
+        The iterables may contain the (headword, machine) pairs and
+        DefinitionError records yielded by definition_parser.iter_definitions()
+        as well; the errors are logged, as is anything else that is not a
+        machine (e.g. a bare printname).
         @note We assume that a machine is added to the static graph only once.
+        @raise FrozenGraphException if the lexicon is frozen and @p what has
+                                    edges: a frozen lexicon only accepts new
+                                    words (see get_machine()).
         """
         if isinstance(what, Machine):
-            self.__add_static_recursive(what)
+            if self.graph_store is not None and any(what.partitions):
+                raise FrozenGraphException(
+                    "definitions cannot be added to a frozen lexicon")
+            with _static_lock:
+                replacement = {}
+                self.__add_static_recursive(what, replacement)
+                # only the edges of the replacements have changed
+                changed = set(m.printname() for m in replacement.itervalues())
+                self.__forget_missing()
+                if self.activation_index is not None:
+                    for printname in changed:
+                        self.__index_static(printname)
+                self.__drop_expansion_plans(changed)
+        elif isinstance(what, DefinitionError):
+            logging.error("Error: {0}".format(what))
         # Call for each item in an iterable
-        elif isinstance(what, Iterable):
-            for m in what:
-                self.add_static(m)
+        elif isinstance(what, Iterable) and not isinstance(what, basestring):
+            for item in what:
+                # a (headword, machine) pair
+                if isinstance(item, tuple):
+                    item = item[1]
+                self.add_static(item)
+        else:
+            logging.error("Calling Lexicon.add_static() with an incompatible" +
+                          " type: {0!r}".format(what))
 
     # TODO: dog canonical == dog[faithful]!
     def __add_static_recursive(self, curr_from, replacement=None):
+        """
+        Adds the definition @p curr_from to the static graph: the machines
+        in it are replaced by the corresponding canonical static machines
+        (or added to static as new ones), and their edges are moved to the
+        replacements.
+        """
         if replacement is None:
             replacement = {}
+        # The machines added to static as new, non-canonical entries, and
+        # those already linked into the static graph
+        added, linked = set(), set()
+
+        def enter(machine):
+            if machine in replacement:
+                return False
+            self.__canonize(machine, replacement)
+            if (replacement[machine] is machine and
+                    not machine.deep_case() and
+                    self.static[machine.printname()][0] is not machine):
+                added.add(machine)
+            return True
+
+        def edges(machine):
+            # Snapshot the edges, then remove them (and the parent links) a
+            # partition at a time; after_edge() links the replacements
+            machine_edges = partition_edges(machine)
+            for part_i, part in enumerate(machine.partitions):
+                machine.remove_all(list(part), part_i)
+            return machine_edges
+
+        def after_edge(machine, part_i, child):
+            replacement[machine].append(replacement[child], part_i)
+            linked.add(replacement[child])
+
+        def leave(machine):
+            # Only the back edges of cycles can link a machine before it is
+            # left; those could not be redirected to the duplicate
+            if machine in added and machine not in linked:
+                self.__deduplicate(machine, replacement)
+
+        # Copying the children...
+        walk(curr_from, enter, edges=edges, after_edge=after_edge,
+             leave=leave)
+        return replacement[curr_from]
+
+    def __deduplicate(self, machine, replacement):
+        """
+        Replaces @p machine, a new non-canonical static entry, with an
+        identical one already in static, if there is one. The children of
+        @p machine are static machines by now, so it is identical to another
+        machine iff they have the same name, control type and children; the
+        candidates are looked up by their fingerprint.
+        """
+        key = fingerprint(machine, 1)
+        candidates = self.static_fingerprints.setdefault(key, [])
+        for other in candidates:
+            if (other.printname_ == machine.printname_ and
+                    type(other.control) is type(machine.control) and
+                    len(other.partitions) == len(machine.partitions) and
+                    all(len(p1) == len(p2) and set(p1) == set(p2)
+                        for p1, p2 in zip(other.partitions,
+                                          machine.partitions))):
+                break
+        else:
+            candidates.append(machine)
+            return
+
+        for part_i, part in enumerate(machine.partitions):
+            machine.remove_all(list(part), part_i)
+        self.__remove_entry(machine)
+        replacement[machine] = other
+
+    def __forget_fingerprint(self, machine):
+        """
+        Removes @p machine from the deduplication candidates (see
+        __deduplicate()), if it is one. Must be called before its edges are
+        removed, as they are part of the fingerprint.
+        """
+        key = fingerprint(machine, 1)
+        candidates = self.static_fingerprints.get(key)
+        if candidates is not None and machine in candidates:
+            candidates.remove(machine)
+            if not candidates:
+                del self.static_fingerprints[key]
+
+    def __remove_entry(self, machine):
+        """Removes the non-canonical @p machine from its static entry."""
+        entries = self.static[machine.printname()]
+        for i in xrange(len(entries) - 1, 0, -1):
+            if entries[i] is machine:
+                del entries[i]
+                break
+
+    def __is_canonical(self, machine):
+        """Whether @p machine is the canonical machine of its static
+        entry."""
+        entries = self.static.get(machine.printname())
+        return entries is not None and entries[0] is machine
+
+    def __canonize(self, curr_from, replacement):
+        """
+        Finds the static machine that replaces @p curr_from, and stores it in
+        @p replacement. If @p replacement is empty, @p curr_from is the
+        definition word.
+        """
         #print "Processing word", curr_from
         #sys.stdout.flush()
+        # Deep cases are not canonized
+        if curr_from.deep_case():
+            replacement[curr_from] = curr_from
+        else:
+            """
+            try:
+                if curr_from.printname().isupper():
+                    curr_from.printname_ = curr_from.printname().lower()
+            except AttributeError, e:
+                logging.info('curr_from: {0}, type: {1}'.format(
+                    curr_from, type(curr_from)))
+                raise Exception(e)
+            """
+            #print "Not in replacement"
+            # Does this machine appear in the static tree?
+            from_already_seen = self.__get_disambig_incomplete(
+                curr_from.printname())
+            #print ("from already seen", curr_from.printname(),
+            #       from_already_seen
+            # If not: simply adding the new machine/definition...
+            if len(from_already_seen) == 0:
+                #print "from already seen = 0"
+                # This is the definition word, or no children: accept as
+                # canonical / placeholder
+                if len(curr_from.children()) == 0 or len(replacement) == 0:
+                    #print "adding as canoncical"
+                    from_already_seen = [curr_from]
+                # Otherwise add a placeholder + itself to static
+                else:
+                    #print "adding as placeholder"
+                    from_already_seen = [
+                        Machine(curr_from.printname()), curr_from]
 
-        if curr_from not in replacement:
-            # Deep cases are not canonized
-            if curr_from.deep_case():
+                self.static[curr_from.printname()] = from_already_seen
+                #print ("Adding to static", curr_from.printname(),
+                #       from_already_seen)
+                self.__add_to_disambig(curr_from.printname())
                 replacement[curr_from] = curr_from
-            else:
-                """
-                try:
-                    if curr_from.printname().isupper():
-                        curr_from.printname_ = curr_from.printname().lower()
-                except AttributeError, e:
-                    logging.info('curr_from: {0}, type: {1}'.format(
-                        curr_from, type(curr_from)))
-                    raise Exception(e)
-                """
-                #print "Not in replacement"
-                # Does this machine appear in the static tree?
-                from_already_seen = self.__get_disambig_incomplete(
-                    curr_from.printname())
-                #print ("from already seen", curr_from.printname(),
-                #       from_already_seen
-                # If not: simply adding the new machine/definition...
-                if len(from_already_seen) == 0:
-                    #print "from already seen = 0"
-                    # This is the definition word, or no children: accept as
-                    # canonical / placeholder
-                    if len(curr_from.children()) == 0 or len(replacement) == 0:
-                        #print "adding as canoncical"
-                        from_already_seen = [curr_from]
-                    # Otherwise add a placeholder + itself to static
-                    else:
-                        #print "adding as placeholder"
-                        from_already_seen = [
-                            Machine(curr_from.printname()), curr_from]
-
-                    self.static[curr_from.printname()] = from_already_seen
-                    #print ("Adding to static", curr_from.printname(),
-                    #       from_already_seen)
-                    self.__add_to_disambig(curr_from.printname())
-                    replacement[curr_from] = curr_from
 
 #                    print self.static, self.static_disambig
 
+            else:
+                #print "in static", from_already_seen
+                # Definitions: the word is the canonical one, regardless of
+                # the number of children
+                if len(replacement) == 0:
+                    #print "definition"
+                    canonical = from_already_seen[0]
+                    canonical.printname_ = curr_from.printname()
+                    canonical.control = curr_from.control
+                    replacement[curr_from] = canonical
+                # Handling non-definition words
                 else:
-                    #print "in static", from_already_seen
-                    # Definitions: the word is the canonical one, regardless of
-                    # the number of children
-                    if len(replacement) == 0:
-                        #print "definition"
-                        canonical = from_already_seen[0]
-                        canonical.printname_ = curr_from.printname()
-                        canonical.control = curr_from.control
+                    #print "not definition"
+                    canonical = from_already_seen[0]
+                    # No children: replace with the canonical
+                    if len(curr_from.children()) == 0:
+                        #print "no children"
                         replacement[curr_from] = canonical
-                    # Handling non-definition words
+                    # Otherwise: add the new machine to static, and keep it
                     else:
-                        #print "not definition"
-                        canonical = from_already_seen[0]
-                        # No children: replace with the canonical
-                        if len(curr_from.children()) == 0:
-                            #print "no children"
-                            replacement[curr_from] = canonical
-                        # Otherwise: add the new machine to static, and keep it
-                        else:
-                            #print "children"
-                            replacement[curr_from] = curr_from
-                            from_already_seen.append(curr_from)
-
-            # Copying the children...
-            curr_to = replacement[curr_from]
-            from_partitions = [[m for m in p] for p in curr_from.partitions]
-            for part_i, part in enumerate(from_partitions):
-                for child in part:
-                    #print "found child", child
-                    #Remove to delete any parent links
-                    #print "part before", part, curr_from.partitions[part_i]
-                    curr_from.remove(child, part_i)
-                    #print "part after", part, curr_from.partitions[part_i]
-                    curr_to.append(
-                        self.__add_static_recursive(child, replacement),
-                        part_i)
-
-        return replacement[curr_from]
+                        #print "children"
+                        replacement[curr_from] = curr_from
+                        from_already_seen.append(curr_from)
 
     def __add_to_disambig(self, print_name):
         """Adds @p print_name to the static_disambig."""
+        ambig_name = symbols.base_name(print_name)
         try:
-            self.static_disambig[print_name.split(id_sep)[0]].add(print_name)
+            self.static_disambig[ambig_name].add(print_name)
         except KeyError:
-            self.static_disambig[print_name.split(id_sep)[0]] = set(
-                [print_name])
+            self.static_disambig[ambig_name] = set([print_name])
+
+    def __remove_from_disambig(self, print_name):
+        """Removes @p print_name from the static_disambig."""
+        ambig_name = symbols.base_name(print_name)
+        names = self.static_disambig.get(ambig_name)
+        if names is not None:
+            names.discard(print_name)
+            if not names:
+                del self.static_disambig[ambig_name]
 
     def __get_disambig_incomplete(self, print_name):
         """
@@ -178,7 +415,7 @@ class Lexicon:
             # in static: everything's OK, just return
             return self.static[print_name]
         else:
-            ambig_name = print_name.split(id_sep)[0]
+            ambig_name = symbols.base_name(print_name)
             names = self.static_disambig.get(ambig_name, set())
 #            print "XXX: len(names:", ambig_name, ") ==", len(names), names
             if len(names) == 0:
@@ -201,6 +438,9 @@ class Lexicon:
                     if ambig_name != print_name:
                         names.remove(ambig_name)
                         names.add(print_name)
+                        # rebuilt by the next activate()
+                        self.activation_index = None
+                        self.clear_expansion_plans()
                         already_seen = self.static[ambig_name]
                         del self.static[ambig_name]
                         self.static[print_name] = already_seen
@@ -233,7 +473,7 @@ class Lexicon:
             # in static: everything's OK, just return
             return self.static[print_name]
         else:
-            ambig_name = print_name.split(id_sep)[0]
+            ambig_name = symbols.base_name(print_name)
             names = self.static_disambig.get(ambig_name, set())
 #            print "XXX: len(names:", ambig_name, ") ==", len(names), names
             if len(names) == 0:
@@ -258,21 +498,242 @@ class Lexicon:
         Links the modified nodes to the canonical one.
         """
         for print_name, nodes in self.static.iteritems():
-            if print_name != nodes[0].printname():
-                #len(nodes) > 1 and (
-                #   nodes[0].printname() != nodes[1].printname()):
-                nodes[0].printname_ = print_name
-            # We don't care about deep cases here
-            if not nodes[0].fancy():
-                for node in nodes[1:]:
-                    # HACK don't insert for binaries
-                    if node.unary():
-                        node.append(nodes[0])
+            self.__finalize_entry(print_name, nodes)
         # defaultdict is not safe, so convert it to a regular dict
         self.static_disambig = dict(self.static_disambig)
+        self.__build_activation_index()
+        self.clear_expansion_plans()
         # TODO: remove the id from the print name of unambiguous machines
 
-    def extract_definition_graph(self, deep_cases=False):
+    def __finalize_entry(self, print_name, nodes):
+        """The part of finalize_static() for a single static entry."""
+        if print_name != nodes[0].printname():
+            #len(nodes) > 1 and (
+            #   nodes[0].printname() != nodes[1].printname()):
+            nodes[0].printname_ = print_name
+        # We don't care about deep cases here
+        if not nodes[0].fancy():
+            for node in nodes[1:]:
+                # HACK don't insert for binaries
+                if node.unary():
+                    node.append(nodes[0])
+
+    def load_definitions(self, printnames, closure=False, context=None):
+        """
+        Adds the definitions of @p printnames from @c definitions to the
+        static graph of the finalized lexicon, unless they have already been
+        added. The definitions are copied, so @c definitions is not modified.
+        get_machine() and expand() call this before they look at static.
+
+        The static entry of a printname has machines from every definition
+        that mentions it (and, through the disambiguation of ambiguous
+        names, every definition that mentions another sense of it). So the
+        definitions that mention a name with the same base name as one of
+        @p printnames are added as well, looked up in a mention index that is
+        built from the names of the definitions (see
+        DefinitionStore.names()) on first use.
+
+        The static graph is only complete after all definitions have been
+        loaded (e.g. by freeze()), which makes two differences from adding
+        all of them up front. activate() only finds the machines of the
+        definitions loaded so far: indexing a headword needs its static
+        machines, and loading every definition that mentions any word would
+        load them all. And the non-canonical static machines of a printname
+        are in the order the definitions that contain them were loaded, so
+        e.g. expand() adds their edges in a different order.
+        @param closure if @c True, the definitions of the words in the
+                       definitions are added as well, recursively (expand()
+                       walks all of them).
+        @param context the active context the definitions are loaded for.
+                       The new static machines are queued in every live
+                       context (see activate()).
+        """
+        if self.definitions is None:
+            return
+        with _static_lock:
+            queue = list(printnames)
+            for printname in list(queue):
+                queue.extend(self.__mentions(printname))
+            while queue:
+                printname = queue.pop()
+                if printname in self.loaded_definitions:
+                    continue
+                self.loaded_definitions.add(printname)
+                machines = self.definitions.get(printname)
+                if not machines:
+                    continue
+                names = self.__add_copies(machines)
+                if closure:
+                    queue.extend(names)
+                self.__entries_changed(names)
+
+    def __mentions(self, printname):
+        """The headwords whose definitions mention a name with the same base
+        name as @p printname."""
+        if self.definition_mentions is None:
+            self.definition_mentions = {}
+            for headword in self.definitions.keys():
+                self.__index_mentions(headword)
+        return self.definition_mentions.get(symbols.base_name(printname), ())
+
+    def __index_mentions(self, headword):
+        """Adds the definitions of @p headword to the mention index."""
+        if hasattr(self.definitions, 'names'):
+            names = self.definitions.names(headword)
+        else:
+            names = definition_names(self.definitions.get(headword, ()))
+        names.add(headword)
+        for name in names:
+            self.definition_mentions.setdefault(
+                symbols.base_name(name), set()).add(headword)
+
+    def __add_copies(self, machines):
+        """Adds copies of the definitions @p machines to the static graph.
+        Returns the printnames of the machines in them."""
+        copies = clone_machines(machines)
+        self.add_static(copies[m] for m in machines)
+        return set(m.printname() for m in copies)
+
+    def __entries_changed(self, names):
+        """Does what finalize_static() would have done for the static
+        entries of @p names, which have been changed after it."""
+        for name in names:
+            if name in self.static:
+                self.__finalize_entry(name, self.static[name])
+            if self.activation_index is not None:
+                self.__index_static(name)
+        self.__drop_expansion_plans(names)
+        self.__forget_missing()
+
+    def add_definitions(self, printname, machines, context=None):
+        """
+        Adds the definitions @p machines of the headword @p printname to the
+        static graph of the finalized lexicon, the same way as they would
+        have been added before finalize_static(). The machines are copied.
+        Only the static entries of the words in the definitions are updated,
+        along with their activation index and expansion plans; sentences
+        processed at the same time may see the graph half-changed.
+        @param context the active context the definitions are added in. The
+                       changed static machines are queued in every live
+                       context (see activate()).
+        """
+        self.__update_definitions(printname, machines, False, context)
+
+    def replace_definitions(self, printname, machines, context=None):
+        """The definitions of @p printname are replaced with @p machines;
+        see retract_definitions() and add_definitions()."""
+        self.__update_definitions(printname, machines, True, context)
+
+    def retract_definitions(self, printname, context=None):
+        """
+        Removes the definitions of the headword @p printname from the static
+        graph of the finalized lexicon: the edges of its canonical machine,
+        and the non-canonical machines that were added for the definitions
+        only. The words that are left without edges are removed from static.
+        See add_definitions().
+        """
+        self.__update_definitions(printname, (), True, context)
+
+    def __update_definitions(self, printname, machines, retract, context):
+        """The implementation of add_definitions() and
+        replace_definitions() (with @p retract)."""
+        if self.graph_store is not None:
+            raise FrozenGraphException(
+                "the definitions of a frozen lexicon cannot be changed")
+        machines = list(machines)
+        for machine in machines:
+            if machine.printname() != printname:
+                raise ValueError("{0} is not a definition of {1}".format(
+                    machine.printname(), printname).encode('utf-8'))
+        with _static_lock:
+            if self.definitions is not None:
+                old = () if retract else self.definitions.get(printname, ())
+                self.definitions[printname] = set(old) | set(machines)
+                if self.definition_mentions is not None:
+                    self.__index_mentions(printname)
+                self.__forget_missing()
+                if printname not in self.loaded_definitions:
+                    # load_definitions() adds them on first use
+                    return
+            changed = self.__retract(printname) if retract else set()
+            if machines:
+                changed |= self.__add_copies(machines)
+            self.__entries_changed(changed)
+
+    def __retract(self, printname):
+        """
+        The static graph part of retract_definitions(). Returns the
+        printnames of the static entries changed.
+        """
+        entries = self.static.get(printname)
+        if not entries:
+            return set()
+        canonical = entries[0]
+        # The machines of the definitions: the non-canonical static machines
+        # and deep cases reachable from the canonical one
+        owned = set()
+        stack = [canonical]
+        while stack:
+            for child in stack.pop().children():
+                if child not in owned and not self.__is_canonical(child):
+                    owned.add(child)
+                    stack.append(child)
+        # Deduplicated machines (see __deduplicate()) may be shared with
+        # other definitions; and so are their children
+        inside = owned | set([canonical])
+        stack = [m for m in owned
+                 if any(parent not in inside for parent, _ in m.parents)]
+        shared = set(stack)
+        while stack:
+            for child in stack.pop().children():
+                if child in owned and child not in shared:
+                    shared.add(child)
+                    stack.append(child)
+        dropped = owned - shared
+
+        changed = set([printname])
+        children = set([canonical])
+        for machine in dropped:
+            self.__forget_fingerprint(machine)
+        for machine in chain([canonical], dropped):
+            for part_i, part in enumerate(machine.partitions):
+                children.update(part)
+                machine.remove_all(list(part), part_i)
+        for machine in dropped:
+            if not machine.deep_case():
+                self.__remove_entry(machine)
+                changed.add(machine.printname())
+        # The words only the definitions referred to (and the headword, if
+        # nothing refers to it)
+        for machine in children - dropped:
+            name = machine.printname()
+            if (self.static.get(name) == [machine] and
+                    not any(machine.partitions) and not machine.parents):
+                del self.static[name]
+                self.__remove_from_disambig(name)
+                changed.add(name)
+        return changed
+
+    def freeze(self):
+        """
+        Moves the static graph into an array-backed GraphStore. Must be called
+        after finalize_static(). Afterwards, the machines in static are
+        read-only views of the store, and the lexicon pickles without
+        recursing through the graph. Words added later (e.g. by get_machine())
+        are stored as regular machines. The remaining definitions (see
+        load_definitions()) are added first.
+        """
+        if self.definitions is not None:
+            self.load_definitions(self.definitions.keys())
+        self.graph_store = GraphStore.from_static(self.static,
+                                                  self.static_disambig)
+        self.static = self.graph_store.static_views()
+        # refer to the old machines
+        self.static_fingerprints = {}
+        self.clear_expansion_plans()
+
+    def extract_definition_graph(self, deep_cases=False, sparse=False,
+                                 processes=None):
         """
         Extracts the definition graph from the static graph. The former is a
         "flattened" version of the latter: all canonical words in the
@@ -282,7 +743,15 @@ class Lexicon:
 
         @param deep_cases if @c False (the default), deep cases in the
                           definitions do not appear on the output graph.
+        @param sparse if @c True, the graph is returned as a scipy.sparse
+                      matrix and the names of its nodes, computed in
+                      @p processes worker processes; see
+                      definition_matrix.py.
         """
+        if sparse:
+            # scipy is only needed here
+            from pymachine.definition_matrix import definition_matrix
+            return definition_matrix(self, deep_cases, processes)
         def_graph = {}
         canonicals = set(l[0] for l in self.static.values())
         for name in self.static.keys():
@@ -355,16 +824,20 @@ class Lexicon:
                 if isinstance(what, AVMConstruction):
                     self.avm_constructions[c.avm.name] = c
 
-    def expand(self, machine, zeros_only=False):
+    def expand(self, machine, zeros_only=False, context=None):
         """expanding a machine
         if machine is not active, we raise an exception
         if machine is active but not in knowledge base, we warn the user,
         and do nothing
         if everything is okay, everything from every partition of the
-        static machine is copied to the active one"""
+        static machine is copied to the active one
+        @param context the active context (see active_context.py)."""
+        context = self.active_context(context)
+        active = context.active
         printname = machine.printname()
-        if (printname not in self.active or
-                machine not in self.active[printname]):
+        self.load_definitions([printname], closure=True, context=context)
+        if (printname not in active or
+                machine not in active[printname]):
             raise Exception("""only active machines can be expanded
                             right now, but {0} is not active""".format(
                             printname))
@@ -372,72 +845,181 @@ class Lexicon:
             logging.warning(("expanding a machine ({0}) that is not in " +
                             "knowledge base ie. Lexicon.static").format(
                             repr(printname)))
-            self.active[printname][machine] = True
+            active.add(machine, True)
             return
 
-        for static_machine in self.static[printname]:
+        plans = self.__expansion_plans(printname)
+        for static_machine, plan in zip(self.static[printname], plans):
             #logging.info('activating machine:\n{0}'.format(static_machine))
             #logging.info(
             #    'control dict:\n{0}'.format(static_machine.control.__dict__))
-            machine = self.unify_recursively(
-                static_machine, zeros_only, first=True)
+            if plan is None or any(name in active
+                                   for name in plan.avm_names):
+                machine = self.unify_recursively(
+                    static_machine, zeros_only, first=True, context=context)
+            else:
+                machine = self.__replay(plan, context)
 
             # change expand status in active store
-            self.active[printname][machine] = True
+            active.add(machine, True)
+
+    def __expansion_plans(self, printname):
+        """The expansion plans of the static machines of @p printname, from
+        the LRU cache if possible."""
+        with _static_lock:
+            if self.expansion_plans is None:
+                self.clear_expansion_plans()
+            plans = self.expansion_plans.pop(printname, None)
+            if plans is None:
+                plans = [ExpansionPlan(static_machine)
+                         for static_machine in self.static[printname]]
+                for plan in plans:
+                    for name in plan.names:
+                        self.plans_using.setdefault(name, set()).add(
+                            printname)
+            self.expansion_plans[printname] = plans
+            while len(self.expansion_plans) > self.expansion_cache_size:
+                self.__drop_expansion_plan(next(iter(self.expansion_plans)))
+            return plans
+
+    def __drop_expansion_plan(self, printname):
+        """Removes the plans of @p printname from the cache."""
+        for plan in self.expansion_plans.pop(printname):
+            for name in plan.names:
+                users = self.plans_using.get(name)
+                if users is not None:
+                    users.discard(printname)
+                    if not users:
+                        del self.plans_using[name]
+
+    def __drop_expansion_plans(self, static_names):
+        """Removes the plans that visit a static machine whose printname is
+        in @p static_names."""
+        if self.expansion_plans is None:
+            return
+        for name in static_names:
+            for printname in list(self.plans_using.get(name, ())):
+                self.__drop_expansion_plan(printname)
+
+    def clear_expansion_plans(self):
+        """Empties the expansion plan cache. Must be called if the static
+        graph is modified other than by add_static()."""
+        # printname -> the ExpansionPlans of its static machines
+        self.expansion_plans = OrderedDict()
+        # static printname -> the printnames whose plans visit it
+        self.plans_using = {}
+
+    def __replay(self, plan, context):
+        """The same as unify_recursively(), but following @p plan. In overlay
+        mode, the new machines are OverlayMachines, and the edges are added
+        when they are first needed (see overlay.py)."""
+        active = context.active
+        machines = []
+        for name, control in zip(plan.names, plan.controls):
+            if name in active:
+                active_machine = active.first(name)
+            elif name.startswith('#'):
+                self.wake_avm_construction(name, context)
+                active_machine = None
+            else:
+                if self.overlay:
+                    active_machine = OverlayMachine(name, control)
+                else:
+                    active_machine = Machine(name)
+                    active_machine.set_control(copy.copy(control))
+                self.__add_active_machine(active_machine, context)
+            machines.append(active_machine)
+        if self.overlay:
+            overlay_plan(plan, machines)
+        else:
+            for parent_i, part_i, child_i in plan.edges:
+                machines[parent_i].append(machines[child_i], part_i)
+        return machines[0]
 
     def unify_recursively(self, static_machine, zeros_only, first=False,
-                          stop=None):
+                          stop=None, context=None):
         """Returns the active machine that corresponds to @p static_machine. It
         recursively unifies all machines in all partitions of @p static_machine
         with machines in the active set. @p static_machine may be either a
         machine or a string.
-        @param stop the set of machines already unified."""
+        @param stop the set of machines already unified.
+        @param context the active context (see active_context.py)."""
+        context = self.active_context(context)
         if stop is None:
             stop = set()
+        # The active machines that correspond to the static machines on the
+        # path walked
+        results = []
 
-        if unicode(static_machine) == u'IS_A':
-            return None
+        def enter(machine):
+            active_machine, walk_on = self.__unify_machine(machine, stop,
+                                                           context)
+            results.append(active_machine)
+            return walk_on
+
+        def after_edge(machine, part_i, child):
+            as_machine = results.pop()
+            if as_machine is not None:
+                #logging.info('adding {} to part {} of {}'.format(
+                #    as_machine, i, active_machine))
+                results[-1].append(as_machine, part_i)
+
+        # Now we have to walk through the tree
+        walk(static_machine, enter, after_edge=after_edge)
+        return results.pop()
+
+    def __unify_machine(self, static_machine, stop, context):
+        """
+        The non-recursive part of unify_recursively(). Returns the active
+        machine for @p static_machine (or @c None), and whether the
+        partitions of @p static_machine should be unified as well.
+        """
+        # (a machine's unicode() is never 'IS_A', it contains its id)
+        if (isinstance(static_machine, basestring) and
+                unicode(static_machine) == u'IS_A'):
+            return None, False
         # If we have already unified this machine: just return
         if (not isinstance(static_machine, str) and
                 not isinstance(static_machine, unicode)):
             static_printname = static_machine.printname()
         else:
             static_printname = static_machine
+        active = context.active
         if static_printname in stop:
             #logging.debug('ur stops')
-            return self.active[static_printname].keys()[0]
+            return active.first(static_printname), False
         #If static_machine is a string, we don't have much to do
         #logging.debug('ur static_machine {0}, type: {1}'.format(
         #   str(static_machine), str(type(static_machine))))
         if isinstance(static_machine, str):
-            if static_machine in self.active:
+            if static_machine in active:
                 # FIXME: [0] is a hack, fix it
                 #logging.debug('ur str in active')
-                return self.active[static_machine].keys()[0]
+                return active.first(static_machine), False
             else:
                 if static_machine.startswith('#'):
                     #logging.debug('ur waking up')
-                    self.wake_avm_construction(static_machine)
-                    return None
+                    self.wake_avm_construction(static_machine, context)
+                    return None, False
                 #logging.debug('ur activating str')
                 active_machine = Machine(static_machine, ConceptControl())
-                self.__add_active_machine(active_machine)
-                return active_machine
+                self.__add_active_machine(active_machine, context)
+                return active_machine, False
         # If it's a machine, we create the corresponding active one
         elif isinstance(static_machine, Machine):
             static_name = static_machine.printname()
             #logging.debug('Does {0} start with #? {1}'.format(
             #   static_name, static_name.startswith('#')))
 
-            if static_name in self.active:
+            if static_name in active:
                 #logging.debug('ur machine in active')
-                active_machine = self.active[static_name].keys()[0]
+                active_machine = active.first(static_name)
             else:
                 #logging.debug('Not in active')
                 if static_name.startswith('#'):
                     #logging.debug('ur waking up')
-                    self.wake_avm_construction(static_name)
-                    return None
+                    self.wake_avm_construction(static_name, context)
+                    return None, False
                 #logging.debug('ur activating machine')
                 active_machine = Machine(static_name)
                 active_control = copy.copy(static_machine.control)
@@ -446,129 +1028,231 @@ class Lexicon:
                 #works, since the active machine will update the control's
                 #machine attribute (and we don't know of anything else)
                 active_machine.set_control(active_control)
-                self.__add_active_machine(active_machine)
+                self.__add_active_machine(active_machine, context)
 
             stop.add(static_name)
-
-            # Now we have to walk through the tree recursively
-            for i, part in enumerate(static_machine.partitions):
-                for ss_machine in part:
-                    as_machine = self.unify_recursively(
-                        ss_machine, zeros_only, first=False, stop=stop)
-                    if as_machine is not None:
-                        #logging.info('adding {} to part {} of {}'.format(
-                        #    as_machine, i, active_machine))
-                        active_machine.append(as_machine, i)
-            return active_machine
+            return active_machine, True
         else:
             raise TypeError('static_machine must be a Machine or a str')
 
-    def wake_avm_construction(self, avm_name):
+    def wake_avm_construction(self, avm_name, context=None):
         """
-        Copies an AVM construction from @c avm_constructions to
-        @c constructions (that is, "wakes" it up).
+        Copies an AVM construction from @c avm_constructions to the
+        constructions of the active context (that is, "wakes" it up).
         """
         avm_construction = self.avm_constructions.get(avm_name[1:])
         # TODO
-        if (avm_construction is not None and
-                avm_construction not in self.constructions):
-            self.constructions.append(avm_construction)
+        if avm_construction is not None:
+            self.active_context(context).wake_avm_construction(
+                avm_construction)
 
-    def activate(self):
+    def activate(self, context=None):
         """Finds and returns the machines that should be activated by the
         machines already active. These machines are automatically added
-        to self.active as well
+        to the active context as well
 
         When exactly a machine should be activated is still up for
-        consideration; however, currently this method returns a machine if
-        all non-primitive machines on its partitions are active."""
-        activated = []
+        consideration; activate() has always compared the unicode() of the
+        children of a static machine with the active printnames, skipping
+        the AVMs ('#'). The unicode() of a machine contains its id, so it
+        never matches: a machine is only activated if all its children are
+        AVMs, and these are exactly the ones in the activation index.
 
-        for printname, static_machines in self.static.iteritems():
-            for static_machine in static_machines:
-                if printname in self.active:
-                    continue
-                has_machine = False
-                for machine in chain(*static_machine.partitions):
-                    has_machine = True
-                    if (not unicode(machine).startswith(u'#') and
-                            unicode(machine) not in self.active):
-                        break
-                else:
-                    if has_machine:
-                        m = Machine(printname,
-                                    copy.copy(static_machine.control))
-                        self.add_active(m)
-                        activated.append(m)
+        The static machines are not scanned: each context queues the machines
+        of the index when it is created (and every live context queues those
+        indexed later, e.g. when definitions are loaded), and activate()
+        takes them off the queue.
+        @param context the active context (see active_context.py)."""
+        context = self.active_context(context)
+        if self.activation_index is None:
+            with _static_lock:
+                if self.activation_index is None:
+                    self.__build_activation_index()
+        activated = []
+        queue, context.activation_queue = context.activation_queue, []
+        for printname, i in queue:
+            if printname in context.active:
+                continue
+            # (the machines are indexed again when their entry changes)
+            if i not in self.activation_index.get(printname, ()):
+                continue
+            static_machines = self.static.get(printname, ())
+            m = Machine(printname, copy.copy(static_machines[i].control))
+            self.add_active(m, context)
+            activated.append(m)
         return activated
 
-    def is_expanded(self, m):
+    def __build_activation_index(self):
+        """Builds the activation index of the whole static graph, and queues
+        its machines in every live context again (activate() skips the
+        printnames already active)."""
+        self.activation_index = {}
+        contexts = self.__live_contexts()
+        for context in contexts:
+            context.activation_queue = []
+        for printname in self.static.keys():
+            self.__index_static(printname, contexts)
+
+    def __index_static(self, printname, contexts=None):
+        """(Re)builds the activation index of the static machines of
+        @p printname, and queues them in @p contexts (by default, every live
+        context)."""
+        if contexts is None:
+            contexts = self.__live_contexts()
+        self.activation_index.pop(printname, None)
+        indices = []
+        for i, static_machine in enumerate(self.static.get(printname, ())):
+            names = [child.printname()
+                     for child in chain(*static_machine.partitions)]
+            if names and all(name.startswith(u'#') for name in names):
+                indices.append(i)
+                for context in contexts:
+                    context.activation_queue.append((printname, i))
+        if indices:
+            self.activation_index[printname] = tuple(indices)
+
+    def __live_contexts(self):
+        """The active contexts in use (see new_context())."""
+        return list(self.live_contexts) if self.live_contexts else []
+
+    def activation_keys(self):
+        """The (printname, index in static) keys of the machines in the
+        activation index (none if it has not been built)."""
+        # (the index changes when definitions are loaded)
+        with _static_lock:
+            if self.activation_index is None:
+                return []
+            return [(printname, i)
+                    for printname, indices in
+                    self.activation_index.iteritems()
+                    for i in indices]
+
+    def is_expanded(self, m, context=None):
         """Returns whether m is expanded or not"""
         printname = m.printname()
         try:
-            return self.active[printname][m]
+            return self.active_context(context).active[printname][m]
         except KeyError:
             logging.error("asking whether a machine is expanded about a " +
                           "non-active machine")
             logging.debug("This machine is: " + m.printname())
             return None
 
-    def get_expanded(self, inverse=False):
-        """Returns the list of expanded machines."""
-        result = []
-        for pn, machines in self.active.iteritems():
-            for machine in machines:
-                # if inverse: return unexpandeds
-                if inverse ^ machines[machine]:
-                    result.append(machine)
-        return result
+    def get_expanded(self, inverse=False, context=None):
+        """Returns the list of expanded machines (or, if @p inverse, the
+        unexpanded ones) in the order they were expanded (activated)."""
+        active = self.active_context(context).active
+        # if inverse: return unexpandeds
+        return list(active.unexpanded if inverse else active.expanded)
 
-    def get_unexpanded(self):
-        return self.get_expanded(True)
+    def get_unexpanded(self, context=None):
+        return self.get_expanded(True, context)
 
-    def active_machines(self):
-        return [v.keys()[0] for v in self.active.values()]
+    def active_machines(self, context=None):
+        """The first active machine of each printname, in the order they
+        became active (a tuple, see ActiveStore.first_machines())."""
+        return self.active_context(context).active.first_machines()
 
     def clear_active(self):
         """
-        Resets the lexicon to the default (inactive) state. Must be called
-        between activation phases.
+        Resets the lexicon's own active context to the default (inactive)
+        state. Must be called between activation phases that do not use
+        contexts of their own (see new_context()).
         """
-        self.active = {}
+        self.context = self.new_context()
         # HACK
         #self.unify_recursively('train')
 
-        # Resets the AVM constructions.
-        avm_constructions = [c for c in self.constructions
-                             if c.type_ == Construction.AVM]
-        for c in avm_constructions:
-            c.avm.clear()
-            if c in self.avm_constructions.values():
-                self.constructions.remove(c)
-
     def test_static_graph_building():
         """Tests the static graph building procedure."""
         pass
 
-    def get_machine(self, printname, second=False):
+    def get_machine(self, printname, context=None):
         if printname == 'have':
             logging.debug('have is changed to HAS')
             #logging.info('interpreting a form of "have" as "HAS"')
-            return self.get_machine("HAS")
-
-        if printname in self.active:
-            return self.active[printname].keys()[0]
-
-        cands = self.get_static_machine(printname)
-        if not cands:
-            if second:
-                raise Exception(
-                    "no machine with printname {0}".format(printname) +
-                    "even after calling add_static for {0}".format(
-                        Machine(printname, ConceptControl())))
-            #logging.warning(
-                #"creating new machine for '{0}'".format(printname))
-            self.add_static(Machine(printname, ConceptControl()))
-            return self.get_machine(printname, second=True)  # sanity check
-
-        return cands[0]
+            return self.get_machine("HAS", context=context)
+
+        context = self.active_context(context)
+        self.load_definitions([printname], context=context)
+        if printname in context.active:
+            return context.active.first(printname)
+
+        #logging.warning(
+            #"creating new machine for '{0}'".format(printname))
+        resolution = self.resolve_many([printname], True, context)
+        if printname not in resolution.machines:
+            raise Exception(
+                "no machine with printname {0}".format(printname) +
+                "even after calling add_static for {0}".format(
+                    Machine(printname, ConceptControl())))
+        return resolution.machines[printname]
+
+    def resolve_many(self, names, create=False, context=None):
+        """
+        Looks up the static machines of @p names (printnames, ambiguous or
+        not) the way get_static_machine() does, in one pass: the definitions
+        of the names (see load_definitions()) are loaded together, and the
+        names known to be missing are not looked up again until static
+        changes.
+        @param create if @c True, the missing names are added to static as
+                      new words, as get_machine() does.
+        @param context the active context the new static machines are
+                       indexed for (see activate()).
+        @return a Resolution: the canonical static machine of each name that
+                was found (or created), and the names that were created,
+                ambiguous or missing.
+        """
+        resolution = Resolution()
+        names = list(OrderedDict.fromkeys(names))
+        with _static_lock:
+            if self.missing_names is None:
+                self.missing_names = set()
+            missing_names = self.missing_names
+            self.load_definitions(
+                [name for name in names if name not in missing_names],
+                context=context)
+            new = []
+            for name in names:
+                if name in missing_names or not self.__resolve_name(
+                        name, resolution):
+                    new.append(name)
+            for name in new:
+                if name in resolution.ambiguous:
+                    continue
+                if create:
+                    # (it may have been created with an earlier name)
+                    if self.__resolve_name(name, resolution):
+                        continue
+                    self.add_static(Machine(name, ConceptControl()))
+                    if self.__resolve_name(name, resolution):
+                        resolution.created.append(name)
+                        continue
+                resolution.missing.append(name)
+                if len(missing_names) >= self.missing_cache_size:
+                    missing_names.clear()
+                missing_names.add(name)
+        return resolution
+
+    def __resolve_name(self, name, resolution):
+        """The part of resolve_many() for @p name. Returns whether it was
+        found."""
+        entries = self.static.get(name)
+        if entries is None:
+            ambig_name = symbols.base_name(name)
+            names = self.static_disambig.get(ambig_name, ())
+            if ambig_name != name or not names:
+                return False
+            if len(names) > 1:
+                resolution.ambiguous[name] = sorted(names)
+                return False
+            for full_name in names:
+                entries = self.static[full_name]
+        resolution.machines[name] = entries[0]
+        return True
+
+    def __forget_missing(self):
+        """Empties the negative cache of resolve_many() after static (or the
+        definitions) changed."""
+        if self.missing_names:
+            self.missing_names.clear()
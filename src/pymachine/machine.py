@@ -4,20 +4,260 @@ from itertools import chain
 import re
 
 from pymachine.control import Control
+from pymachine.symbols import symbols
+from pymachine.traversal import traverse
 from constants import deep_pre, avm_pre, enc_pre
 
+# Shared by all machines without incoming edges (e.g. definition roots);
+# add_parent_link() replaces it with a list on the first link, which in turn
+# becomes a set once it grows larger than this (hubs such as 'IS_A').
+_no_parents = ()
+_max_parent_list = 8
+# Partitions up to this size are searched linearly; larger ones (e.g. those
+# of 'IS_A' or '=AGT') keep an index of their members as well.
+_max_partition_list = 8
+
+
+def _forgets_members(method):
+    """Wraps a list mutator of Partition that may change its members."""
+    def wrapper(self, *args):
+        self._members = None
+        return method(self, *args)
+    wrapper.__name__ = method.__name__
+    return wrapper
+
+
+class _MemberIndex(dict):
+    """The index of a large Partition: machine -> upper bound of its
+    position, and the drift of the positions."""
+    __slots__ = ('drift',)
+
+    def __init__(self, items):
+        dict.__init__(self, items)
+        self.drift = 0
+
+
+class Partition(list):
+    """
+    A partition of a machine: an insertion-ordered set of machines. It is a
+    list, so indexing and iteration work as before, but append() and extend()
+    skip the machines already in it, and membership tests are O(1) for large
+    partitions.
+
+    The index of a large partition (a _MemberIndex) maps each member to an
+    upper bound of its position: removing a machine shifts the ones after it
+    to the left by one, which is recorded in the drift of the index instead
+    of updating their positions, so remove() only has to search the
+    drift + 1 places below the bound. The positions are recomputed once the
+    square of the drift exceeds the size of the partition.
+
+    The other list mutators (item and slice assignment, insert(), pop(), ...)
+    may still be used, but they do not check for duplicates.
+    """
+    __slots__ = ('_members',)
+
+    def __init__(self, machines=()):
+        list.__init__(self)
+        # the _MemberIndex if the partition is large, None if it has not been
+        # built yet (or has been invalidated)
+        self._members = None
+        if machines:
+            self.extend(machines)
+
+    def __reduce__(self):
+        # the items are appended after the partition has been created (and
+        # memoized), so cyclic graphs can be pickled and deep-copied
+        return self.__class__, (), None, iter(self)
+
+    def __index_members(self):
+        """Builds (and returns) the index of the members."""
+        members = self._members = _MemberIndex(
+            (machine, i) for i, machine in enumerate(self))
+        return members
+
+    def __contains__(self, machine):
+        members = self._members
+        if members is None:
+            if len(self) <= _max_partition_list:
+                return list.__contains__(self, machine)
+            members = self.__index_members()
+        return machine in members
+
+    def append(self, machine):
+        """Appends @p machine if it is not in the partition yet.
+        @return whether it was appended."""
+        if machine in self:
+            return False
+        list.append(self, machine)
+        if self._members is not None:
+            self._members[machine] = len(self) - 1
+        return True
+
+    def extend(self, machines):
+        """Appends the machines not in the partition yet, in one pass.
+        @return the list of the machines appended."""
+        members = self._members
+        if members is None:
+            members = self.__index_members()
+        added = []
+        position = len(self)
+        for machine in machines:
+            if machine not in members:
+                members[machine] = position
+                position += 1
+                added.append(machine)
+        list.extend(self, added)
+        if len(self) <= _max_partition_list:
+            self._members = None
+        return added
+
+    def __iadd__(self, machines):
+        self.extend(machines)
+        return self
+
+    def remove(self, machine):
+        """Removes @p machine; a large partition finds it through its index.
+        @raise ValueError if @p machine is not in the partition."""
+        members = self._members
+        if members is None:
+            if len(self) <= _max_partition_list:
+                list.remove(self, machine)
+                return
+            members = self.__index_members()
+        if machine not in members:
+            raise ValueError("machine not in partition")
+        bound = members.pop(machine)
+        list.__delitem__(self, list.index(
+            self, machine, max(0, bound - members.drift), bound + 1))
+        members.drift += 1
+        if members.drift * members.drift > len(self):
+            self.__index_members()
+
+    def remove_all(self, machines):
+        """Removes the members of @p machines (an iterable) in one pass.
+        @return the list of the machines removed, in partition order."""
+        drop = machines if isinstance(machines, (set, frozenset)) else set(
+            machines)
+        removed, kept = [], []
+        for machine in self:
+            (removed if machine in drop else kept).append(machine)
+        if removed:
+            list.__setitem__(self, slice(None), kept)
+            self._members = None
+        return removed
+
+    def replace(self, old, new):
+        """Replaces @p old with @p new in place; if @p new is already in the
+        partition, @p old is simply removed."""
+        if new is old:
+            self.index(old)
+            return
+        if new in self:
+            self.remove(old)
+            return
+        members = self._members
+        if members is None:
+            list.__setitem__(self, self.index(old), new)
+            return
+        if old not in members:
+            raise ValueError("machine not in partition")
+        bound = members.pop(old)
+        index = list.index(self, old, max(0, bound - members.drift),
+                           bound + 1)
+        list.__setitem__(self, index, new)
+        members[new] = index
+
+    __setitem__ = _forgets_members(list.__setitem__)
+    __delitem__ = _forgets_members(list.__delitem__)
+    __setslice__ = _forgets_members(list.__setslice__)
+    __delslice__ = _forgets_members(list.__delslice__)
+    insert = _forgets_members(list.insert)
+    pop = _forgets_members(list.pop)
+    sort = _forgets_members(list.sort)
+    reverse = _forgets_members(list.reverse)
+
+
+def _read_only(method):
+    """Wraps a mutator of the shared empty partition to raise."""
+    def wrapper(self, *args):
+        raise TypeError("the shared empty partition cannot be changed, "
+                        "add machines with Machine.append()")
+    wrapper.__name__ = method.__name__
+    return wrapper
+
+
+class _EmptyPartition(Partition):
+    """
+    The empty partition shared by all machines (see Machine.__init__()), so
+    that a unary concept created with the default three partitions does not
+    carry two empty Partition objects. It cannot be changed: Machine creates
+    a partition of its own when it first adds a machine there.
+    """
+    __slots__ = ()
+
+    def __reduce__(self):
+        # pickled (and copied) as a reference to the shared instance
+        return '_empty_partition'
+
+    append = _read_only(Partition.append)
+    extend = _read_only(Partition.extend)
+    __iadd__ = _read_only(Partition.__iadd__)
+    __setitem__ = _read_only(Partition.__setitem__)
+    __setslice__ = _read_only(Partition.__setslice__)
+    insert = _read_only(Partition.insert)
+    sort = _read_only(Partition.sort)
+    reverse = _read_only(Partition.reverse)
+
+
+_empty_partition = _EmptyPartition()
+
 
 class Machine(object):
+    # A full lexicon contains millions of machines, so they don't get a
+    # __dict__. Subclasses must declare __slots__ as well.
+    # The printname is stored as its Symbol in the global symbol table.
+    # _fingerprints caches the labels computed by fingerprint.fingerprint().
+    __slots__ = ('_symbol', 'partitions', 'control', 'parents',
+                 '_fingerprints')
+
     def __init__(self, name, control=None, part_num=3):
         if not name:
             logging.warning('empty printname! replacing with "???"')
             name = "???"
+        self._fingerprints = None
         self.printname_ = name
         # if name.isupper():
         #     part_num = 3  # TODO crude, but effective
-        self.partitions = [[] for i in range(part_num)]
+        # empty partitions are shared until a machine is added to them (see
+        # _EmptyPartition)
+        self.partitions = [_empty_partition] * part_num
         self.set_control(control)
-        self.parents = set()
+        self.parents = _no_parents
+
+    def __getstate__(self):
+        return self.printname_, self.partitions, self.control, self.parents
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # pickled before Machine had __slots__
+            state = (state['printname_'], state['partitions'],
+                     state['control'], state['parents'])
+        printname, partitions, self.control, parents = state
+        # plain lists if pickled before partitions were sets
+        self.partitions = [Partition(part) if part else _empty_partition
+                           for part in partitions]
+        self._fingerprints = None
+        self.printname_ = printname
+        self.parents = parents if parents else _no_parents
+
+    def _get_printname_(self):
+        return self._symbol.name
+
+    def _set_printname_(self, name):
+        self._symbol = symbols.id(name)
+        self._invalidate_fingerprints()
+
+    printname_ = property(_get_printname_, _set_printname_)
 
     def __repr__(self):
         return str(self)
@@ -56,30 +296,27 @@ class Machine(object):
               keep_orig=False):
         """
         moves all incoming and outgoing links of machine2 to machine1.
-        The list() part is essential in all three places (going through
-        partitions, machines of partitions, and parents), because that creates
-        a new list, but doesn't copy the machines themselves, as deepcopy would
+        The edges are moved a partition at a time (see append_all() and
+        remove_all()), and each parent of machine2 replaces it in place, so
+        merging hubs takes time linear in the number of edges.
         """
         # logging.info('unifying {0}'.format(machine2.printname()))
-        for i, part in enumerate(list(machine2.partitions)):
-            for m in list(part):
-                if (
-                        i == 0 and m.printname().startswith('=') and
-                        exclude_0_case):
-                    continue
-                if exclude_negation and m.printname() == 'not':
-                    continue
-                # logging.info('actually moving edge')
-                self.append(m, i)
-                if not keep_orig:
-                    machine2.remove(m, i)
+        for i, part in enumerate(machine2.partitions):
+            moved = [m for m in part if not (
+                (i == 0 and exclude_0_case and
+                 m.printname().startswith('=')) or
+                (exclude_negation and m.printname() == 'not'))]
+            self.append_all(moved, i)
+            if not keep_orig:
+                machine2.remove_all(moved, i)
 
         # logging.info('parents: {0}'.format(list(machine2.parents)))
         for parent, i in list(machine2.parents):
             # logging.info('parent: {0}'.format(parent.printname()))
-            if not keep_orig:
-                parent.remove(machine2, i)
-            parent.append(self, i)
+            if keep_orig:
+                parent.append(self, i)
+            else:
+                parent.replace(machine2, self, i)
 
     def dot_id(self):
         """node id for dot output"""
@@ -88,7 +325,7 @@ class Machine(object):
 
     def dot_printname(self):
         """printname for dot output"""
-        return self.printname_.split('/')[0].replace('-', '_')
+        return self.printname().replace('-', '_')
 
     @staticmethod
     def d_clean(string):
@@ -105,9 +342,11 @@ class Machine(object):
         return s
 
     def printname(self):
-        if '/' in self.printname_:
-            return self.printname_.split('/')[0]
-        return self.printname_
+        return self._symbol.base_name
+
+    def symbol(self):
+        """The Symbol of the full printname (printname_)."""
+        return self._symbol
 
     def unique_name(self):
         return u"{0}_{1}".format(self.printname(), id(self))
@@ -136,24 +375,28 @@ class Machine(object):
     def unique_machines_in_tree(self):
         """Returns all unique machines under (and including)
         the current one."""
-        def __recur(m):
-            visited.add(m)
-            for child in m.children():
-                if child not in visited:
-                    __recur(child)
-
-        visited = set()
-        __recur(self)
-        return visited
+        return set(m for m, _ in traverse([self]))
 
     def append_all(self, what_iter, which_partition=0):
-        """ Mass append function that calls append() for every object """
+        """
+        Adds the Machine instances in @p what_iter to the specified partition
+        in one pass.
+        """
         from collections import Iterable
-        if isinstance(what_iter, Iterable):
-            for what in what_iter:
-                self.append(what, which_partition)
-        else:
+        if not isinstance(what_iter, Iterable):
             raise TypeError("append_all only accepts iterable objects.")
+        machines = []
+        for what in what_iter:
+            if isinstance(what, Machine):
+                machines.append(what)
+            elif what is not None:
+                raise TypeError(
+                    "Only machines and strings can be added to partitions")
+        added = self.partition(which_partition).extend(machines)
+        for what in added:
+            what.add_parent_link(self, which_partition)
+        if added:
+            self._invalidate_fingerprints()
 
     def append(self, what, which_partition=0):
         """
@@ -163,34 +406,56 @@ class Machine(object):
         # logging.debug(u"{0}.append(
         #    {1},{2})".format(self.printname(), what.printname(),
         #    which_partition).encode("utf-8"))
-        if len(self.partitions) > which_partition:
-            if what in self.partitions[which_partition]:
-                return
-        else:
-            self.partitions += [[] for i in range(which_partition + 1 -
-                                len(self.partitions))]
-
-        self.__append(what, which_partition)
-
-    def __append(self, what, which_partition):
-        """Helper function for append()."""
         if isinstance(what, Machine):
-            self.partitions[which_partition].append(what)
-            what.add_parent_link(self, which_partition)
+            if self.partition(which_partition).append(what):
+                what.add_parent_link(self, which_partition)
+                self._invalidate_fingerprints()
         elif what is None:
             pass
         else:
             raise TypeError(
                 "Only machines and strings can be added to partitions")
 
+    def partition(self, which_partition):
+        """
+        The partition @p which_partition, to add machines to: empty
+        partitions are added up to it, and it replaces the shared empty
+        partition with one of its own.
+        """
+        partitions = self.partitions
+        if len(partitions) <= which_partition:
+            partitions += [_empty_partition] * (
+                which_partition + 1 - len(partitions))
+        partition = partitions[which_partition]
+        if partition is _empty_partition:
+            partition = partitions[which_partition] = Partition()
+        return partition
+
     def remove_all(self, what_iter, which_partition=None):
-        """ Mass remove function that calls remove() for every object """
+        """
+        Removes the machines in @p what_iter from the specified partition (or,
+        if @p which_partition is @c None, from all partitions on which they
+        are found) in one pass.
+        """
         from collections import Iterable
-        if isinstance(what_iter, Iterable):
-            for what in what_iter:
-                self.remove(what, which_partition)
+        if not isinstance(what_iter, Iterable):
+            raise TypeError("remove_all only accepts iterable objects.")
+        drop = set(what_iter)
+        if which_partition is not None:
+            if len(self.partitions) <= which_partition:
+                return
+            removed = self.partitions[which_partition].remove_all(drop)
+            if len(removed) != len(drop):
+                raise ValueError("machine not in partition {0}".format(
+                    which_partition))
+            links = [(what, which_partition) for what in removed]
         else:
-            raise TypeError("append_all only accepts iterable objects.")
+            links = [(what, part_i)
+                     for part_i, part in enumerate(self.partitions)
+                     for what in part.remove_all(drop)]
+        for what, part_i in links:
+            what.del_parent_link(self, part_i)
+        self._invalidate_fingerprints()
 
     def remove(self, what, which_partition=None):
         """
@@ -201,18 +466,60 @@ class Machine(object):
         if which_partition is not None:
             if len(self.partitions) > which_partition:
                 self.partitions[which_partition].remove(what)
+                if isinstance(what, Machine):
+                    what.del_parent_link(self, which_partition)
         else:
-            for partition, _ in enumerate(self.partitions):
-                self.partitions[partition].remove(what)
+            for part_i, partition in enumerate(self.partitions):
+                if what in partition:
+                    partition.remove(what)
+                    if isinstance(what, Machine):
+                        what.del_parent_link(self, part_i)
+        self._invalidate_fingerprints()
+
+    def replace(self, old, new, which_partition):
+        """
+        Replaces @p old with @p new in the specified partition, keeping its
+        position (@p old is just removed if @p new is already there).
+        """
+        self.partitions[which_partition].replace(old, new)
+        old.del_parent_link(self, which_partition)
+        new.add_parent_link(self, which_partition)
+        self._invalidate_fingerprints()
 
-        if isinstance(what, Machine):
-            what.del_parent_link(self, which_partition)
+    def _invalidate_fingerprints(self):
+        """
+        Drops the cached fingerprints of the machine and its ancestors. The
+        ancestors of a machine without a cache have none either (computing
+        theirs would have filled it), so the walk stops there.
+        """
+        if self._fingerprints is None:
+            return
+        stack = [self]
+        while stack:
+            machine = stack.pop()
+            if machine._fingerprints is not None:
+                machine._fingerprints = None
+                stack.extend(parent for parent, _ in machine.parents)
 
     def add_parent_link(self, whose, part):
-        self.parents.add((whose, part))
+        link = (whose, part)
+        parents = self.parents
+        if type(parents) is set:
+            parents.add(link)
+        elif parents is _no_parents:
+            self.parents = [link]
+        elif link not in parents:
+            if len(parents) < _max_parent_list:
+                parents.append(link)
+            else:
+                parents = self.parents = set(parents)
+                parents.add(link)
 
     def del_parent_link(self, whose, part):
-        self.parents.remove((whose, part))
+        link = (whose, part)
+        if link not in self.parents:
+            raise KeyError(link)
+        self.parents.remove(link)
 
 # ##################################
 # ## Machine-type-related methods
@@ -214,12 +214,15 @@ class FillArgumentOperator(Operator):
 
 class ExpandOperator(Operator):
     """Expands an active machine."""
-    def __init__(self, lexicon, working_area=None):
+    def __init__(self, lexicon, working_area=None, context=None):
         """
         @param lexicon the lexicon.
+        @param context the active context the machine is expanded in (see
+                       active_context.py); the lexicon's own, if @c None.
         """
         Operator.__init__(self, working_area)
         self.lexicon = lexicon
+        self.context = context
 
     def act(self, input):
         """
@@ -228,5 +231,5 @@ class ExpandOperator(Operator):
         logging.debug(
             "ExpandOperator acting on input {0} and working area {0}".format(
                 input, self.working_area[0]))
-        self.lexicon.expand(input)
+        self.lexicon.expand(input, context=self.context)
         self.working_area[0] = input
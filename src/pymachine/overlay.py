@@ -0,0 +1,174 @@
+"""Copy-on-write active machines.
+
+By default, Lexicon.expand() copies the whole static subgraph reachable from
+the expanded word into the active graph: every edge is added and the control
+of every new machine is copied, only to be thrown away by clear_active() at
+the end of the sentence.
+
+In overlay mode (Lexicon(overlay=True)), expand() resolves the active machines
+of its expansion plan (see expansion.py) the same way, but the machines it
+creates are OverlayMachines, and the edges of the plan are not added yet: each
+OverlayMachine remembers the plans (and the active machines they were
+resolved to) whose edges start from it, and adds them when its partitions are
+first looked at; its control is copied on first access as well. Its children
+remember the same plans, so that looking at their parents adds the edges from
+the deferred parents first. The static graph is never modified.
+
+The active graph is the one the eager expansion builds: the same machines are
+active (they are created, not copied, by expand()), each expanded static
+machine only contributes the edges unify_recursively() would add in that
+call (the plan follows its per-call stop set), and the edges of a partition
+are in the same order, because the plans of a machine are replayed in the
+order they were expanded, and a machine whose partitions have been copied
+gets the edges of later plans right away. Only the order of the parent links
+can differ. Edges to machines that are not overlays (e.g. the words of the
+sentence) are added right away, as the parents of those cannot be deferred.
+Like the eager expansion, the overlay ignores @p zeros_only.
+
+The OverlayMachines themselves are still created up front, one for every
+machine of the plan that is not active yet: expand() unifies the machines of
+later expansions with the active machines by printname, so a machine created
+on first access would change what those are unified with. An expansion
+therefore still costs as much as the number of machines in the definition
+subgraph; only the edges and the controls are saved."""
+
+import copy
+
+from pymachine.machine import Machine, _empty_partition, _no_parents
+
+# The slots of Machine, which OverlayMachine hides behind properties
+_partitions_slot = Machine.partitions
+_control_slot = Machine.control
+_parents_slot = Machine.parents
+
+def _new_machine():
+    """Unpickling helper for OverlayMachine."""
+    return Machine.__new__(Machine)
+
+class OverlayMachine(Machine):
+    """
+    An active machine whose edges (from expansion plans) and control are
+    only added when they are first accessed. Until then, the plans are kept
+    in @c pending (those the machine is the parent in) and @c incoming (those
+    it is a child in); afterwards it is an ordinary machine.
+    """
+    __slots__ = ('static_control', 'pending', 'incoming')
+
+    def __init__(self, name, static_control=None):
+        """
+        @param static_control the control of the static machine, which is
+                              copied on first access.
+        """
+        self._fingerprints = None
+        self.printname_ = name
+        _parents_slot.__set__(self, _no_parents)
+        self.static_control = static_control
+        # (plan, active machines, index) triples
+        self.pending = ()
+        self.incoming = ()
+
+    def __reduce_ex__(self, protocol):
+        # Pickled as an ordinary machine
+        return _new_machine, (), Machine.__getstate__(self)
+
+    def _get_partitions(self):
+        try:
+            return _partitions_slot.__get__(self, Machine)
+        except AttributeError:
+            return self.__materialize()
+
+    def _set_partitions(self, partitions):
+        _partitions_slot.__set__(self, partitions)
+        self.pending = ()
+
+    partitions = property(_get_partitions, _set_partitions)
+
+    def _get_control(self):
+        try:
+            return _control_slot.__get__(self, Machine)
+        except AttributeError:
+            # the same shallow copy unify_recursively() makes
+            self.set_control(copy.copy(self.static_control))
+            return _control_slot.__get__(self, Machine)
+
+    def _set_control(self, control):
+        _control_slot.__set__(self, control)
+
+    control = property(_get_control, _set_control)
+
+    def _get_parents(self):
+        if self.incoming:
+            incoming, self.incoming = self.incoming, ()
+            for plan, machines, child_i in incoming:
+                for parent_i in plan.parents[child_i]:
+                    parent = machines[parent_i]
+                    if isinstance(parent, OverlayMachine):
+                        parent.partitions
+        return _parents_slot.__get__(self, Machine)
+
+    def _set_parents(self, parents):
+        _parents_slot.__set__(self, parents)
+
+    parents = property(_get_parents, _set_parents)
+
+    def add_parent_link(self, whose, part):
+        # the links of the deferred parents are not needed to add this one
+        incoming, self.incoming = self.incoming, ()
+        try:
+            Machine.add_parent_link(self, whose, part)
+        finally:
+            self.incoming = incoming
+
+    def materialized(self):
+        """Whether the edges of the pending plans have been added."""
+        try:
+            _partitions_slot.__get__(self, Machine)
+            return True
+        except AttributeError:
+            return False
+
+    def __materialize(self):
+        # Machine(static_name) in unify_recursively() has 3 partitions
+        partitions = [_empty_partition] * 3
+        _partitions_slot.__set__(self, partitions)
+        pending, self.pending = self.pending, ()
+        for plan, machines, parent_i in pending:
+            _add_edges(plan, machines, parent_i)
+        return partitions
+
+def _add_edges(plan, machines, parent_i):
+    """Adds the edges of @p plan that start from @p machines[parent_i]."""
+    parent = machines[parent_i]
+    for part_i, child_i in plan.children[parent_i]:
+        parent.append(machines[child_i], part_i)
+
+def _defer(machine, slot, entry):
+    """Appends @p entry to the @p slot list of @p machine."""
+    entries = getattr(machine, slot)
+    if entries:
+        entries.append(entry)
+    else:
+        setattr(machine, slot, [entry])
+
+def overlay_plan(plan, machines):
+    """
+    Adds the edges of the ExpansionPlan @p plan between @p machines (the
+    active machines of its printnames, @c None for the AVMs), deferring those
+    that start from an OverlayMachine whose partitions have not been copied
+    yet, if all its children in the plan are OverlayMachines as well.
+    """
+    deferred = set()
+    for parent_i, parent in enumerate(machines):
+        children = plan.children[parent_i]
+        if not children:
+            continue
+        if (isinstance(parent, OverlayMachine) and
+                not parent.materialized() and
+                all(isinstance(machines[child_i], OverlayMachine)
+                    for _, child_i in children)):
+            _defer(parent, 'pending', (plan, machines, parent_i))
+            deferred.update(child_i for _, child_i in children)
+        else:
+            _add_edges(plan, machines, parent_i)
+    for child_i in deferred:
+        _defer(machines[child_i], 'incoming', (plan, machines, child_i))
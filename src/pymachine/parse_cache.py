@@ -0,0 +1,115 @@
+"""A persistent cache of the parse results of definition lines.
+
+Parsing a definition file from scratch (or loading the dump of a whole file)
+makes a one-line edit cost as much as a new file. A ParseCache stores the
+result of each line separately, under the hash of its contents and of
+everything else the result depends on (the plural dictionary and the options
+of definition_parser.read()):
+
+    magic, version
+    entries (marshal): hash -> the pickled machine (or None, for empty
+                       definitions) and the syntax error in the line (or
+                       None)
+    headwords (marshal): headword -> the hash of the line of its definition
+
+so read(cache=...) only parses the lines that are not in the cache yet. Since
+the cache also knows where the definitions of the previous read came from,
+it tells which headwords got a different definition (or none) since then:
+a lexicon built before can be updated with Lexicon.replace_definitions()
+instead of being rebuilt.
+
+The entries of lines that are not in the file any more are dropped when the
+cache is updated."""
+
+import cPickle
+import hashlib
+import logging
+import marshal
+import os
+
+PARSE_CACHE_MAGIC = 'PYMPARSE'
+# Must be increased whenever the format, or the machines the parser builds
+# from a line change
+PARSE_CACHE_VERSION = 2
+
+class ParseCache(object):
+    """
+    The parse cache saved at @p path. If there is no cache there yet (or it
+    is of an other version), it starts empty.
+    """
+    def __init__(self, path):
+        self.path = path
+        # hash -> pickled (machine, error)
+        self.entries = {}
+        # headword -> hash
+        self.headwords = {}
+        # the headwords whose definition changed in the last update()
+        self.changed = set()
+        if os.path.exists(path):
+            self.__load()
+
+    def __load(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        if not data.startswith(PARSE_CACHE_MAGIC):
+            logging.warning('{0} is not a parse cache, ignoring it'.format(
+                self.path))
+            return
+        version, self.entries, self.headwords = marshal.loads(
+            data[len(PARSE_CACHE_MAGIC):])
+        if version != PARSE_CACHE_VERSION:
+            logging.info('ignoring parse cache {0} of version {1}'.format(
+                self.path, version))
+            self.entries, self.headwords = {}, {}
+
+    def save(self):
+        """Writes the cache to its path (through a temporary file)."""
+        tmp_path = '{0}.tmp'.format(self.path)
+        with open(tmp_path, 'wb') as f:
+            f.write(PARSE_CACHE_MAGIC)
+            f.write(marshal.dumps(
+                (PARSE_CACHE_VERSION, self.entries, self.headwords)))
+        os.rename(tmp_path, self.path)
+
+    @staticmethod
+    def keys(lines, salt):
+        """The hashes of @p lines; @p salt is everything else their results
+        depend on."""
+        salted = hashlib.sha1(salt)
+        keys = []
+        for line in lines:
+            h = salted.copy()
+            h.update(line.encode('utf-8') if isinstance(line, unicode)
+                     else line)
+            keys.append(h.digest())
+        return keys
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        """The machine (new for each call) and the syntax error of the line
+        with hash @p key."""
+        return cPickle.loads(self.entries[key])
+
+    def put(self, key, result):
+        """Stores @p result, the machine and the syntax error of the line
+        with hash @p key."""
+        self.entries[key] = cPickle.dumps(result, 2)
+
+    def update(self, headwords, keys):
+        """
+        Replaces the headwords with @p headwords (headword -> the hash of the
+        line of its definition), and records in changed the ones whose
+        definition is new, changed or gone. Only the entries of @p keys (the
+        hashes of the lines of the file) are kept.
+        """
+        old = self.headwords
+        self.changed = set(
+            headword for headword in set(old) | set(headwords)
+            if old.get(headword) != headwords.get(headword))
+        self.headwords = headwords
+        keys = set(keys)
+        for key in self.entries.keys():
+            if key not in keys:
+                del self.entries[key]
@@ -6,6 +6,8 @@ from gensim.models import Word2Vec
 from nltk.corpus import stopwords as nltk_stopwords
 from scipy.stats.stats import pearsonr
 
+from pymachine.symbols import symbols
+from pymachine.traversal import traverse
 from pymachine.utils import average, harmonic_mean, jaccard, min_jaccard, MachineGraph, MachineTraverser, my_max  # nopep8
 from pymachine.wrapper import Wrapper as MachineWrapper
 assert jaccard, min_jaccard  # silence pyflakes
@@ -13,6 +15,7 @@ assert jaccard, min_jaccard  # silence pyflakes
 class WordSimilarity():
     def __init__(self, wrapper):
         self.wrapper = wrapper
+        # keyed by the symbols of the lemmas
         self.lemma_sim_cache = {}
         self.links_nodes_cache = {}
         self.stopwords = set(nltk_stopwords.words('english'))
@@ -27,7 +30,7 @@ class WordSimilarity():
         self.seen_for_links = set()
         links = set()
         nodes = set()
-        for link, node in self._get_links_nodes(machine, depth=0):
+        for link, node in self._get_links_nodes(machine):
             if link is not None:
                 links.add(link)
             if node is not None:
@@ -35,22 +38,21 @@ class WordSimilarity():
         self.links_nodes_cache[machine] = (links, nodes)
         return links, nodes
 
-    def _get_links_nodes(self, machine, depth):
-        if machine in self.seen_for_links or depth > 5:
-            return
-        self.seen_for_links.add(machine)
-        for hypernym in machine.partitions[0]:
-            name = hypernym.printname()
-            if name == '=AGT' or not name.isupper():
-            #    if depth == 0 and name not in ("lack", "to"):  # TMP!!!
-                yield name, None
-
-            for link, node in self._get_links_nodes(hypernym, depth=depth+1):
+    def _get_links_nodes(self, machine):
+        for hyponym, depth in traverse([machine], partitions=(0,),
+                                       max_depth=5,
+                                       visited=self.seen_for_links):
+            for hypernym in hyponym.partitions[0]:
+                name = hypernym.printname()
+                if name == '=AGT' or not name.isupper():
+                #    if depth == 0 and name not in ("lack", "to"):  # TMP!!!
+                    yield name, None
+
+            for link, node in self.get_binary_links_nodes(hyponym):
                 yield link, node
 
-        for link, node in self.get_binary_links_nodes(machine):
-            yield link, node
-
+        # the hypernyms are all in the same (connected) graph, so their nodes
+        # are the same as those of machine
         for node in MachineTraverser.get_nodes(machine):
             yield None, node
 
@@ -197,8 +199,9 @@ class WordSimilarity():
         return sim
 
     def lemma_similarity(self, lemma1, lemma2, sim_type):
-        if (lemma1, lemma2) in self.lemma_sim_cache:
-            return self.lemma_sim_cache[(lemma1, lemma2)]
+        key1, key2 = symbols.id(lemma1), symbols.id(lemma2)
+        if (key1, key2) in self.lemma_sim_cache:
+            return self.lemma_sim_cache[(key1, key2)]
         elif lemma1 == lemma2:
             return 1
         self.log(u'lemma1: {0}, lemma2: {1}'.format(lemma1, lemma2))
@@ -221,8 +224,8 @@ class WordSimilarity():
             f.write(graph.to_dot().encode('utf-8'))
 
         sim = sim if sim >= 0 else 0
-        self.lemma_sim_cache[(lemma1, lemma2)] = sim
-        self.lemma_sim_cache[(lemma2, lemma1)] = sim
+        self.lemma_sim_cache[(key1, key2)] = sim
+        self.lemma_sim_cache[(key2, key1)] = sim
         return sim
 
 class SentenceSimilarity():
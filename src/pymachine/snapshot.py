@@ -0,0 +1,335 @@
+"""Binary snapshots of finalized lexicons.
+
+cPickle writes a lexicon as one big object graph: loading it recreates every
+machine, recursing along the edges (so deep definition chains can hit the
+recursion limit), and each process that loads it gets a private copy of all
+the objects.
+
+A snapshot stores the static graph in the layout of a GraphStore instead:
+
+    magic, version, header offset
+    sections, each aligned to 8 bytes
+    header (marshal): the offset, typecode and length of each section
+
+The node and edge arrays are written as they are in memory, and the loaded
+lexicon reads them directly from a read-only mmap of the file (see
+MappedArray): they are not copied on load, only the pages actually used are
+read, and processes that load the same snapshot share them through the page
+cache. Loading only unmarshals the static entries (printname -> node ids);
+the printnames and the controls are read when they are first needed, and no
+machine is created until somebody asks for it.
+
+The arrays are in native byte order, so a snapshot can only be loaded on a
+machine with the same byte order and integer sizes as the one that wrote it;
+load_snapshot() checks this.
+
+A snapshot can carry everything else a Wrapper needs to start as well (see
+Wrapper.save_bundle()): the definitions, as the blobs of a definition index
+(see definition_store.py) after the sections, with their index in the
+'definition_index' section, and other picklable objects (the supplementary
+dictionary, ...) in the 'bundle' section. load_bundle() reads all of them
+from one mapping of the file; load_snapshot() ignores them."""
+
+from array import array
+import cPickle
+import marshal
+import mmap
+import struct
+import sys
+
+from pymachine.definition_store import DefinitionStore, write_definition_blobs
+from pymachine.graph_store import GraphStore, NodeView, StaticViews
+from pymachine.lexicon import Lexicon
+from pymachine.symbols import symbols
+
+SNAPSHOT_MAGIC = 'PYMSNAP\0'
+# Must be increased whenever the layout changes
+SNAPSHOT_VERSION = 2
+# magic, version, reserved, header offset
+_preamble = struct.Struct('<8sIIQ')
+_alignment = 8
+
+class SnapshotError(Exception):
+    pass
+
+class MappedArray(object):
+    """A read-only array of @p length items of type @p typecode, stored in
+    @p buf (e.g. an mmap) from @p offset on. Slices are returned as arrays."""
+    __slots__ = ('buf', 'offset', 'typecode', 'itemsize', 'length', 'format')
+
+    def __init__(self, buf, offset, typecode, length):
+        self.buf = buf
+        self.offset = offset
+        self.typecode = typecode
+        self.itemsize = array(typecode).itemsize
+        self.length = length
+        self.format = struct.Struct(typecode)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.length)
+            values = array(self.typecode)
+            if stop > start:
+                values.fromstring(
+                    self.buf[self.offset + start * self.itemsize:
+                             self.offset + stop * self.itemsize])
+            return values if step == 1 else values[::step]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError('MappedArray index out of range')
+        return self.format.unpack_from(
+            self.buf, self.offset + index * self.itemsize)[0]
+
+    def __iter__(self):
+        for start in xrange(0, self.length, 4096):
+            for value in self[start:start + 4096]:
+                yield value
+
+    def tostring(self):
+        return self.buf[self.offset:self.offset + self.length * self.itemsize]
+
+def _plain_store(state):
+    """Unpickling helper for MappedGraphStore."""
+    store = GraphStore.__new__(GraphStore)
+    store.__setstate__(state)
+    return store
+
+class MappedGraphStore(GraphStore):
+    """
+    A GraphStore whose arrays are MappedArrays over the sections of a
+    snapshot. The printnames and the controls are only read from the snapshot
+    when they are first needed, the symbols of the printnames one by one.
+    Pickled, it becomes an ordinary GraphStore.
+    """
+    def __init__(self, buf, header):
+        self._buf = buf
+        # name -> (offset, typecode, length in items) for arrays,
+        #         (offset, None, size) for the others
+        sections = self._sections = header['sections']
+        for name in GraphStore._arrays:
+            offset, typecode, length = sections[name]
+            setattr(self, name, MappedArray(buf, offset, typecode, length))
+        self._names = None
+        self._control_table = None
+        self.name_symbols = [None] * header['num_names']
+        self.static = None
+        self.static_disambig = None
+        self._views = [None] * len(self.node_name)
+
+    def __reduce__(self):
+        return _plain_store, (self.__getstate__(),)
+
+    def _section(self, name):
+        offset, _, length = self._sections[name]
+        return self._buf[offset:offset + length]
+
+    @property
+    def names(self):
+        if self._names is None:
+            self._names = marshal.loads(self._section('names'))
+        return self._names
+
+    @property
+    def name_ids(self):
+        return dict((name, i) for i, name in enumerate(self.names))
+
+    @property
+    def control_table(self):
+        if self._control_table is None:
+            self._control_table = cPickle.loads(self._section('controls'))
+        return self._control_table
+
+    def symbol(self, node):
+        name_id = self.node_name[node]
+        symbol = self.name_symbols[name_id]
+        if symbol is None:
+            symbol = self.name_symbols[name_id] = symbols.id(
+                self.names[name_id])
+        return symbol
+
+def _static_store(static, static_disambig, graph_store=None):
+    """
+    Returns @p graph_store and the node ids of the static entries if all
+    machines in @p static are its views; otherwise a new GraphStore is built
+    from @p static.
+    """
+    if graph_store is not None:
+        if (isinstance(static, StaticViews) and
+                static.store is graph_store):
+            # (without creating the views not looked up yet)
+            entries, ids = static.entries, dict(static.pending)
+        else:
+            entries, ids = static, {}
+        for name, machines in entries.iteritems():
+            ids[name] = [m.node_id for m in machines
+                         if isinstance(m, NodeView) and m.store is graph_store]
+        if all(len(ids[name]) == len(machines)
+               for name, machines in entries.iteritems()):
+            return graph_store, ids
+    store = GraphStore.from_static(static, static_disambig)
+    return store, store.static
+
+def _write_snapshot(path, store, static, static_disambig, extras,
+                    definitions=None, bundle=None):
+    with open(path, 'wb') as f:
+        sections = {}
+
+        def write(name, data, typecode=None, length=None):
+            padding = -f.tell() % _alignment
+            f.write('\0' * padding)
+            sections[name] = (f.tell(), typecode,
+                              len(data) if length is None else length)
+            f.write(data)
+
+        f.write(_preamble.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, 0))
+        for name in GraphStore._arrays:
+            values = getattr(store, name)
+            write(name, values.tostring(), values.typecode, len(values))
+        write('names', marshal.dumps(store.names))
+        write('controls', cPickle.dumps(store.control_table, 2))
+        write('static', marshal.dumps(static))
+        write('static_disambig', marshal.dumps(static_disambig))
+        write('extras', cPickle.dumps(extras, 2))
+        if definitions is not None:
+            index = write_definition_blobs(f, definitions)
+            write('definition_index', marshal.dumps(index))
+        if bundle is not None:
+            write('bundle', cPickle.dumps(bundle, 2))
+
+        header_offset = f.tell()
+        f.write(marshal.dumps({
+            'sections': sections,
+            'num_names': len(store.names),
+            'byteorder': sys.byteorder,
+            'itemsizes': dict((typecode, array(typecode).itemsize)
+                              for typecode in 'bi')}))
+        f.seek(0)
+        f.write(_preamble.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0,
+                               header_offset))
+
+def _read_snapshot(path):
+    """Maps the snapshot at @p path. Returns the mmap and the header."""
+    with open(path, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(buf) < _preamble.size:
+        raise SnapshotError('{0} is not a lexicon snapshot'.format(path))
+    magic, version, _, header_offset = _preamble.unpack_from(buf)
+    if magic != SNAPSHOT_MAGIC:
+        raise SnapshotError('{0} is not a lexicon snapshot'.format(path))
+    if version != SNAPSHOT_VERSION:
+        raise SnapshotError(
+            'unsupported snapshot version {0} in {1} (expected {2})'.format(
+                version, path, SNAPSHOT_VERSION))
+    header = marshal.loads(buf[header_offset:])
+    itemsizes = dict((typecode, array(typecode).itemsize)
+                     for typecode in 'bi')
+    if (header['byteorder'] != sys.byteorder or
+            header['itemsizes'] != itemsizes):
+        raise SnapshotError(
+            '{0} was written on a platform with a different byte order or '
+            'integer sizes'.format(path))
+    return buf, header
+
+def _section(buf, header, name):
+    """The data of the section @p name, or @c None if there is none."""
+    if name not in header['sections']:
+        return None
+    offset, _, length = header['sections'][name]
+    return buf[offset:offset + length]
+
+def is_snapshot(path):
+    """Whether the file at @p path is a snapshot (of any version)."""
+    with open(path, 'rb') as f:
+        return f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+
+def save_snapshot(lexicon, path, definitions=None, bundle=None):
+    """
+    Writes the finalized @p lexicon to @p path. The lexicon does not have to
+    be frozen; if it is not (or words have been added to it since), its
+    static graph is converted to a GraphStore first. The active state is not
+    saved.
+    @param definitions if given, these definitions (printname -> set of
+                       machines) are saved as well.
+    @param bundle if given, a dict of other picklable objects saved as well.
+    """
+    store, static = _static_store(lexicon.static, lexicon.static_disambig,
+                                  lexicon.graph_store)
+    extras = {'overlay': lexicon.overlay,
+              'constructions': lexicon.constructions,
+              'avm_constructions': lexicon.avm_constructions}
+    _write_snapshot(path, store, static, dict(lexicon.static_disambig),
+                    extras, definitions, bundle)
+
+def load_snapshot(path):
+    """
+    Returns the lexicon saved at @p path by save_snapshot(). It is frozen,
+    and its graph store reads the snapshot through a read-only mmap.
+    """
+    buf, header = _read_snapshot(path)
+    return _load_lexicon(buf, header)
+
+def load_bundle(path):
+    """
+    Returns the lexicon (see load_snapshot()), the definitions and the dict
+    of other objects saved at @p path by save_snapshot(). The definitions are
+    a DefinitionStore that reads them from the snapshot by headword; it is
+    empty (as is the dict) if they were not saved.
+    """
+    buf, header = _read_snapshot(path)
+    lexicon = _load_lexicon(buf, header)
+    definitions = DefinitionStore()
+    index = _section(buf, header, 'definition_index')
+    if index is not None:
+        definitions.add_index(path, buf, marshal.loads(index))
+    bundle = _section(buf, header, 'bundle')
+    return (lexicon, definitions,
+            cPickle.loads(bundle) if bundle is not None else {})
+
+def snapshot_definitions(path):
+    """
+    Maps the snapshot at @p path. Returns the mmap and the index of the
+    definitions saved in it (see DefinitionStore.add_index()).
+    @raise SnapshotError if no definitions were saved.
+    """
+    buf, header = _read_snapshot(path)
+    index = _section(buf, header, 'definition_index')
+    if index is None:
+        raise SnapshotError('{0} has no definitions'.format(path))
+    return buf, marshal.loads(index)
+
+def _load_lexicon(buf, header):
+    store = MappedGraphStore(buf, header)
+    store.static = marshal.loads(store._section('static'))
+    store.static_disambig = marshal.loads(store._section('static_disambig'))
+    extras = cPickle.loads(store._section('extras'))
+
+    lexicon = Lexicon(overlay=extras['overlay'])
+    lexicon.graph_store = store
+    lexicon.static = store.static_views()
+    lexicon.static_disambig = dict(store.static_disambig)
+    lexicon.constructions = extras['constructions']
+    lexicon.avm_constructions = extras['avm_constructions']
+    return lexicon
+
+def save_definitions(definitions, path):
+    """
+    Writes a definition dict (printname -> set of machines, as returned by
+    definition_parser.read()) to @p path in the snapshot format.
+    """
+    store = GraphStore.from_static(
+        dict((pn, list(machines)) for pn, machines in definitions.iteritems()),
+        {})
+    _write_snapshot(path, store, store.static, {}, {})
+
+def load_definitions(path):
+    """Reads definitions saved by save_definitions() as new (mutable)
+    machines."""
+    buf, header = _read_snapshot(path)
+    store = MappedGraphStore(buf, header)
+    store.static = marshal.loads(store._section('static'))
+    return dict((pn, set(machines))
+                for pn, machines in store.to_machines().iteritems())
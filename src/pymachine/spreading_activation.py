@@ -18,7 +18,7 @@ class SpreadingActivation(object):
     def __init__(self, lexicon):
         self.lexicon = lexicon
 
-    def activation_loop(self, chunks):
+    def activation_loop(self, chunks, context=None):
         """
         Implements the algorithm. It goes as follows:
         @arg Expand all unexpanded words
@@ -31,16 +31,19 @@ class SpreadingActivation(object):
 
         @param chunks a list of lists of machines that make up the chunks in
             the sentence (and the rest, too).
+        @param context the active context of the sentence (see
+            active_context.py); the lexicon's own, if omitted.
         """
         # chunks contains the chunks of the sentence -- at the beginning, all
         # words are considered chunks, but then are merged by the syntactic
         # constructions
 
+        context = self.lexicon.active_context(context)
         sentence = itertools.chain(*chunks)
-        self.lexicon.add_active(sentence)
-        last_active = len(self.lexicon.active)
-        unexpanded = list(self.lexicon.get_unexpanded())
-        chunk_constructions = set([c for c in self.lexicon.constructions
+        self.lexicon.add_active(sentence, context)
+        last_active = len(context.active)
+        unexpanded = list(self.lexicon.get_unexpanded(context))
+        chunk_constructions = set([c for c in context.constructions
                                   if c.type_ == Construction.CHUNK])
         chunk_dbg_str = ', '.join(
             c.name.encode('utf-8')
@@ -48,7 +51,7 @@ class SpreadingActivation(object):
         logging.debug(
             "\n\nCHUNK CONSTRUCTIONS:" + ' ' + chunk_dbg_str + "\n\n")
 
-        semantic_constructions = set([c for c in self.lexicon.constructions
+        semantic_constructions = set([c for c in context.constructions
                                       if c.type_ == Construction.SEMANTIC])
         semantic_dbg_str = ', '.join(
             c.name.encode('utf-8') for c in semantic_constructions)
@@ -73,28 +76,28 @@ class SpreadingActivation(object):
                 safety_zone += 1
             active_dbg_str = ', '.join(
                 k.encode('utf-8') + ':' + str(len(v))
-                for k, v in self.lexicon.active.iteritems())
+                for k, v in context.active.iteritems())
             static_dbg_str = ', '.join(
                 k.encode('utf-8') for k in sorted(self.lexicon.static.keys()))
             logging.debug(
                 "\n\nACTIVE:" + str(last_active) + ' ' + active_dbg_str)
-            logging.debug("\n\nACTIVE DICT: {}".format(self.lexicon.active))
+            logging.debug("\n\nACTIVE DICT: {}".format(context.active))
             logging.debug("\n\nSTATIC:" + ' ' + static_dbg_str)
             logging.debug("\n\nSTATIC DICT: {}".format(self.lexicon.static))
 #            logging.debug('ACTIVE')
 #            from machine import Machine
-#            for ac in self.lexicon.active.values():
+#            for ac in context.active.values():
 #                for m in ac:
 #                    logging.debug(Machine.to_debug_str(m))
             # Step 1: expansion
             for machine in unexpanded:
                 logging.debug("EXPANDING: " + unicode(machine).encode('utf-8'))
 
-                self.lexicon.expand(machine)
+                self.lexicon.expand(machine, context=context)
 
-            logging.debug("\n\nACTIVE DICT: {}".format(self.lexicon.active))
+            logging.debug("\n\nACTIVE DICT: {}".format(context.active))
             logging.debug("\n\nACTIVE MACHINES: {}".format(
-                self.lexicon.active_machines()))
+                self.lexicon.active_machines(context)))
             # Step 2a: semantic constructions:
             for c in semantic_constructions:
                 # The machines that can take part in constructions
@@ -102,7 +105,7 @@ class SpreadingActivation(object):
                 accepted = []
                 # Find the sequences that match the construction
                 # TODO: combinatorial explosion alert!
-                no_active = len(self.lexicon.active_machines())
+                no_active = len(self.lexicon.active_machines(context))
                 max_length = 3
                 no_all_combinations = sum((fac(no_active)/fac(no_active-i-1)
                                           for i in range(max_length)))
@@ -113,14 +116,15 @@ class SpreadingActivation(object):
                     no_active, max_length, no_all_combinations))
                 """
                 for i, seq in enumerate(powerset(
-                        self.lexicon.active_machines())):
+                        self.lexicon.active_machines(context))):
                 """
                 count = 0
-                for elems in xrange(
-                        min(len(self.lexicon.active_machines()), max_length)):
+                for elems in xrange(min(
+                        len(self.lexicon.active_machines(context)),
+                        max_length)):
                 #for elems in xrange(len(constable)):
                     for i, seq in enumerate(itertools.permutations(
-                            self.lexicon.active_machines(), elems + 1)):
+                            self.lexicon.active_machines(context), elems + 1)):
                         if any(isinstance(machine.control, ConceptControl)
                                for machine in seq):
                             continue
@@ -158,7 +162,8 @@ class SpreadingActivation(object):
                         # We remove the machines that were consumed by the
                         # construction and add the machines returned by it
                         for m in c_res:
-                            self.lexicon.unify_recursively(m)
+                            self.lexicon.unify_recursively(
+                                m, False, context=context)
 
                         # If one of the returned machines has a PluginControl,
                         # we can stop the activation loop
@@ -173,7 +178,7 @@ class SpreadingActivation(object):
 
                     break  # TODO
 
-            avm_constructions = set([c for c in self.lexicon.constructions
+            avm_constructions = set([c for c in context.constructions
                                     if c.type_ == Construction.AVM])
             active_avm_dbg_str = ', '.join(
                 c.name.encode('utf-8') for c in avm_constructions)
@@ -183,7 +188,7 @@ class SpreadingActivation(object):
             for c in avm_constructions:
                 logging.debug(u"AVM {0} before: {1}".format(
                     c.name, unicode(c.avm)).encode("utf-8"))
-                attr_vals = set(self.lexicon.active_machines()) | set(
+                attr_vals = set(self.lexicon.active_machines(context)) | set(
                     c.avm for c in avm_constructions)
                 for m in attr_vals:
                     if c.check([m]):
@@ -195,15 +200,15 @@ class SpreadingActivation(object):
                     c.name, unicode(c.avm)).encode("utf-8"))
 
             # Step 3: activation
-            self.lexicon.activate()
+            self.lexicon.activate(context)
 
             # Step 4: housekeeping
-            unexpanded = list(self.lexicon.get_unexpanded())
-            if len(self.lexicon.active) + len(
+            unexpanded = list(self.lexicon.get_unexpanded(context))
+            if len(context.active) + len(
                     avm_constructions) == last_active:
                 break
             else:
-                last_active = len(self.lexicon.active) + len(avm_constructions)
+                last_active = len(context.active) + len(avm_constructions)
 
         # Return messages to active plugins
         # TODO: add AVMs. What is the relation between AVMs and Plugins?
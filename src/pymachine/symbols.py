@@ -0,0 +1,94 @@
+"""Process-wide symbol table for printnames.
+
+Every printname (e.g. 'bank/2') is interned as a Symbol the first time it is
+seen, and its parts are parsed once: the ambiguous name without the
+@c id_sep suffix ('bank'), and the suffix itself ('2'). Machines store the
+symbol instead of the printname, so printname() is an attribute lookup
+instead of a split(), and symbols can be used as cheap dictionary keys
+(they are hashed by identity).
+
+The table only keeps weak references to its symbols: a symbol is dropped as
+soon as no machine (or other holder) refers to it any more, so the names a
+long-running service meets in its input do not pile up in memory. Printnames
+are normalized to unicode (byte strings are decoded as UTF-8), so a str and
+a unicode printname are the same symbol, and printnames are always
+returned as unicode."""
+
+import threading
+import weakref
+
+from pymachine.constants import id_sep
+
+class Symbol(object):
+    """
+    An interned printname.
+    @param name the printname.
+    @param base the Symbol of the printname without the id_sep suffix (the
+                symbol itself if it has none).
+    @param suffix the id_sep suffix, or @c None.
+    """
+    __slots__ = ('name', 'base_name', 'base', 'suffix', '__weakref__')
+
+    def __init__(self, name, base=None, suffix=None):
+        self.name = name
+        self.base = self if base is None else base
+        self.base_name = self.base.name
+        self.suffix = suffix
+
+    def __repr__(self):
+        return 'Symbol({0!r})'.format(self.name)
+
+class SymbolTable(object):
+    def __init__(self):
+        # printname -> Symbol
+        self.ids = weakref.WeakValueDictionary()
+        # new symbols are added under the lock, as the processing of
+        # sentences in several threads (see active_context.py) can meet the
+        # same new printname at the same time
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, printname):
+        if type(printname) is str:
+            printname = printname.decode('utf-8')
+        return printname in self.ids
+
+    def id(self, printname):
+        """Returns the Symbol of @p printname, adding it if necessary."""
+        if type(printname) is str:
+            printname = printname.decode('utf-8')
+        try:
+            return self.ids[printname]
+        except KeyError:
+            return self.__add(printname)
+
+    def __add(self, printname):
+        with self.lock:
+            symbol = self.ids.get(printname)
+            if symbol is None:
+                symbol = self.ids[printname] = self.__new(printname)
+            return symbol
+
+    def __new(self, printname):
+        if id_sep in printname:
+            base_name, suffix = printname.split(id_sep, 1)
+            # printname() used to be split('/')[0], which drops everything
+            # after a second separator
+            return Symbol(printname, self.id(base_name),
+                          suffix.split(id_sep)[0])
+        return Symbol(printname)
+
+    def base_name(self, printname):
+        """The ambiguous name of @p printname ('bank' for 'bank/2')."""
+        return self.id(printname).base_name
+
+    def parts(self, printname):
+        """Returns the ambiguous name and the suffix (or @c None) of
+        @p printname."""
+        symbol = self.id(printname)
+        return symbol.base_name, symbol.suffix
+
+# The symbol table shared by all machines, lexicons, etc.
+symbols = SymbolTable()
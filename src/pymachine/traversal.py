@@ -0,0 +1,179 @@
+"""Stack-based traversal of machine graphs.
+
+Definition chains can be deeper than the recursion limit, so the graph walkers
+of the package (MachineTraverser, MachineGraph, WordSimilarity, Lexicon) use
+the iterative functions below instead of recursion:
+
+- traverse() is a generator over the machines reachable from some roots, in
+  depth-first or breadth-first order, with partition filters, an optional
+  depth limit and parent-following.
+- walk() replaces recursive functions that do something before and after
+  descending along each edge (e.g. copying a definition into the static
+  graph), where the order of the callbacks matters.
+
+Both accept a visited set that can be reused between traversals; VisitedSet
+(for machines) and VisitedBitmap (for the integer nodes of a GraphStore) can
+be cleared in constant time."""
+
+from collections import deque
+
+DFS, BFS = 'dfs', 'bfs'
+
+class VisitedSet(object):
+    """
+    A set of visited machines that can be cleared in O(1): the members are
+    stamped with the current epoch, and clear() simply starts a new one.
+    """
+    # clear() drops the stamps when there are more than this, so that the
+    # set does not keep old machines alive forever
+    max_size = 1 << 16
+
+    def __init__(self):
+        self.epoch = 0
+        self.marks = {}
+
+    def clear(self):
+        if len(self.marks) > VisitedSet.max_size:
+            self.marks = {}
+        self.epoch += 1
+
+    def add(self, item):
+        self.marks[item] = self.epoch
+
+    def __contains__(self, item):
+        return self.marks.get(item) == self.epoch
+
+class VisitedBitmap(object):
+    """The same as VisitedSet for the nodes 0 .. @p size - 1."""
+    def __init__(self, size):
+        self.epoch = 1
+        self.marks = bytearray(size)
+
+    def clear(self):
+        self.epoch += 1
+        if self.epoch == 256:
+            self.marks = bytearray(len(self.marks))
+            self.epoch = 1
+
+    def add(self, node):
+        self.marks[node] = self.epoch
+
+    def __contains__(self, node):
+        return self.marks[node] == self.epoch
+
+def neighbours(machine, partitions=None, follow_parents=False):
+    """
+    The children of @p machine (in the order of its partitions), followed by
+    its parents if @p follow_parents is @c True.
+    @param partitions if not @c None, only the edges in these partitions are
+                      followed (for parents: the partition @p machine is in).
+    """
+    if partitions is None:
+        result = [child for part in machine.partitions for child in part]
+        if follow_parents:
+            result.extend(parent for parent, _ in machine.parents)
+    else:
+        result = [child for i, part in enumerate(machine.partitions)
+                  if i in partitions for child in part]
+        if follow_parents:
+            result.extend(parent for parent, i in machine.parents
+                          if i in partitions)
+    return result
+
+def traverse(roots, order=DFS, partitions=None, max_depth=None,
+             follow_parents=False, visited=None):
+    """
+    Yields (machine, depth) for every machine reachable from @p roots, once
+    each. The roots are at depth 0.
+
+    The depth-first order is the same as that of the usual recursive
+    implementation: a machine is yielded (and marked as visited) when it is
+    reached, and its neighbours are only looked at after the caller resumes
+    the generator, so the caller may modify the machine in between.
+
+    @param order DFS or BFS.
+    @param partitions see neighbours().
+    @param max_depth the machines deeper than this are not reached.
+    @param follow_parents also walk the parent links.
+    @param visited a set-like object (anything with add() and @c in) of
+                   machines that are not to be visited. It is updated, so it
+                   can be shared by subsequent calls.
+    """
+    if visited is None:
+        visited = set()
+    if order == DFS:
+        stack = [iter(roots)]
+        depth = 0
+        while stack:
+            for machine in stack[-1]:
+                if machine in visited:
+                    continue
+                visited.add(machine)
+                yield machine, depth
+                if max_depth is None or depth < max_depth:
+                    stack.append(iter(neighbours(machine, partitions,
+                                                 follow_parents)))
+                    depth += 1
+                break
+            else:
+                stack.pop()
+                depth -= 1
+    elif order == BFS:
+        queue = deque((root, 0) for root in roots)
+        while queue:
+            machine, depth = queue.popleft()
+            if machine in visited:
+                continue
+            visited.add(machine)
+            yield machine, depth
+            if max_depth is None or depth < max_depth:
+                queue.extend(
+                    (neighbour, depth + 1) for neighbour in neighbours(
+                        machine, partitions, follow_parents))
+    else:
+        raise ValueError("unknown traversal order: {0}".format(order))
+
+def partition_edges(machine):
+    """(partition, child) pairs of the outgoing edges of @p machine. The list
+    is a snapshot, so the partitions can be modified during the walk."""
+    return [(i, child) for i, part in enumerate(machine.partitions)
+            for child in part]
+
+def walk(root, enter, edges=partition_edges, before_edge=None,
+         after_edge=None, leave=None):
+    """
+    Iterative version of the recursive function
+
+        def visit(node):
+            if enter(node):
+                for part_i, child in edges(node):
+                    before_edge(node, part_i, child)
+                    visit(child)
+                    after_edge(node, part_i, child)
+                leave(node)
+
+    The callbacks are called in exactly the same order as above.
+    @param enter called when a node is reached; its edges are only followed
+                 if it returns @c True.
+    @param edges returns the (partition, child) pairs to follow from a node.
+    """
+    if not enter(root):
+        return
+    stack = [(root, iter(edges(root)), None)]
+    while stack:
+        node, node_edges, incoming = stack[-1]
+        for part_i, child in node_edges:
+            if before_edge is not None:
+                before_edge(node, part_i, child)
+            if enter(child):
+                stack.append((child, iter(edges(child)),
+                              (node, part_i, child)))
+                break
+            if after_edge is not None:
+                after_edge(node, part_i, child)
+        else:
+            stack.pop()
+            if leave is not None:
+                leave(node)
+            if incoming is not None and after_edge is not None:
+                after_edge(*incoming)
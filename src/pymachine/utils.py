@@ -5,6 +5,7 @@ import networkx as nx
 from networkx.readwrite import json_graph
 
 from pymachine.machine import Machine
+from pymachine.traversal import traverse
 
 def ensure_dir(path):
     if not os.path.exists(path):
@@ -24,27 +25,15 @@ class MachineTraverser():
 
     def _get_nodes(
             self, machine, depth, exclude_words, names_only, keep_upper):
-        if machine in self.seen_for_nodes:
-            return
-        self.seen_for_nodes.add(machine)
-        name = machine.printname()
-        # logging.info(u'traversing: {0}'.format(name))
-        if (keep_upper or not name.isupper()) and name not in exclude_words:
-            if names_only:
-                yield name
-            else:
-                yield machine
-
-        for part in machine.partitions:
-            for submachine in part:
-                for node in self._get_nodes(
-                        submachine, depth+1, exclude_words, names_only,
-                        keep_upper):
-                    yield node
-        for parent, _ in machine.parents:
-            for node in self._get_nodes(
-                    parent, depth+1, exclude_words, names_only, keep_upper):
-                yield node
+        for machine, _ in traverse([machine], follow_parents=True,
+                                   visited=self.seen_for_nodes):
+            name = machine.printname()
+            # logging.info(u'traversing: {0}'.format(name))
+            if (keep_upper or not name.isupper()) and name not in exclude_words:
+                if names_only:
+                    yield name
+                else:
+                    yield machine
 
 class MachineGraph:
     @staticmethod
@@ -54,60 +43,49 @@ class MachineGraph:
         g.seen = set()
         # logging.debug('whitelist: {}'.format(whitelist))
         for machine in iterable:
-            g._get_edges_recursively(machine, max_depth, whitelist,
-                                     strict=strict, machinegraph_options=machinegraph_options)
+            g._get_edges(machine, max_depth, whitelist, strict=strict,
+                         machinegraph_options=machinegraph_options)
 
         return g
 
-    def _get_edges_recursively(self, machine, max_depth, whitelist,
-                               strict=False, depth=0, machinegraph_options=None):
+    def _get_edges(self, machine, max_depth, whitelist, strict=False,
+                   machinegraph_options=None):
         #  if pn.isupper():
         #      if depth >= 2:
         #          return
         # pn = machine.unique_name()
-        if machine in self.seen or (max_depth is not None and
-                                    depth > max_depth):
-            # logging.info(u'skipping machine: {}'.format(pn))
-            return
-
-        # logging.info(u'getting edges for machine: {}'.format(pn))
-        # logging.info("{0}".format(machine.partitions))
-
-        self.seen.add(machine)
-        # if printname == 'from':
-        #     logging.info('from machine: {0}'.format(machine))
-        edges = set()
-        neighbours = set()
-        for color, part in enumerate(machine.partitions):
-            for machine2 in part:
-                if machine2 in self.seen:
+        for machine, depth in traverse([machine], max_depth=max_depth,
+                                       follow_parents=True, visited=self.seen):
+            # logging.info(u'getting edges for machine: {}'.format(pn))
+            # logging.info("{0}".format(machine.partitions))
+
+            # if printname == 'from':
+            #     logging.info('from machine: {0}'.format(machine))
+            edges = set()
+            for color, part in enumerate(machine.partitions):
+                for machine2 in part:
+                    if machine2 in self.seen:
+                        continue
+                    edges.add((machine, machine2, color))
+            for parent, color in machine.parents:
+                if parent in self.seen:
                     continue
-                neighbours.add(machine2)
-                edges.add((machine, machine2, color))
-        for parent, color in machine.parents:
-            if parent in self.seen:
-                continue
-            neighbours.add(parent)
-            edges.add((parent, machine, color))
-
-        for machine1, machine2, color in edges:
-            printname1 = machine1.printname()
-            printname2 = machine2.printname()
-            # TODO
-            if (whitelist is not None and printname1 not in whitelist and
-                    printname2 not in whitelist):
-                continue
-            elif (not machinegraph_options == None) and machinegraph_options.upper_excl == True and (printname1.isupper() or printname2.isupper()):
-                continue
-            elif whitelist is None or (printname1 in whitelist and
-                                       printname2 in whitelist):
-                self.add_edge(
-                    machine1.unique_name(), machine1.printname().encode('utf-8'),
-                    machine2.unique_name(), machine2.printname().encode('utf-8'), color, machinegraph_options)
-
-        for neighbour in neighbours:
-            self._get_edges_recursively(
-                neighbour, max_depth, whitelist, depth=depth+1, machinegraph_options=machinegraph_options)
+                edges.add((parent, machine, color))
+
+            for machine1, machine2, color in edges:
+                printname1 = machine1.printname()
+                printname2 = machine2.printname()
+                # TODO
+                if (whitelist is not None and printname1 not in whitelist and
+                        printname2 not in whitelist):
+                    continue
+                elif (not machinegraph_options == None) and machinegraph_options.upper_excl == True and (printname1.isupper() or printname2.isupper()):
+                    continue
+                elif whitelist is None or (printname1 in whitelist and
+                                           printname2 in whitelist):
+                    self.add_edge(
+                        machine1.unique_name(), machine1.printname().encode('utf-8'),
+                        machine2.unique_name(), machine2.printname().encode('utf-8'), color, machinegraph_options)
 
     def __init__(self):
         self.G = nx.MultiDiGraph()
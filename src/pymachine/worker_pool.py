@@ -0,0 +1,135 @@
+"""Worker processes sharing one frozen lexicon.
+
+Running Wrapper.run() in several processes that each build (or unpickle)
+their own lexicon multiplies both the startup time and the memory used by the
+static graph. A WorkerPool builds the lexicon once, in the parent process,
+freezes it (see Lexicon.freeze()) and then forks the workers: they inherit
+the static graph, and the operating system shares its pages between the
+processes until one of them writes to a page (copy-on-write).
+
+Sharing only lasts while the pages are not written to, so before forking:
+- the static graph is moved into the arrays of a GraphStore, which have no
+  per-node objects whose reference counts or GC headers would be written;
+- a full garbage collection is run, and the surviving objects are moved out
+  of the collector's reach (gc.freeze(), where available); otherwise the
+  workers run full collections, which visit every object, rarely.
+
+The workers take sentences from a shared queue, process them with
+Wrapper.process(), each in a new active context, and send back the AVM result
+dicts."""
+
+import gc
+import logging
+import multiprocessing
+from Queue import Empty
+import traceback
+
+# The workers run a full collection after this many collections of the
+# middle generation (the default is 10), if gc.freeze() is not available
+_full_collection_threshold = 1000
+
+class WorkerError(Exception):
+    pass
+
+def _prepare_fork():
+    """Makes the objects of the parent process survive the fork unmodified
+    for as long as possible."""
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+
+def _worker(wrapper, tasks, results):
+    """The main loop of a worker process."""
+    if not hasattr(gc, 'freeze'):
+        threshold0, threshold1, _ = gc.get_threshold()
+        gc.set_threshold(threshold0, threshold1, _full_collection_threshold)
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        index, sentence = task
+        try:
+            results.put((index, True, wrapper.process(sentence)[1]))
+        except Exception:
+            results.put((index, False, traceback.format_exc()))
+
+class WorkerPool(object):
+    """
+    A pool of @p processes (the number of CPUs by default) worker processes
+    that share the lexicon of @p wrapper. The lexicon is frozen first, if it
+    is not frozen yet.
+    """
+    def __init__(self, wrapper, processes=None):
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.wrapper = wrapper
+        if wrapper.lexicon.graph_store is None:
+            logging.info('freezing the lexicon...')
+            wrapper.lexicon.freeze()
+        _prepare_fork()
+        self.tasks = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.workers = []
+        for i in xrange(processes):
+            worker = multiprocessing.Process(
+                target=_worker, args=(wrapper, self.tasks, self.results))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def map(self, sentences):
+        """
+        Processes @p sentences in the workers. Returns the list of results
+        (the AVM dicts returned by Wrapper.process()) of each sentence, in
+        the order of @p sentences.
+        @raise WorkerError if the processing of a sentence failed, or a worker
+                           died.
+        """
+        if not self.workers:
+            raise WorkerError('the pool is closed')
+        num_sentences = 0
+        for index, sentence in enumerate(sentences):
+            self.tasks.put((index, sentence))
+            num_sentences += 1
+        results = [None] * num_sentences
+        errors = []
+        for i in xrange(num_sentences):
+            while True:
+                try:
+                    index, ok, result = self.results.get(timeout=1)
+                    break
+                except Empty:
+                    if not all(worker.is_alive() for worker in self.workers):
+                        self.terminate()
+                        raise WorkerError('a worker process died')
+            if ok:
+                results[index] = result
+            else:
+                errors.append((index, result))
+        if errors:
+            index, tb = min(errors)
+            raise WorkerError(
+                'processing sentence {0} failed:\n{1}'.format(index, tb))
+        return results
+
+    def close(self):
+        """Stops the workers after the sentences already queued."""
+        for worker in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+    def terminate(self):
+        """Stops the workers right away."""
+        for worker in self.workers:
+            worker.terminate()
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
@@ -1,5 +1,4 @@
 #!/usr/bin/env python
-from copy import deepcopy
 import cPickle
 import logging
 import os
@@ -9,6 +8,12 @@ import sys
 from pymachine.construction import VerbConstruction
 from pymachine.sentence_parser import SentenceParser
 from pymachine.lexicon import Lexicon
+from pymachine.clone import clone_definitions
+from pymachine.definition_store import DefinitionStore, write_definition_index
+from pymachine.snapshot import (
+    is_snapshot, load_snapshot, save_snapshot, load_bundle, load_definitions,
+    save_definitions)
+from pymachine.parse_cache import ParseCache
 from pymachine.operators import AppendToBinaryFromLexiconOperator  # nopep8
 from pymachine.utils import ensure_dir, MachineGraph, MachineTraverser
 from pymachine.machine import Machine
@@ -36,21 +41,78 @@ class Wrapper:
         self.__read_config()
         self.batch = batch
         self.wordlist = set()
+        if self.bundle_fn:
+            self.__load_bundle()
+            return
         self.__read_definitions()
         if include_ext:
             self.get_ext_definitions()
         self.__read_supp_dict()
         self.reset_lexicon()
 
+    def save_bundle(self, path):
+        """
+        Saves everything the wrapper is built from to @p path, as one
+        snapshot (see snapshot.py): the lexicon with its constructions, the
+        definitions and the supplementary dictionary. A wrapper whose config
+        has path as its bundle option starts from it.
+        """
+        if self.lexicon.definitions is not None:
+            # lazy: the snapshot has the whole static graph
+            self.lexicon.load_definitions(self.definitions.keys())
+        config = dict(self.cfg.items('machine'))
+        config.pop('bundle', None)
+        save_snapshot(self.lexicon, path, definitions=self.definitions,
+                      bundle={'supp_dict': self.supp_dict,
+                              'machine_config': config})
+
+    def __load_bundle(self):
+        logging.info('loading bundle {}...'.format(self.bundle_fn))
+        self.lexicon, self.definitions, bundle = load_bundle(self.bundle_fn)
+        self.lexicon.overlay = self.overlay
+        self.supp_dict = bundle['supp_dict']
+        self.hot_words = []
+        self.changed_headwords = set()
+        config = dict(self.cfg.items('machine'))
+        config.pop('bundle', None)
+        if config != bundle['machine_config']:
+            logging.warning(
+                'the config differs from the one {} was built with'.format(
+                    self.bundle_fn))
+
     def reset_lexicon(self, load_from=None, save_to=None):
+        """
+        Builds the lexicon, or loads it from @p load_from (a snapshot, see
+        snapshot.py, or a pickle). If @p save_to is given, the lexicon is
+        saved there as a snapshot.
+        """
         if load_from:
-            self.lexicon = cPickle.load(open(load_from))
+            if is_snapshot(load_from):
+                self.lexicon = load_snapshot(load_from)
+            else:
+                self.lexicon = cPickle.load(open(load_from))
         else:
-            self.lexicon = Lexicon()
+            self.lexicon = Lexicon(
+                overlay=self.overlay,
+                definitions=(self.definitions if self.lazy_definitions
+                             else None))
             self.__add_definitions()
             self.__add_constructions()
         if save_to:
-            cPickle.dump(self.lexicon, open(save_to, 'w'))
+            save_snapshot(self.lexicon, save_to)
+
+    def update_definitions(self, lines, printname_index=0):
+        """
+        Replaces the definitions of the headwords of the 4lang definition
+        @p lines (e.g. edited lines of a definition file) in the definitions
+        and in the finalized lexicon, without rebuilding it. See
+        Lexicon.replace_definitions().
+        """
+        definitions = read_defs(lines, self.plural_fn, printname_index,
+                                three_parts=True)
+        for printname, machines in definitions.iteritems():
+            self.definitions[printname] = machines
+            self.lexicon.replace_definitions(printname, machines)
 
     def __read_config(self):
         items = dict(self.cfg.items("machine"))
@@ -61,9 +123,34 @@ class Wrapper:
         self.ext_defs_path = items.get("ext_definitions")
         self.supp_dict_fn = items.get("supp_dict")
         self.plural_fn = items.get("plurals")
+        self.overlay = items.get("overlay", "false").lower() == "true"
+        # definitions are read and added to the lexicon on first use; this
+        # changes the results of activate(), see Lexicon.load_definitions()
+        self.lazy_definitions = items.get(
+            "lazy_definitions", "false").lower() == "true"
+        # a file of words (one per line) whose definitions are loaded anyway
+        self.hot_words_fn = items.get("hot_words")
+        # the number of processes each definition file is parsed in, see
+        # definition_parser.read()
+        self.read_processes = int(items.get("read_processes", 1))
+        # the parse results of the lines of definition files are cached (in
+        # <file>.cache), and only new lines are parsed, see parse_cache.py
+        self.parse_cache = items.get(
+            "parse_cache", "false").lower() == "true"
+        # a snapshot saved by save_bundle(), which the wrapper is loaded from
+        # instead of the files above
+        self.bundle_fn = items.get("bundle")
 
     def __read_definitions(self):
-        self.definitions = {}
+        """
+        Reads the definition files into a DefinitionStore. Index files
+        (.defs) are only read by headword, on first use; the others are read
+        at once. In lazy mode, parsed files are cached as index files.
+        With the parse cache, the headwords whose definitions changed since
+        the previous build are collected in changed_headwords.
+        """
+        self.definitions = DefinitionStore()
+        self.changed_headwords = set()
         for file_name, printname_index in self.def_files:
             # TODO HACK makefile needed
             if (file_name.endswith("generated") and
@@ -73,30 +160,60 @@ class Wrapper:
                     " by pymachine/scripts/generate_translation_dict.sh" +
                     " does not exist: {0}".format(file_name))
 
-            if file_name.endswith('pickle'):
+            if file_name.endswith('defs'):
+                logging.info(
+                    'using 4lang definition index {}...'.format(file_name))
+                self.definitions.add_file(file_name)
+                continue
+            elif file_name.endswith('snapshot'):
+                logging.info(
+                    'loading 4lang definitions from {}...'.format(file_name))
+                definitions = load_definitions(file_name)
+            elif file_name.endswith('pickle'):
                 logging.info(
                     'loading 4lang definitions from {}...'.format(file_name))
-                definitions = cPickle.load(file(file_name))
+                # written as a snapshot by the code below, or as a pickle by
+                # older versions
+                if is_snapshot(file_name):
+                    definitions = load_definitions(file_name)
+                else:
+                    definitions = cPickle.load(file(file_name))
             else:
                 logging.info('parsing 4lang definitions...')
+                cache = (ParseCache('{0}.cache'.format(file_name))
+                         if self.parse_cache else None)
                 definitions = read_defs(
                     file(file_name), self.plural_fn, printname_index,
-                    three_parts=True)
+                    three_parts=True, processes=self.read_processes,
+                    cache=cache)
+                if cache is not None:
+                    cache.save()
+                    self.changed_headwords.update(cache.changed)
 
                 logging.info('dumping 4lang definitions to file...')
-                f = open('{0}.pickle'.format(file_name), 'w')
-                cPickle.dump(definitions, f)
-
-            for pn, machines in definitions.iteritems():
-                if pn not in self.definitions:
-                    self.definitions[pn] = machines
+                if self.lazy_definitions:
+                    write_definition_index(
+                        definitions, '{0}.defs'.format(file_name))
                 else:
-                    self.definitions[pn] |= machines
+                    # (the configs load <file>.pickle, so the name is kept)
+                    save_definitions(
+                        definitions, '{0}.pickle'.format(file_name))
+
+            self.definitions.update(definitions)
+
+        if self.hot_words_fn:
+            self.hot_words = [line.strip().decode('utf-8')
+                              for line in open(self.hot_words_fn)]
+            self.definitions.warm_up(self.hot_words)
+        else:
+            self.hot_words = []
 
     def __add_definitions(self):
-            definitions = deepcopy(self.definitions)
-            self.lexicon.add_static(definitions.itervalues())
+            if not self.lazy_definitions:
+                definitions = clone_definitions(self.definitions)
+                self.lexicon.add_static(definitions.itervalues())
             self.lexicon.finalize_static()
+            self.lexicon.load_definitions(self.hot_words)
 
     def __read_supp_dict(self):
         self.supp_dict = sdreader(
@@ -156,28 +273,40 @@ class Wrapper:
                     u"{0}\t{1}\n".format(
                         headword, u"\t".join(def_words)).encode("utf-8"))
 
+    def process(self, sentence):
+        """
+        Parses a sentence and runs the spreading activation on it in a new
+        active context, so it can be called from several threads (or worker
+        processes, see worker_pool.py) at the same time. Returns the machines
+        of the sentence and the messages that have to be sent to the active
+        plugins.
+        """
+        sp = SentenceParser()
+        sa = SpreadingActivation(self.lexicon)
+        context = self.lexicon.new_context()
+        machines = sp.parse(sentence)
+        logging.debug('machines: {}'.format(machines))
+        logging.debug('machines: {}'.format(
+            [m for m in machines]))
+        for machine_list in machines:
+            for machine in machine_list:
+                if machine.control.kr['CAT'] == 'VERB':
+                    logging.debug('adding verb construction for {}'.format(
+                        machine))
+                    context.add_construction(VerbConstruction(
+                        machine.printname(), self.lexicon, self.supp_dict,
+                        context=context))
+        logging.info('constructions: {}'.format(context.constructions))
+
+        # results is a list of (url, data) tuples
+        results = sa.activation_loop(machines, context)
+        return machines, results
+
     def run(self, sentence):
         """Parses a sentence, runs the spreading activation and returns the
         messages that have to be sent to the active plugins."""
         try:
-            sp = SentenceParser()
-            sa = SpreadingActivation(self.lexicon)
-            machines = sp.parse(sentence)
-            logging.debug('machines: {}'.format(machines))
-            logging.debug('machines: {}'.format(
-                [m for m in machines]))
-            for machine_list in machines:
-                for machine in machine_list:
-                    if machine.control.kr['CAT'] == 'VERB':
-                        logging.debug('adding verb construction for {}'.format(
-                            machine))
-                        self.lexicon.add_construction(VerbConstruction(
-                            machine.printname(), self.lexicon, self.supp_dict))
-            logging.info('constructions: {}'.format(
-                self.lexicon.constructions))
-
-            # results is a list of (url, data) tuples
-            results = sa.activation_loop(machines)
+            machines, results = self.process(sentence)
             print 'results:', results
             print 'machines:', machines
 
@@ -185,8 +314,6 @@ class Wrapper:
                 [m[0] for m in machines], max_depth=1)
             f = open('machines.dot', 'w')
             f.write(graph.to_dot().encode('utf-8'))
-
-            self.lexicon.clear_active()
         except Exception, e:
             import traceback
             traceback.print_exc(e)
@@ -0,0 +1,59 @@
+"""Random 4lang definitions for the differential tests."""
+
+import random
+from StringIO import StringIO
+
+from pymachine.definition_parser import read
+
+BINARIES = ['HAS', 'IS_A', 'EAT', 'HEAL', 'AT']
+AVMS = ['Color', 'Size', 'Shape', 'Age', 'Place']
+
+def random_definition_lines(count=200, seed=1, senses=False, avms=False):
+    """
+    The lines of a definition file with @p count random definitions of the
+    words w0, w1, ...
+    @param senses if @c True, some words have several definitions, and the
+                  headwords are numbered senses ('w3/17'), which the
+                  definitions refer to by their full or ambiguous names.
+    @param avms if @c True, some definitions (and some machines in them) only
+                refer to AVMs ('#Color', '#Size', ...).
+    """
+    rnd = random.Random(seed)
+    words = ['w{0}'.format(i) for i in xrange(count)]
+    heads = list(words)
+    if senses:
+        heads += [rnd.choice(words) for _ in xrange(count // 5)]
+        rnd.shuffle(heads)
+        heads = ['{0}/{1}'.format(word, i) for i, word in enumerate(heads)]
+        words = words + heads
+    lines = []
+    for i, head in enumerate(heads):
+        parts = []
+        for _ in xrange(rnd.randint(1, 4)):
+            a, b = rnd.choice(words), rnd.choice(words)
+            r = rnd.random()
+            if r < 0.3:
+                parts.append(a)
+            elif r < 0.45:
+                parts.append('{0}[{1}]'.format(a, b))
+            elif r < 0.8:
+                parts.append('{0} {1} {2}'.format(a, rnd.choice(BINARIES), b))
+            else:
+                parts.append('[{0}] {1} [{2}]'.format(
+                    head, rnd.choice(BINARIES), b))
+        if avms and rnd.random() < 0.2:
+            avm = '#' + rnd.choice(AVMS)
+            if rnd.random() < 0.5:
+                parts = [avm]
+            else:
+                parts.append('{0}[{1}]'.format(rnd.choice(words), avm))
+        lines.append('{0}\t#\t#\t#\t{1}\t#\tN\t{2}\t'.format(
+            head, i, ', '.join(parts)))
+    return lines
+
+def random_definitions(count=200, seed=1, senses=False, avms=False):
+    """The definitions (printname -> set of machines) of
+    random_definition_lines()."""
+    lines = random_definition_lines(count, seed, senses, avms)
+    return read(StringIO('\n'.join(lines) + '\n'), None, printname_index=0,
+                add_indices=False)
@@ -0,0 +1,51 @@
+"""Compares Lexicon.activate() with the scan of the static graph it replaces,
+on random definitions some of which only refer to AVMs."""
+
+from itertools import chain
+import random
+
+from pymachine.clone import clone_definitions
+from pymachine.lexicon import Lexicon
+from pymachine.machine import Machine
+
+from random_definitions import random_definitions
+
+def scan(lexicon):
+    """The printnames activate() used to activate: the loop of the old
+    activate(), without adding the machines to the active context."""
+    active = lexicon.context.active
+    activated = []
+    for printname, static_machines in lexicon.static.iteritems():
+        for static_machine in static_machines:
+            if printname in active or printname in activated:
+                continue
+            has_machine = False
+            for machine in chain(*static_machine.partitions):
+                has_machine = True
+                if (not unicode(machine).startswith(u'#') and
+                        unicode(machine) not in active):
+                    break
+            else:
+                if has_machine:
+                    activated.append(printname)
+    return sorted(activated)
+
+def test_activate_equals_scan():
+    definitions = random_definitions(senses=True, avms=True)
+    lexicon = Lexicon()
+    lexicon.add_static(clone_definitions(definitions).itervalues())
+    lexicon.finalize_static()
+    rnd = random.Random(0)
+    printnames = sorted(lexicon.static)
+    for _ in xrange(10):
+        lexicon.clear_active()
+        lexicon.add_active([Machine(rnd.choice(printnames))
+                            for _ in xrange(rnd.randint(0, 20))])
+        expected = scan(lexicon)
+        assert expected
+        assert sorted(m.printname() for m in lexicon.activate()) == expected
+        # everything has been activated
+        assert lexicon.activate() == []
+
+if __name__ == "__main__":
+    test_activate_equals_scan()
@@ -0,0 +1,55 @@
+"""Processes words in several active contexts of the same lexicon (see
+pymachine/active_context.py)."""
+
+import cPickle
+
+from pymachine.lexicon import Lexicon
+from pymachine.machine import Machine
+
+from random_definitions import random_definitions
+
+def lazy_lexicon():
+    lexicon = Lexicon(definitions=random_definitions(avms=True))
+    lexicon.finalize_static()
+    return lexicon
+
+def test_active():
+    lexicon = lazy_lexicon()
+    machine = Machine('w3')
+    lexicon.add_active(machine)
+    assert lexicon.active is lexicon.context.active
+    assert 'w3' in lexicon.active
+    lexicon.clear_active()
+    assert 'w3' not in lexicon.active
+
+def test_loads_are_queued_in_every_context():
+    lexicon = lazy_lexicon()
+    contexts = [lexicon.new_context() for _ in xrange(3)]
+    for word in ['w3', 'w17', 'w100']:
+        machine = Machine(word)
+        lexicon.add_active(machine, contexts[0])
+        lexicon.expand(machine, context=contexts[0])
+    assert lexicon.activation_index
+    # the machines indexed while the definitions were loaded in the first
+    # context are activated in the others (and in the lexicon's own) as well
+    for context in contexts[1:] + [None]:
+        activated = lexicon.activate(context)
+        assert (sorted(set(m.printname() for m in activated)) ==
+                sorted(lexicon.activation_index))
+
+def test_pickle():
+    lexicon = lazy_lexicon()
+    lexicon.add_active(Machine('w3'))
+    loaded = cPickle.loads(cPickle.dumps(lexicon, 2))
+    assert 'w3' in loaded.active
+    context = loaded.new_context()
+    machine = Machine('w17')
+    loaded.add_active(machine, context)
+    loaded.expand(machine, context=context)
+    assert 'w17' in context.active
+    assert 'w17' not in loaded.active
+
+if __name__ == "__main__":
+    test_active()
+    test_loads_are_queued_in_every_context()
+    test_pickle()
@@ -0,0 +1,36 @@
+"""Saves a lexicon with its definitions and extra state as a bundle (see
+pymachine/snapshot.py), loads it with load_bundle(), and compares it with the
+original."""
+
+import os
+import shutil
+import tempfile
+
+from pymachine.snapshot import save_snapshot, load_bundle
+
+from random_definitions import random_definitions
+from test_snapshot import build, graph
+
+def test_bundle():
+    directory = tempfile.mkdtemp()
+    try:
+        definitions = random_definitions(senses=True)
+        lexicon = build(definitions)
+        path = os.path.join(directory, 'bundle')
+        save_snapshot(lexicon, path, definitions=definitions,
+                      bundle={'answer': 42})
+        loaded, loaded_definitions, bundle = load_bundle(path)
+        assert graph(loaded.static) == graph(lexicon.static)
+        assert loaded.static_disambig == dict(lexicon.static_disambig)
+        assert bundle == {'answer': 42}
+        assert sorted(loaded_definitions) == sorted(definitions)
+        for printname in ['w3', 'w17']:
+            assert (sorted(graph({printname: [m]})
+                           for m in loaded_definitions[printname]) ==
+                    sorted(graph({printname: [m]})
+                           for m in definitions[printname]))
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    test_bundle()
@@ -0,0 +1,133 @@
+"""Compares definition_grammar.parse_definition() (DefinitionParser.parse())
+with the pyparsing grammar it replaces (DefinitionParser.parse_pyparsing())
+on random definitions, about half of them malformed."""
+
+import random
+
+import pyparsing
+
+from pymachine.definition_grammar import DefinitionSyntaxError
+from pymachine.definition_parser import DefinitionParser
+
+UNARIES = ['dog', 'w1', '-x', '_', '12', 'a/3', 'b/', 'x_y', '=AGT', '= PAT',
+           '$HUN_X', '#Avm', '@Ext-1', '<cat>', '< dog >']
+BINARIES = ['HAS', 'IS_A', 'AT/2', '12', '_', '=REL', '= REL', 'A1']
+TOKENS = ['dog', 'HAS', '[', ']', '(', ')', '<', '>', ',', ';', "'", '=',
+          'AGT', 'REL', '12', ' ', '/', '3', '-', '$', '#', '@', 'a', '\t',
+          'x/', 'IS_A']
+
+class DefinitionGenerator(object):
+    """Random definitions following the grammar in definition_grammar.py,
+    and random mutations of them."""
+    def __init__(self, seed):
+        self.rnd = random.Random(seed)
+
+    def definition(self, depth=0):
+        return ', '.join(self.expression(depth + 1)
+                         for _ in xrange(self.rnd.choice([1, 1, 2, 3])))
+
+    def expression(self, depth):
+        r = self.rnd.random()
+        if depth > 3 or r < 0.4:
+            return self.unary_expression(depth)
+        if r < 0.8:
+            return self.binary_expression(depth)
+        if r < 0.9:
+            return '{0}({1})'.format(self.unary(depth),
+                                     self.expression(depth + 1))
+        return '<{0}>'.format(self.expression(depth + 1))
+
+    def binary_expression(self, depth):
+        r = self.rnd.random()
+        binary = self.rnd.choice(BINARIES)
+        if r < 0.2:
+            return '{0} {1}'.format(self.argument(depth + 1), binary)
+        if r < 0.4:
+            return '{0} {1}'.format(binary, self.argument(depth + 1))
+        if r < 0.8:
+            return '{0} {1} {2}'.format(self.argument(depth + 1), binary,
+                                        self.argument(depth + 1))
+        return '{0}[{1}; {2}]'.format(binary, self.expression(depth + 1),
+                                      self.expression(depth + 1))
+
+    def unary_expression(self, depth):
+        r = self.rnd.random()
+        if depth > 3 or r < 0.6:
+            return self.unary(depth)
+        if r < 0.8:
+            return '{0}[{1}]'.format(self.unary(depth),
+                                     self.definition(depth + 1))
+        return '{0}({1})'.format(self.unary(depth), self.unary(depth))
+
+    def argument(self, depth):
+        r = self.rnd.random()
+        if depth > 3 or r < 0.6:
+            return self.unary_expression(depth)
+        if r < 0.8:
+            return '[{0}]'.format(self.definition(depth + 1))
+        if r < 0.9:
+            return '<{0}>'.format(self.argument(depth + 1))
+        return "'"
+
+    def unary(self, depth):
+        if depth > 2 or self.rnd.random() < 0.8:
+            return self.rnd.choice(UNARIES)
+        return '<{0}>'.format(self.unary(depth + 1))
+
+    def mutation(self, text):
+        """@p text with a few tokens inserted or characters deleted."""
+        chars = list(text)
+        for _ in xrange(self.rnd.randint(1, 3)):
+            i = self.rnd.randrange(len(chars) + 1)
+            if chars and i < len(chars) and self.rnd.random() < 0.5:
+                del chars[i]
+            else:
+                chars.insert(i, self.rnd.choice(TOKENS))
+        return ''.join(chars)
+
+    def soup(self):
+        """A random sequence of tokens."""
+        return ''.join(self.rnd.choice(TOKENS) + self.rnd.choice(['', ' '])
+                       for _ in xrange(self.rnd.randint(1, 10)))
+
+    def sample(self):
+        r = self.rnd.random()
+        if r < 0.5:
+            return self.definition()
+        if r < 0.75:
+            return self.soup()
+        return self.mutation(self.definition())
+
+def parse_both(parser, text):
+    """The results of the two parsers on @p text (@c None on a syntax
+    error)."""
+    try:
+        new = repr(parser.parse(text))
+    except DefinitionSyntaxError:
+        new = None
+    try:
+        old = repr(parser.parse_pyparsing(text))
+    except pyparsing.ParseException:
+        old = None
+    return new, old
+
+def test_parse_equals_pyparsing():
+    generator = DefinitionGenerator(0)
+    parser = DefinitionParser({})
+    parsed = 0
+    for _ in xrange(200):
+        text = generator.sample()
+        new, old = parse_both(parser, text)
+        assert new == old, text
+        parsed += new is not None
+    # both valid and malformed definitions have been compared
+    assert 0 < parsed < 200
+
+def test_parse_errors():
+    parser = DefinitionParser({})
+    for text in ['', 'dog,', 'HAS[dog', '<dog', 'dog HAS HAS dog']:
+        assert parse_both(parser, text) == (None, None), text
+
+if __name__ == "__main__":
+    test_parse_equals_pyparsing()
+    test_parse_errors()
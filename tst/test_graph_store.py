@@ -0,0 +1,43 @@
+"""Freezes lexicons (see pymachine/graph_store.py) and compares their static
+graphs with the originals."""
+
+from pymachine.clone import clone_definitions
+from pymachine.lexicon import Lexicon
+
+from random_definitions import random_definitions
+
+def build(definitions):
+    lexicon = Lexicon()
+    lexicon.add_static(clone_definitions(definitions).itervalues())
+    lexicon.finalize_static()
+    return lexicon
+
+def describe(machine):
+    """The printnames of the partitions and parents of @p machine."""
+    return ([[m.printname() for m in part] for part in machine.partitions],
+            sorted((m.printname(), i) for m, i in machine.parents))
+
+def test_frozen_graph():
+    definitions = random_definitions(senses=True)
+    lexicon, frozen = build(definitions), build(definitions)
+    frozen.freeze()
+    assert sorted(frozen.static) == sorted(lexicon.static)
+    for printname, machines in lexicon.static.iteritems():
+        assert ([describe(m) for m in frozen.static[printname]] ==
+                [describe(m) for m in machines])
+
+def test_views_are_lazy():
+    lexicon = build(random_definitions())
+    lexicon.freeze()
+    store = lexicon.graph_store
+    assert all(view is None for view in store._views)
+    entry = lexicon.static['w3']
+    # only the machines of the entry looked up have views
+    assert sum(view is not None for view in store._views) == len(entry)
+    machine = entry[0]
+    assert machine.partitions is machine.partitions
+    assert machine.parents is machine.parents
+
+if __name__ == "__main__":
+    test_frozen_graph()
+    test_views_are_lazy()
@@ -0,0 +1,89 @@
+"""Changes the definitions of a finalized lexicon with
+Lexicon.replace_definitions() and retract_definitions(), and compares the
+static graph, the disambiguation table and the activation index with those
+of a lexicon built from scratch from the changed definitions."""
+
+import random
+
+from pymachine.clone import clone_definitions
+from pymachine.lexicon import Lexicon
+
+from random_definitions import random_definitions
+
+def build(definitions):
+    lexicon = Lexicon()
+    lexicon.add_static(clone_definitions(definitions).itervalues())
+    lexicon.finalize_static()
+    return lexicon
+
+def describe(static, machine, depth=0):
+    """
+    A static machine: its printname if it is canonical, and (up to a depth)
+    its partitions otherwise, as sets: the order of the non-canonical
+    machines and of the edges depends on the order the definitions were
+    added in.
+    """
+    if static.get(machine.printname(), [None])[0] is machine:
+        return machine.printname()
+    if depth > 6:
+        return ('nc', machine.printname())
+    return ('nc', machine.printname(), partitions(static, machine, depth + 1))
+
+def partitions(static, machine, depth=0):
+    parts = [tuple(sorted(describe(static, child, depth)
+                          for child in partition))
+             for partition in machine.partitions]
+    while parts and not parts[-1]:
+        parts.pop()
+    return tuple(parts)
+
+def static_graph(lexicon):
+    """The static entries of @p lexicon: the partitions of the canonical
+    machine and the other machines of each printname."""
+    static = lexicon.static
+    return dict((printname, (partitions(static, machines[0]),
+                             sorted(describe(static, m)
+                                    for m in machines[1:])))
+                for printname, machines in static.iteritems())
+
+def activation_index(lexicon):
+    """The static machines in the activation index of @p lexicon, by
+    printname."""
+    static = lexicon.static
+    return dict((printname, sorted(describe(static, static[printname][i])
+                                   for i in indices))
+                for printname, indices in
+                lexicon.activation_index.iteritems())
+
+def check_updates(seed, senses):
+    definitions = random_definitions(seed=seed, senses=senses, avms=True)
+    updates = random_definitions(seed=seed + 100, senses=senses, avms=True)
+    lexicon = build(definitions)
+    lexicon.activate()
+    target = dict(definitions)
+    rnd = random.Random(seed)
+    printnames = sorted(set(definitions) | set(updates))
+    for _ in xrange(60):
+        printname = rnd.choice(printnames)
+        if rnd.random() < 0.3:
+            lexicon.retract_definitions(printname)
+            target.pop(printname, None)
+        elif printname in updates:
+            lexicon.replace_definitions(printname, updates[printname])
+            target[printname] = updates[printname]
+    rebuilt = build(target)
+    assert static_graph(lexicon) == static_graph(rebuilt)
+    assert dict(lexicon.static_disambig) == dict(rebuilt.static_disambig)
+    assert activation_index(lexicon) == activation_index(rebuilt)
+
+def test_updates_equal_rebuild():
+    for seed in xrange(3):
+        check_updates(seed, False)
+
+def test_updates_equal_rebuild_with_senses():
+    for seed in xrange(3):
+        check_updates(seed, True)
+
+if __name__ == "__main__":
+    test_updates_equal_rebuild()
+    test_updates_equal_rebuild_with_senses()
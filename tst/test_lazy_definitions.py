@@ -0,0 +1,73 @@
+"""Expands every word of lexicons whose definitions are loaded on first use
+(see Lexicon.load_definitions()) and compares the active graphs with those of
+a lexicon built from all definitions up front."""
+
+import os
+import shutil
+import tempfile
+
+from pymachine.clone import clone_definitions
+from pymachine.definition_store import DefinitionStore, write_definition_index
+from pymachine.lexicon import Lexicon
+from pymachine.machine import Machine
+
+from random_definitions import random_definitions
+
+def eager_lexicon(definitions):
+    lexicon = Lexicon()
+    lexicon.add_static(clone_definitions(definitions).itervalues())
+    lexicon.finalize_static()
+    return lexicon
+
+def lazy_lexicon(definitions):
+    lexicon = Lexicon(definitions=definitions)
+    lexicon.finalize_static()
+    return lexicon
+
+def expansion(lexicon, word):
+    """
+    The active machines after expanding @p word in a new context, by
+    printname. The machines are described by their printnames and the
+    printnames of their partitions, as sets: the order of the non-canonical
+    machines depends on the order the definitions were loaded in.
+    """
+    context = lexicon.new_context()
+    machine = Machine(word)
+    lexicon.add_active(machine, context)
+    lexicon.expand(machine, context=context)
+    active = context.active
+    return dict((printname, sorted(
+                    (m.printname(), sorted(sorted(c.printname() for c in part)
+                                           for part in m.partitions))
+                    for m in active[printname]))
+                for printname in active)
+
+def check_expansions(definitions, lazy_definitions):
+    eager = eager_lexicon(definitions)
+    lazy = lazy_lexicon(lazy_definitions)
+    for word in sorted(definitions):
+        assert expansion(lazy, word) == expansion(eager, word), word
+
+def test_lazy_equals_eager():
+    for seed in (1, 3):
+        definitions = random_definitions(seed=seed)
+        check_expansions(definitions, definitions)
+
+def test_lazy_equals_eager_with_senses():
+    definitions = random_definitions(seed=3, senses=True)
+    check_expansions(definitions, definitions)
+
+def test_definition_store():
+    directory = tempfile.mkdtemp()
+    try:
+        definitions = random_definitions(seed=3)
+        path = os.path.join(directory, 'definitions.defs')
+        write_definition_index(definitions, path)
+        check_expansions(definitions, DefinitionStore([path]))
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    test_lazy_equals_eager()
+    test_lazy_equals_eager_with_senses()
+    test_definition_store()
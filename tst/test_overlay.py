@@ -0,0 +1,64 @@
+"""Compares the active graphs of overlay mode with those of the eager
+expansion (see pymachine/overlay.py)."""
+
+import random
+
+from pymachine.lexicon import Lexicon
+from pymachine.machine import Machine
+from pymachine.overlay import OverlayMachine
+
+from random_definitions import random_definitions
+
+def active_graph(lexicon):
+    """The partitions (in order) and parents (as a set) of the active
+    machines of @p lexicon, by printname."""
+    active = lexicon.context.active
+    graph = {}
+    for printname in active:
+        for machine in active[printname]:
+            graph.setdefault(printname, []).append((
+                [[m.printname() for m in part] for part in machine.partitions],
+                sorted((m.printname(), i) for m, i in machine.parents)))
+    # (the machines of a printname are not ordered)
+    return dict((pn, sorted(descs)) for pn, descs in graph.iteritems())
+
+def expand_words(overlay, sentences):
+    """The active graphs after expanding the words of each of @p sentences
+    (lists of words)."""
+    definitions = random_definitions()
+    lexicon = Lexicon(overlay=overlay)
+    lexicon.add_static(d for pn in sorted(definitions)
+                       for d in definitions[pn])
+    graphs = []
+    for sentence in sentences:
+        lexicon.clear_active()
+        machines = [Machine(word) for word in sentence]
+        lexicon.add_active(machines)
+        for machine in machines:
+            lexicon.expand(machine)
+        graphs.append(active_graph(lexicon))
+    return graphs
+
+def test_overlay_equals_expand():
+    rnd = random.Random(2)
+    sentences = [['w{0}'.format(rnd.randrange(200))
+                  for _ in xrange(rnd.randint(1, 5))] for _ in xrange(30)]
+    assert expand_words(True, sentences) == expand_words(False, sentences)
+
+def test_overlay_is_lazy():
+    definitions = random_definitions()
+    lexicon = Lexicon(overlay=True)
+    lexicon.add_static(d for pn in sorted(definitions)
+                       for d in definitions[pn])
+    machine = Machine('w3')
+    lexicon.add_active(machine)
+    lexicon.expand(machine)
+    active = lexicon.context.active
+    overlays = [m for pn in active for m in active[pn]
+                if isinstance(m, OverlayMachine)]
+    assert overlays
+    assert not all(m.materialized() for m in overlays)
+
+if __name__ == "__main__":
+    test_overlay_equals_expand()
+    test_overlay_is_lazy()
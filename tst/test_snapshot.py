@@ -0,0 +1,113 @@
+"""Saves lexicons and definitions as snapshots (see pymachine/snapshot.py),
+loads them, and compares them with the originals."""
+
+import os
+import shutil
+import tempfile
+
+from pymachine.clone import clone_definitions
+from pymachine.lexicon import Lexicon
+from pymachine.machine import Machine
+from pymachine.snapshot import (save_snapshot, load_snapshot,
+                                save_definitions, load_definitions)
+
+from random_definitions import random_definitions
+
+def graph(roots):
+    """
+    The machines reachable from @p roots (a printname -> machines dict),
+    numbered in breadth-first order from the roots in the order of their
+    printnames, with their printnames, partitions, parents and control
+    types.
+    """
+    index, machines = {}, []
+
+    def number(machine):
+        if machine not in index:
+            index[machine] = len(machines)
+            machines.append(machine)
+        return index[machine]
+
+    entries = [(printname, [number(m) for m in roots[printname]])
+               for printname in sorted(roots)]
+    for machine in machines:
+        for partition in machine.partitions:
+            for child in partition:
+                number(child)
+    return entries, [
+        (m.printname(),
+         [[index[child] for child in partition]
+          for partition in m.partitions],
+         sorted((index[parent], part_i) for parent, part_i in m.parents),
+         type(m.control).__name__)
+        for m in machines]
+
+def build(definitions):
+    lexicon = Lexicon()
+    lexicon.add_static(clone_definitions(definitions).itervalues())
+    lexicon.finalize_static()
+    return lexicon
+
+def expansion(lexicon, words):
+    """The active graph after expanding @p words in @p lexicon."""
+    lexicon.clear_active()
+    for word in words:
+        machine = Machine(word)
+        lexicon.add_active(machine)
+        lexicon.expand(machine)
+    active = lexicon.context.active
+    return graph(dict((printname, sorted(active[printname],
+                                         key=lambda m: m.printname()))
+                      for printname in active))
+
+def check_with_directory(test):
+    """Calls @p test with the path of a new temporary directory."""
+    directory = tempfile.mkdtemp()
+    try:
+        test(directory)
+    finally:
+        shutil.rmtree(directory)
+
+def test_lexicon():
+    def test(directory):
+        lexicon = build(random_definitions(senses=True))
+        path = os.path.join(directory, 'lexicon')
+        save_snapshot(lexicon, path)
+        loaded = load_snapshot(path)
+        assert graph(loaded.static) == graph(lexicon.static)
+        assert loaded.static_disambig == dict(lexicon.static_disambig)
+        words = ['w3', 'w17', 'w100']
+        assert expansion(loaded, words) == expansion(lexicon, words)
+    check_with_directory(test)
+
+def test_frozen_lexicon():
+    def test(directory):
+        lexicon = build(random_definitions(senses=True))
+        lexicon.freeze()
+        # a word added after freeze() is saved as well
+        lexicon.get_machine('brandnew')
+        path = os.path.join(directory, 'frozen')
+        save_snapshot(lexicon, path)
+        loaded = load_snapshot(path)
+        assert graph(loaded.static) == graph(lexicon.static)
+        assert 'brandnew' in loaded.static
+    check_with_directory(test)
+
+def test_definitions():
+    def test(directory):
+        definitions = random_definitions(senses=True)
+        path = os.path.join(directory, 'definitions')
+        save_definitions(definitions, path)
+        loaded = load_definitions(path)
+        assert sorted(loaded) == sorted(definitions)
+        # each definition separately, as their machines are not ordered
+        for printname, machines in definitions.iteritems():
+            assert (sorted(graph({printname: [m]}) for m in machines) ==
+                    sorted(graph({printname: [m]})
+                           for m in loaded[printname]))
+    check_with_directory(test)
+
+if __name__ == "__main__":
+    test_lexicon()
+    test_frozen_lexicon()
+    test_definitions()
@@ -0,0 +1,98 @@
+"""Compares DefinitionParser.unify() with unify_by_keys(), the one group at a
+time unification it replaces, on random definitions with many repeated
+words."""
+
+import random
+
+from pymachine.definition_grammar import DefinitionSyntaxError
+from pymachine.definition_parser import DefinitionParser
+
+PLURALS = {'dogs': 'dog', 'w3s': 'w3'}
+
+class UnunifiedParser(DefinitionParser):
+    """Leaves the machines it parses as they are."""
+    def unify(self, machine):
+        pass
+
+def random_line(rnd, line_no):
+    """A random definition line, with a small vocabulary so that the same
+    words occur several times."""
+    words = ['w{0}'.format(i) for i in xrange(rnd.choice([2, 3, 5, 10]))]
+    words += ['other', 'dog', 'dogs', 'w1/2', '=AGT', '=PAT', '@foo', '$HUN']
+    binaries = ['HAS', 'IS_A', 'EAT', 'AT']
+
+    def unary(depth):
+        word = rnd.choice(words)
+        r = rnd.random()
+        if depth > 3 or r < 0.4:
+            return word
+        if r < 0.7:
+            return '{0}[{1}]'.format(word, definition(depth + 1))
+        return '{0}({1})'.format(word, rnd.choice(words[:2]))
+
+    def argument(depth):
+        if rnd.random() < 0.8:
+            return unary(depth)
+        return '[{0}]'.format(definition(depth + 1))
+
+    def expression(depth):
+        r = rnd.random()
+        if r < 0.4:
+            return unary(depth)
+        if r < 0.6:
+            return '{0} {1} {2}'.format(argument(depth),
+                                        rnd.choice(binaries), argument(depth))
+        if r < 0.7:
+            return '{0} {1}'.format(argument(depth), rnd.choice(binaries))
+        if r < 0.8:
+            return '{0} {1}'.format(rnd.choice(binaries), argument(depth))
+        return '{0}({1})'.format(rnd.choice(words), expression(depth + 1))
+
+    def definition(depth):
+        return ', '.join(expression(depth) for _ in
+                         xrange(rnd.randint(1, 4 if depth < 2 else 2)))
+
+    head = rnd.choice(['w0', 'w1', 'dog', 'other'])
+    return '{0}\t#\t#\t#\t{1}\t#\tN\t{2}\t'.format(head, line_no,
+                                                   definition(0))
+
+def structure(machine):
+    """The printnames, partitions and parent links of the machines of the
+    definition @p machine, the machines numbered in breadth-first order."""
+    index = {machine: 0}
+    machines = [machine]
+    for m in machines:
+        for partition in m.partitions:
+            for m_ in partition:
+                if m_ not in index:
+                    index[m_] = len(machines)
+                    machines.append(m_)
+    return [(m.printname(),
+             [[index[m_] for m_ in partition] for partition in m.partitions],
+             sorted((index.get(parent, -1), part_i)
+                    for parent, part_i in m.parents))
+            for m in machines]
+
+def test_unify_equals_unify_by_keys():
+    rnd = random.Random(7)
+    parser = UnunifiedParser(PLURALS)
+    unifier = DefinitionParser(PLURALS)
+    compared = 0
+    for line_no in xrange(500):
+        line = random_line(rnd, line_no)
+        for kwargs in ({}, {'add_indices': True},
+                       {'loop_to_defendum': False}, {'three_parts': True}):
+            try:
+                by_groups = parser.parse_into_machines(line, **kwargs)
+            except DefinitionSyntaxError:
+                # (the generator does not always follow the grammar)
+                break
+            by_keys = parser.parse_into_machines(line, **kwargs)
+            unifier.unify(by_groups)
+            unifier.unify_by_keys(by_keys)
+            assert structure(by_groups) == structure(by_keys), (line, kwargs)
+            compared += 1
+    assert compared > 1000
+
+if __name__ == "__main__":
+    test_unify_equals_unify_by_keys()